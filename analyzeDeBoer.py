@@ -0,0 +1,196 @@
+'''
+analysis of deboer.py output: the vowel system each run ends up with,
+as counted by hand for figure 5 of de boer (2000).
+
+each run's final snapshot is read from a .csv or .npz output file in
+chunks (deboer.readSnapshots), keeping only the latest snapshot of
+each run seen so far, so that files of 10^4 runs and more fit in
+memory.  all agents' vowel prototypes are then clustered in
+perceptual space (F1 in bark, F2'; deboer.clusterPrototypes), and the
+clusters with a vowel of at least --minShare of the agents are taken
+as the vowels of the run's system.  each is labelled (in X-SAMPA) with
+one of a set of cardinal vowels, the closest one not taken by a
+vowel closer to it, which gives the system's shape: its vowels, and
+how many are front, central and back.
+
+print the distribution of number of vowels and the most common
+systems over runs, and write one row per run to systems.csv:
+> python deboer.py --nAgents 20 --nIts 5000 --storeIvl 5000 --nRuns 500 --ensemble --seed 1 runs.csv
+> python analyzeDeBoer.py --out systems.csv runs.csv
+
+'''
+
+import argparse, csv, sys
+import numpy as np
+
+import deboer
+
+
+## cardinal vowels: X-SAMPA label, articulation ([height, backness,
+## rounding]) and place (0: front, 1: central, 2: back)
+cardinals = [('i', [1, 0, 0], 0), ('y', [1, 0, 1], 0), ('e', [0.5, 0, 0], 0), ('E', [0.25, 0, 0], 0), ('{', [0, 0, 0], 0),
+             ('1', [1, 0.5, 0], 1), ('@', [0.5, 0.5, 0], 1), ('a', [0, 0.5, 0], 1),
+             ('M', [1, 1, 0], 2), ('u', [1, 1, 1], 2), ('o', [0.5, 1, 1], 2), ('O', [0.25, 1, 1], 2), ('A', [0, 1, 0], 2)]
+cardinalLabels = [c[0] for c in cardinals]
+cardinalPercepts = deboer.percepts(deboer.calFormFreqs(np.array([c[1] for c in cardinals], dtype=float)))
+cardinalPlaces = np.array([c[2] for c in cardinals])
+
+runColumns = ['run', 'time', 'agents', 'meanSize', 'vowels', 'strays', 'front', 'central', 'back', 'shape', 'system']
+
+
+## final states of runs, gathered while streaming over chunks of
+## snapshot rows (as from deboer.readSnapshots): for each run, the agent
+## numbers and perceptual coordinates of the vowels of its latest
+## snapshot seen so far.  chunks can hold runs and times in any order
+## (run by run as from the per-run loop, or time by time as from the
+## ensemble), and a snapshot can be split over chunks.
+class FinalStates(object):
+    def __init__(self):
+        self.times = {}
+        self.parts = {}
+
+    def add(self, chunk):
+        run, time = chunk['run'], chunk['time']
+        if not len(run):
+            return
+        order = np.lexsort((time, run))
+        run, time = run[order], time[order]
+        ## only each run's rows at its latest time in the chunk
+        last = np.r_[run[1:] != run[:-1], True]
+        ends = np.flatnonzero(last) + 1
+        keep = time == np.repeat(time[last], np.diff(np.r_[0, ends]))
+        order, run, time = order[keep], run[keep], time[keep]
+        agent = chunk['agent'][order]
+        perc = np.column_stack([deboer.barks(chunk['F1'][order]), chunk['F2prime'][order]])
+        bounds = np.r_[0, np.flatnonzero(run[1:] != run[:-1]) + 1, len(run)]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            r, t = int(run[start]), int(time[start])
+            if r not in self.times or t > self.times[r]:
+                self.times[r] = t
+                self.parts[r] = []
+            if t == self.times[r]:
+                self.parts[r].append((agent[start:end], perc[start:end]))
+
+    ## (run, time, agent numbers, perceptual coordinates) of each run's
+    ## final snapshot, in order of runs; each run's rows are let go of
+    ## once given
+    def runs(self):
+        for r in sorted(self.times):
+            parts = self.parts.pop(r)
+            yield r, self.times[r], np.concatenate([a for a, p in parts]), np.concatenate([p for a, p in parts])
+
+
+## classify the vowel system of a population, from the agent numbers
+## agent and perceptual coordinates perc (n, 2) of all its agents'
+## vowels: prototypes are clustered (deboer.clusterPrototypes, clusters
+## radius apart in perceptual distance with weighting L), and the
+## clusters with a vowel of at least minShare of the agents (with any
+## vowels) are the system's vowels, the rest strays.  the system's
+## vowels are labelled with cardinal vowels (see assignCardinals), in
+## the order of cardinals.
+##
+## output: dict of the columns of runColumns but run and time
+def classify(agent, perc, radius=1.0, L=0.3, minShare=0.5):
+    labels, centroids = deboer.clusterPrototypes(perc, radius, L)
+    agents, ag = np.unique(agent, return_inverse=True)
+    nAgents = len(agents)
+    ## number of agents with a vowel in each cluster
+    members = np.unique(labels*nAgents + ag)//nAgents
+    share = np.bincount(members, minlength=len(centroids))/float(nAgents)
+    shared = share >= minShare
+    assigned = np.sort(assignCardinals(deboer.perceptualDistances(centroids[shared][:, None], cardinalPercepts[None], L)))
+    places = np.bincount(cardinalPlaces[assigned], minlength=3)
+    return {'agents': nAgents, 'meanSize': len(agent)/float(nAgents),
+            'vowels': int(shared.sum()), 'strays': int((~shared).sum()),
+            'front': places[0], 'central': places[1], 'back': places[2],
+            'shape': '%d/%d/%d' % tuple(places),
+            'system': ' '.join(cardinalLabels[c] for c in assigned)}
+
+## label vowels with cardinal vowels, one-to-one, from their distances
+## dist (vowels, cardinals): greedily, the closest (vowel, cardinal)
+## pair not yet labelled first, so two vowels near the same cardinal
+## get it and its next nearest free one.  with more vowels than
+## cardinals, the vowels left over are labelled with their nearest
+## cardinals, which then appear twice.
+##
+## output: array of the cardinal of each vowel
+def assignCardinals(dist):
+    nVowels, nCardinals = dist.shape
+    assigned = dist.argmin(axis=1) if nVowels else np.zeros(0, dtype=int)
+    free = np.ones(nCardinals, dtype=bool)
+    todo = np.ones(nVowels, dtype=bool)
+    for pair in dist.ravel().argsort(kind='mergesort').tolist():
+        v, c = divmod(pair, nCardinals)
+        if todo[v] and free[c]:
+            assigned[v] = c
+            todo[v] = free[c] = False
+            if not todo.any() or not free.any():
+                break
+    return assigned
+
+## classify the final vowel system of every run in source: an output
+## file (.csv or .npz) of deboer.py, read chunkRows rows at a time, or
+## results (a dict of column arrays) as from deboer.game
+##
+## output: list of dicts of runColumns, one per run, in order of runs
+def analyze(source, radius=1.0, L=0.3, minShare=0.5, chunkRows=100000):
+    final = FinalStates()
+    for chunk in ([source] if isinstance(source, dict) else deboer.readSnapshots(source, chunkRows)):
+        final.add(chunk)
+    rows = []
+    for run, time, agent, perc in final.runs():
+        row = classify(agent, perc, radius, L, minShare)
+        row.update(run=run, time=time)
+        rows.append(row)
+    return rows
+
+## distribution of column name (e.g. 'vowels' or 'system') over runs
+##
+## output: list of (value, number of runs), most common first (ties in
+## order of value)
+def tally(rows, name):
+    counts = {}
+    for row in rows:
+        counts[row[name]] = counts.get(row[name], 0) + 1
+    return sorted(counts.items(), key=lambda vc: (-vc[1], vc[0]))
+
+def writeRuns(rows, fileName):
+    with open(fileName, 'wb') as f:
+        w = csv.writer(f)
+        w.writerow(runColumns)
+        for row in rows:
+            w.writerow(['%.4f' % row[c] if c == 'meanSize' else row[c] for c in runColumns])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = 'classify the final vowel systems of the runs in a deboer.py output file')
+    parser.add_argument('fileName', help = '.csv or .npz file written by deboer.py')
+    parser.add_argument('--out', default=None, help = '.csv file to write one row per run to (default: none)')
+    parser.add_argument('--radius', type=float, default=1.0, help = 'perceptual distance apart of clusters of prototypes (default: %(default)s)')
+    parser.add_argument('--L', type=float, default=0.3, help = 'weighting of F2prime vs F1 in perceptual distance, as the simulation\'s --L (default: %(default)s)')
+    parser.add_argument('--minShare', type=float, default=0.5, help = 'fraction of agents with a vowel in a cluster for it to count as a vowel of the system (default: %(default)s)')
+    parser.add_argument('--chunkRows', type=int, default=100000, help = 'number of rows of the file to read at a time (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=10, help = 'number of most common systems to print (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    rows = analyze(args.fileName, args.radius, args.L, args.minShare, args.chunkRows)
+    if args.out:
+        writeRuns(rows, args.out)
+    if not rows:
+        print "no snapshots in %s" % args.fileName
+        return 1
+
+    n = float(len(rows))
+    print "%d runs" % len(rows)
+    print
+    print "%-8s %8s %8s" % ('vowels', 'runs', '%')
+    for vowels, count in sorted(tally(rows, 'vowels')):
+        print "%-8d %8d %8.1f" % (vowels, count, 100*count/n)
+    print
+    print "%-24s %-8s %8s %8s" % ('system', 'shape', 'runs', '%')
+    shapes = dict((row['system'], row['shape']) for row in rows)
+    for system, count in tally(rows, 'system')[:args.top]:
+        print "%-24s %-8s %8d %8.1f" % (system or '-', shapes[system], count, 100*count/n)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
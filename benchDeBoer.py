@@ -0,0 +1,298 @@
+'''
+benchmarks for deboer.py: microbenchmarks of the functions the
+simulation spends its time in, and end-to-end runs of the game at the
+configurations in simDeBoer.sh and with 10^4 agents (interactions/s,
+and memory per agent).
+
+all benchmarks use fixed seeds.  results are printed, and written as
+JSON with --out; --compare checks them against results stored earlier
+and flags regressions.
+
+run all benchmarks, store results:
+> python benchDeBoer.py --out baseline.json
+
+after changing deboer.py, check for regressions (exit status 1 if any):
+> python benchDeBoer.py --compare baseline.json
+
+'''
+
+import argparse, json, os, platform, random, sys, tempfile, time
+import numpy as np
+
+import deboer
+
+
+## time fn(), called number times, best of repeat tries.
+##
+## if setup is given, setup() is called before each call of fn (to
+## make fresh state, e.g. an inventory for merge to change), and only
+## fn's time is counted; fn is then called with setup's result.
+##
+## output: seconds per call
+def timeCall(fn, setup=None, number=1000, repeat=3):
+    best = float('inf')
+    for i in range(repeat):
+        if setup is None:
+            start = time.time()
+            for j in range(number):
+                fn()
+            elapsed = time.time() - start
+        else:
+            elapsed = 0.0
+            for j in range(number):
+                state = setup()
+                start = time.time()
+                fn(state)
+                elapsed += time.time() - start
+        best = min(best, elapsed)
+    return best/number
+
+## an agent of simulation sim with (about) nVowels random vowels,
+## after merging those too close (as in the game)
+def makeAgent(sim, nVowels, seed):
+    sim.rng = deboer.RandomStream(seed, sim.nAgents, sim.noise)
+    ag = deboer.Agent('1', sim)
+    for i in range(nVowels):
+        ag.addRandomVowel()
+    ag.merge()
+    return ag
+
+## an agent of simulation sim with nVowels random vowels, not merged
+def makeUnmergedAgent(sim, nVowels, seed):
+    sim.rng = deboer.RandomStream(seed, sim.nAgents, sim.noise)
+    ag = deboer.Agent('1', sim)
+    for i in range(nVowels):
+        ag.addRandomVowel()
+    return ag
+
+## random signals (formants of random articulations, with noise)
+def makeSignals(sim, n, seed):
+    rng = sim.rng = deboer.RandomStream(seed, sim.nAgents, sim.noise)
+    signals = []
+    for i in range(n):
+        v = deboer.Vowel(sim)
+        v.setArt([rng.random(), rng.random(), rng.random()])
+        signals.append(v.production())
+    return signals
+
+
+## microbenchmarks: name -> function of (number of calls) giving
+## seconds per call, best of repeat tries
+def microBenchmarks(seed, repeat):
+    sim = deboer.Simulation(seed=seed)
+    uncached = deboer.Simulation(seed=seed, noSynthCache=True)
+    random.seed(seed)
+    arts = [[random.random(), random.random(), random.random()] for i in range(100)]
+    forms = [deboer.calFormFreq(a) for a in arts]
+    signals = makeSignals(sim, 100, seed)
+    agent = makeAgent(sim, 10, seed)
+    formArray, signalArray = np.array(forms), np.array(signals)
+
+    def cycle(xs):
+        it = [0]
+        def next():
+            it[0] = (it[0] + 1) % len(xs)
+            return xs[it[0]]
+        return next
+
+    nextArt, nextForm, nextSignal = cycle(arts), cycle(forms), cycle(signals)
+
+    def shift(state):
+        v, A = state
+        v.shiftCloser(A)
+
+    def shiftSetup():
+        v = deboer.Vowel(sim)
+        v.setArt(nextArt())
+        return v, nextSignal()
+
+    def mergeSetup():
+        return makeUnmergedAgent(sim, 12, seed)
+
+    return [
+        ('calFormFreq', lambda n: timeCall(lambda: deboer.calFormFreq(nextArt()), number=n, repeat=repeat)),
+        ('bark', lambda n: timeCall(lambda: deboer.bark(nextForm()[1]), number=n, repeat=repeat)),
+        ('F2prime', lambda n: timeCall(lambda: deboer.F2prime(nextForm()), number=n, repeat=repeat)),
+        ('acousticDistance', lambda n: timeCall(lambda: deboer.acousticDistance(nextForm(), nextSignal()), number=n, repeat=repeat)),
+        ('percepts (100 signals)', lambda n: timeCall(lambda: deboer.percepts(signalArray), number=max(n/10, 5), repeat=repeat)),
+        ('acousticDistances (100 x 100)', lambda n: timeCall(lambda: deboer.acousticDistances(formArray, signalArray), number=max(n/10, 5), repeat=repeat)),
+        ('RandomStream.pair', lambda n: timeCall(sim.rng.pair, number=n, repeat=repeat)),
+        ('Vowel.production', lambda n: timeCall(agent.v[0].production, number=n, repeat=repeat)),
+        ('articDistance', lambda n: timeCall(lambda: deboer.articDistance(nextArt(), nextArt()), number=n, repeat=repeat)),
+        ('neighbors', lambda n: timeCall(lambda: deboer.neighbors(nextArt(), sim.articEps, sim.synthesize), number=n, repeat=repeat)),
+        ('neighbors (uncached)', lambda n: timeCall(lambda: deboer.neighbors(nextArt(), uncached.articEps, uncached.synthesize), number=n, repeat=repeat)),
+        ('Vowel.shiftCloser', lambda n: timeCall(shift, setup=shiftSetup, number=n, repeat=repeat)),
+        ('Agent.step2', lambda n: timeCall(lambda: agent.step2(nextSignal()), number=n, repeat=repeat)),
+        ('Agent.step3', lambda n: timeCall(lambda: agent.step3(1, nextSignal()), number=n, repeat=repeat)),
+        ('Agent.merge', lambda n: timeCall(lambda ag: ag.merge(), setup=mergeSetup, number=max(n/100, 5), repeat=repeat)),
+        ('Agent.findPhoneme', lambda n: timeCall(lambda: agent.findPhoneme(nextSignal()), number=max(n/100, 5), repeat=repeat)),
+        ('Agent.findPhoneme (uncached)', lambda n: timeCall(lambda: deboer.hillClimb(nextSignal(), [0.5, 0.5, 0.5], uncached), number=max(n/100, 5), repeat=repeat)),
+    ]
+
+## end-to-end runs: the configurations of simDeBoer.sh (name, parameters)
+endToEndConfigs = [
+    ('20 agents', dict(nAgents=20, nIts=10000, storeIvl=20)),
+    ('20 agents, 10 runs, final only', dict(nAgents=20, nIts=5000, storeIvl=5000, nRuns=10)),
+    ('20 agents, numba kernels', dict(nAgents=20, nIts=10000, storeIvl=20, kernels='numba')),
+    ('20 agents, noise 0.25', dict(nAgents=20, nIts=10000, storeIvl=100, noise=0.25)),
+    ('200 agents', dict(nAgents=200, nIts=10000, storeIvl=100)),
+    ('10000 agents', dict(nAgents=10000, nIts=20000, storeIvl=20000)),
+    ('10000 agents, flat population', dict(nAgents=10000, nIts=20000, storeIvl=20000, flatPopulation=True)),
+]
+
+## play the game (nRuns runs, one by default) with the given
+## parameters, returning interactions per second (over all runs, best
+## of repeat tries), seconds taken, the
+## population's bytes per agent at the end (from its --profile
+## summary), and the kernels the game actually used ('python' if the
+## compiled ones couldn't be loaded)
+def endToEnd(params, seed, repeat):
+    best = float('inf')
+    fd, statsF = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        for i in range(repeat):
+            sim = deboer.Simulation(seed=seed, profile=True, progressIvl=0, statsF=statsF, **params)
+            start = time.time()
+            deboer.game(sim)
+            best = min(best, time.time() - start)
+        kernelsUsed = sim.kernels if sim.jit is not None else 'python'
+        with open(statsF) as f:
+            bytesPerAgent = json.loads(f.readline())['bytesPerAgent']
+    finally:
+        os.remove(statsF)
+    return params['nIts']*params.get('nRuns', 1)/best, best, bytesPerAgent, kernelsUsed
+
+
+## what results were measured on and with: meta fields that change
+## the benchmarks themselves (results differing in them can't be
+## compared), and those that only change what they ran on
+workloadMeta = ['seed', 'quick']
+environmentMeta = ['python', 'numpy', 'platform']
+
+def metadata(args):
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'seed': args.seed, 'quick': args.quick}
+
+## check that results with meta can be compared to baseline results;
+## raises ValueError if not
+def checkComparable(meta, baseline):
+    changed = ['%s %s (baseline %s)' % (k, meta[k], baseline['meta'].get(k)) for k in workloadMeta if meta[k] != baseline['meta'].get(k)]
+    if changed:
+        raise ValueError("can't compare with a baseline run differently: %s" % ', '.join(changed))
+
+def run(args):
+    results = {
+        'meta': metadata(args),
+        'micro': {},
+        'endToEnd': {},
+    }
+
+    if not args.endToEndOnly:
+        number = 200 if args.quick else 2000
+        for name, bench in microBenchmarks(args.seed, args.microRepeat):
+            if args.only and args.only not in name:
+                continue
+            secs = bench(number)
+            results['micro'][name] = {'secondsPerCall': secs}
+            print "%-32s %10.2f us/call" % (name, secs*1e6)
+
+    if not args.microOnly:
+        for name, params in endToEndConfigs:
+            if args.only and args.only not in name:
+                continue
+            params = dict(params)
+            ## timing the python fallback under the compiled kernels'
+            ## name would make a meaningless (and, compared, falsely
+            ## regressing) benchmark
+            if params.get('kernels', 'python') != 'python' and deboer.getKernels(params['kernels']) is None:
+                print "%-32s skipped: no %s kernels" % (name, params['kernels'])
+                continue
+            if args.quick:
+                params['nIts'] /= 10
+                params['storeIvl'] = min(params['storeIvl'], params['nIts'])
+            rate, secs, bytesPerAgent, kernelsUsed = endToEnd(params, args.seed, args.repeat)
+            results['endToEnd'][name] = dict(params, interactionsPerSecond=rate, seconds=secs, bytesPerAgent=bytesPerAgent, kernelsUsed=kernelsUsed)
+            print "%-32s %10.1f interactions/s (%.1f s, %.0f bytes/agent, %s kernels)" % (name, rate, secs, bytesPerAgent, kernelsUsed)
+
+    return results
+
+## what a benchmark measured, as opposed to the parameters it was run
+## with
+measuredKeys = ['secondsPerCall', 'interactionsPerSecond', 'seconds', 'bytesPerAgent', 'kernelsUsed']
+
+## compare results to baseline results (see checkComparable); a
+## benchmark regresses if it's slower by more than fraction
+## tolerance.  benchmarks run with other parameters, or end-to-end
+## runs that used other kernels, than the baseline's aren't compared.
+##
+## output: list of (benchmark, baseline value, new value, relative change)
+## for regressions
+def compare(results, baseline, tolerance):
+    regressions = []
+    print
+    for k in environmentMeta:
+        if results['meta'][k] != baseline['meta'].get(k):
+            print "warning: %s %s, baseline %s: changes may come from that" % (k, results['meta'][k], baseline['meta'].get(k))
+    print "%-32s %12s %12s %8s" % ('benchmark', 'baseline', 'now', 'change')
+    for kind, key, slowerIsHigher in [('micro', 'secondsPerCall', True), ('endToEnd', 'interactionsPerSecond', False)]:
+        for name in sorted(results[kind]):
+            if name not in baseline.get(kind, {}):
+                continue
+            oldKernels, newKernels = baseline[kind][name].get('kernelsUsed'), results[kind][name].get('kernelsUsed')
+            if oldKernels and newKernels and oldKernels != newKernels:
+                print "%-32s not compared: %s kernels, baseline %s" % (name, newKernels, oldKernels)
+                continue
+            changed = sorted(k for k in set(results[kind][name]) | set(baseline[kind][name])
+                             if k not in measuredKeys and results[kind][name].get(k) != baseline[kind][name].get(k))
+            if changed:
+                print "%-32s not compared: different %s" % (name, ', '.join(changed))
+                continue
+            old, new = baseline[kind][name][key], results[kind][name][key]
+            ## relative slowdown: positive is slower
+            change = (new/old - 1) if slowerIsHigher else (old/new - 1)
+            flag = ''
+            if change > tolerance:
+                flag = 'REGRESSION'
+                regressions.append((name, old, new, change))
+            print "%-32s %12.4g %12.4g %+7.1f%% %s" % (name, old, new, 100*change, flag)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = 'benchmarks for the de boer model simulation')
+    parser.add_argument('--out', default=None, help = '.json file to write results to (default: none)')
+    parser.add_argument('--compare', default=None, help = '.json file of baseline results (from --out) to compare against (default: none)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help = 'fraction by which a benchmark can be slower than the baseline without being flagged as a regression (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help = 'random seed for all benchmarks (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help = 'number of times to play each end-to-end run, taking the fastest (default: %(default)s)')
+    parser.add_argument('--microRepeat', type=int, default=9, help = 'number of times to time each microbenchmark, taking the fastest (default: %(default)s)')
+    parser.add_argument('--quick', action='store_true', help = 'fewer calls, and end-to-end runs with a tenth of the interactions (default: false)')
+    parser.add_argument('--only', default=None, help = 'only run benchmarks whose name contains this (default: all)')
+    parser.add_argument('--microOnly', action='store_true', help = 'only run microbenchmarks (default: false)')
+    parser.add_argument('--endToEndOnly', action='store_true', help = 'only run end-to-end benchmarks (default: false)')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        try:
+            checkComparable(metadata(args), baseline)
+        except ValueError as e:
+            parser.error(str(e))
+
+    results = run(args)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print "%d regression(s) beyond %d%%" % (len(regressions), 100*args.tolerance)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
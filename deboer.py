@@ -14,136 +14,641 @@ values for each parameter:
 sample run, for 5000 its (total) for 20 agents, all other parameters at default values, store log in sample.csv:
 > python deboer.py --nIts 5000 --nAgents 20 sample.csv
 
+can also be used from python, without writing a file:
+> import deboer
+> results = deboer.game(deboer.Simulation(nIts=5000, nAgents=20))
+
 '''
 
-import random, itertools, csv, argparse, itertools, math, copy
+import random, itertools, csv, argparse, math, collections
+import os, sys, shutil, tempfile, hashlib, multiprocessing, json, zipfile, io, timeit, threading
 import os.path as path
+import numpy as np
 
 
-## parse command line arguments
+## command line arguments
 ##
 
+def buildParser():
+    parser = argparse.ArgumentParser(description = 'de boer model simulation')
+    parser.add_argument('--nIts', type = int, default = 10000, help = 'number of interactions between agents (default: %(default)s)')
+
+    parser.add_argument('--nRuns', type = int, default = 1, help = 'number of runs of the whole game (default: %(default)s)')
+
+    parser.add_argument('csvF', help = '.csv file to output to (with --sweep: directory to write the sweep to)')
+
+    parser.add_argument('--noise', type = float, default = 0.1, help = 'amount of acoustic noise (deboer: varies; default: %(default)s)')
+
+    parser.add_argument('--nAgents', type = int, default = 5, help = 'number of agents (deboer: 20; default: %(default)s)')
+
+    parser.add_argument('--discardThresh', type=float, default=0.7, help = 'success/uses ratio under which vowels are discarded (deboer: 0.7; default: %(default)s)')
+
+    parser.add_argument('--successThresh', type=float, default=0.5, help = 'success/uses ratio under which vowel added (deboer: 0.5; default: %(default)s)')
+
+    parser.add_argument('--minUsesDiscard', type = int, default = 5, help = 'minimum number of times a vowel must be used to consider discarding (deboer: 5; default: %(default)s)')
+
+    parser.add_argument('--acousticMergeThresh', type=float, default=1.0, help = 'perceptual distance under which vowels merged (deboer: not defined; default: %(default)s)')
+
+    parser.add_argument('--articMergeThresh', type=float, default=0.17, help = 'euclidean distance in articulatory space space under which vowels merged (deboer: n.d. in article, 0.17 in book; default: %(default)s)')
+
+    parser.add_argument('--articEps', type=float, default=0.03, help = 'how much to shift by, in articulatory space, when calculating neighbors (deboer: 0.1; default: %(default)s)')
+
+    parser.add_argument('--L', type=float, default=0.3, help='lambda: weighting of F2\' difference vs F1 difference in calculating perceptual distance (deboer: 0.3; default: default: %(default)s)')
+
+    ## deboer says something weird about this
+    parser.add_argument('--additionProb', type=float, default=0.005, help = 'probability with which an agent adds a random new vowel (deboer: 0.01; default: %(default)s)')
+
+    parser.add_argument('--cleanUpProb', type=float, default=1.0, help = 'probability with which an agent cleans up (discards and merges) in each round (deboer: n.d. in article, 0.1 in book; default: %(default)s)')
+
+    parser.add_argument('--storeIvl', type=int, default=100, help = 'write info to CSV every storeIvl iterations (default: %(default)s)')
+
+    parser.add_argument('--outFormat', choices=['csv', 'npz'], default=None, help = 'output format: csv, or npz (compressed numpy arrays, written in chunks; see readSnapshots) (default: npz if the output file ends in .npz, else csv)')
+
+    parser.add_argument('--chunkRows', type=int, default=100000, help = 'with npz output, number of rows to buffer before writing a chunk (default: %(default)s)')
+
+    parser.add_argument('--verbose', action='store_true', help = "verbose output (default: false)")
+
+    parser.add_argument('--profile', action='store_true', help = 'record time spent in each phase of the game and counts of events (merges, discards, additions, hill-climb steps, successes and failures), and print progress (default: false)')
+
+    parser.add_argument('--statsF', default=None, help = 'with --profile, file to write a JSON summary of each run to, one line per run (default: print them; with --sweep, stats.json in the sweep directory)')
+
+    parser.add_argument('--progressIvl', type=int, default=1000, help = 'with --profile, print interactions/s and estimated time left every progressIvl interactions, or never if 0 (default: %(default)s)')
+
+    parser.add_argument('--seed', type=int, default=None, help = 'master random seed; each run\'s seed is derived from it and the run number, so results don\'t depend on --workers (default: chosen at random, and printed)')
+
+    parser.add_argument('--workers', type=int, default=1, help = 'number of worker processes to play runs in parallel (default: %(default)s)')
+
+    parser.add_argument('--sweep', default=None, help = '.json file giving a grid of parameter values, e.g. {"noise": [0.1, 0.25], "nAgents": [20, 200]}: play --nRuns runs of each combination, other parameters as given on the command line, writing one .csv file per combination to directory csvF.  Rerunning an interrupted sweep resumes it (default: no sweep)')
+
+    parser.add_argument('--synthCacheSize', type=int, default=100000, help = 'maximum number of articulations whose formants are kept in the synthesizer cache (default: %(default)s)')
+
+    parser.add_argument('--noSynthCache', action='store_true', help = 'turn off the synthesizer cache, for exact reproduction of uncached runs (default: false)')
+
+    parser.add_argument('--inverseMap', action='store_true', help = 'when adding a vowel near a signal, start the hill-climb from the closest articulation in a precomputed inverse map of the synthesizer, rather than from schwa (default: false)')
 
-parser = argparse.ArgumentParser(description = 'de boer model simulation')
-parser.add_argument('--nIts', type = int, default = 10000, help = 'number of interactions between agents (default: %(default)s)')
+    parser.add_argument('--verifyInverseMap', action='store_true', help = 'use the original hill-climb from schwa, but report how often the inverse map gives a different result (default: false)')
 
-parser.add_argument('--nRuns', type = int, default = 1, help = 'number of runs of the whole game (default: %(default)s)')
+    parser.add_argument('--kernels', choices=['python', 'numba'], default='python', help = 'functions to synthesize, perceive and hill-climb with: python, or compiled with numba (see kernelsDeBoer.py), which are much faster and give the same results as --noSynthCache; falls back to python if numba isn\'t installed (default: %(default)s)')
 
-parser.add_argument('csvF', help = '.csv file to output to')
+    parser.add_argument('--ensemble', action='store_true', help = 'play all runs in lockstep, as one batch of numpy arrays (see ensembleDeBoer.py): much faster for many runs of small populations, and statistically the same as playing them one at a time, but not the same runs; snapshots are ordered by time, then run (default: false)')
 
-parser.add_argument('--noise', type = float, default = 0.1, help = 'amount of acoustic noise (deboer: varies; default: %(default)s)')
+    parser.add_argument('--convergeWindow', type=int, default=0, help = 'stop each run early once it has converged: every convergeWindow interactions, compare communicative success over the window, mean inventory size and how far vowel prototypes have moved with the previous window, and stop once they have stayed within the tolerances below for convergePatience windows in a row.  the final state is always written, at the time the run stopped, and the time and reason each run stopped are written to a .stops.csv file alongside the output (default: never stop early)')
 
-parser.add_argument('--nAgents', type = int, default = 5, help = 'number of agents (deboer: 20; default: %(default)s)')
+    parser.add_argument('--convergeSuccess', type=float, default=0.03, help = 'with --convergeWindow, largest change in the fraction of successful interactions between windows (default: %(default)s)')
 
-parser.add_argument('--discardThresh', type=float, default=0.7, help = 'success/uses ratio under which vowels are discarded (deboer: 0.7; default: %(default)s)')
+    parser.add_argument('--convergeSize', type=float, default=0.25, help = 'with --convergeWindow, largest change in the mean number of vowels per agent between windows (default: %(default)s)')
 
-parser.add_argument('--successThresh', type=float, default=0.5, help = 'success/uses ratio under which vowel added (deboer: 0.5; default: %(default)s)')
+    parser.add_argument('--convergeShift', type=float, default=0.075, help = 'with --convergeWindow, largest mean distance (in articulatory space) moved over a window by vowels present at both its start and end (default: %(default)s)')
 
-parser.add_argument('--minUsesDiscard', type = int, default = 5, help = 'minimum number of times a vowel must be used to consider discarding (deboer: 5; default: %(default)s)')
+    parser.add_argument('--convergePatience', type=int, default=3, help = 'with --convergeWindow, number of windows in a row which must be within the tolerances (default: %(default)s)')
 
-parser.add_argument('--acousticMergeThresh', type=float, default=1.0, help = 'perceptual distance under which vowels merged (deboer: not defined; default: %(default)s)')
+    parser.add_argument('--checkpointIvl', type=int, default=0, help = 'save a checkpoint of the whole population (and the random number generator) every checkpointIvl interactions, to continue from with --resume; not with --workers (default: never)')
 
-parser.add_argument('--articMergeThresh', type=float, default=0.17, help = 'euclidean distance in articulatory space space under which vowels merged (deboer: n.d. in article, 0.17 in book; default: %(default)s)')
+    parser.add_argument('--checkpointDir', default=None, help = 'directory to keep checkpoints in (default: the output file name plus .checkpoints)')
 
-parser.add_argument('--articEps', type=float, default=0.03, help = 'how much to shift by, in articulatory space, when calculating neighbors (deboer: 0.1; default: %(default)s)')
+    parser.add_argument('--checkpointKeep', type=int, default=2, help = 'number of most recent checkpoints to keep (default: %(default)s)')
 
-parser.add_argument('--L', type=float, default=0.3, help='lambda: weighting of F2\' difference vs F1 difference in calculating perceptual distance (deboer: 0.3; default: default: %(default)s)')
+    parser.add_argument('--resume', action='store_true', help = 'continue from the latest checkpoint in the checkpoint directory, giving the same output as an uninterrupted game; parameters must be the same as when the checkpoint was saved (default: false)')
 
-## deboer says something weird about this
-parser.add_argument('--additionProb', type=float, default=0.005, help = 'probability with which an agent adds a random new vowel (deboer: 0.01; default: %(default)s)')
+    parser.add_argument('--flatPopulation', action='store_true', help = 'keep all agents\' vowels in one set of flat arrays, and only set up an agent once it first interacts (see Population): for populations of 10^4 agents and up.  gives the same output as without (default: false)')
 
-parser.add_argument('--cleanUpProb', type=float, default=1.0, help = 'probability with which an agent cleans up (discards and merges) in each round (deboer: n.d. in article, 0.1 in book; default: %(default)s)')
+    parser.add_argument('--snapshotAgents', type=int, default=0, help = 'write only this many agents (the same random sample throughout a run) to each snapshot (default: all agents)')
 
-parser.add_argument('--storeIvl', type=int, default=100, help = 'write info to CSV every storeIvl iterations (default: %(default)s)')
+    parser.add_argument('--summaries', choices=['none', 'both', 'only'], default='none', help = 'at each snapshot, also (both) or instead (only) of writing every vowel, write summaries of the whole population: inventory size, success ratio and energy to <output>.summary.csv, and clusters of vowel prototypes in (F1 bark, F2\') to <output>.clusters.csv (see summarize); not with --sweep (default: %(default)s)')
 
-parser.add_argument('--verbose', action='store_true', help = "verbose output (default: false)")
+    parser.add_argument('--eventLog', action='store_true', help = 'also write a log of every interaction\'s outcome and every change to the agents\' inventories to <output>.events.npz (see EventLog), from which snapshots at any interval can be written later by replayDeBoer.py, without playing the game again; not with --ensemble or --sweep (default: false)')
 
-args = parser.parse_args()
+    parser.add_argument('--clusterRadius', type=float, default=1.0, help = 'with --summaries, perceptual distance within which prototypes are clustered together (see clusterPrototypes) (default: %(default)s)')
 
-## for convenience
-nIts, noise, verbose, L, articEps = args.nIts, args.noise, args.verbose, args.L, args.articEps
+    return parser
 
+parser = buildParser()
+
+## names of the simulation parameters: all command-line arguments but
+## the output file and --sweep
+simulationParams = [a.dest for a in parser._actions if a.dest not in ('help', 'csvF', 'sweep')]
+
+
+## all parameters of a simulation (see buildParser for what they
+## mean), plus the caches shared by its agents.  for example:
+##
+## > sim = Simulation(nAgents=20, noise=0.25, seed=1)
+## > results = game(sim)
+##
+## plays the game with 20 agents and noise 0.25, all other parameters
+## at their defaults, and returns the agents' vowel prototypes in
+## memory (see game).
+class Simulation(object):
+    def __init__(self, **params):
+        for name in simulationParams:
+            setattr(self, name, params.pop(name, parser.get_default(name)))
+        if params:
+            raise TypeError("unknown simulation parameters: %s" % ', '.join(sorted(params)))
+        self.setUp()
+
+    ## simulation from parsed command-line arguments
+    @classmethod
+    def fromArgs(cls, args):
+        return cls(**dict((name, getattr(args, name)) for name in simulationParams))
+
+    ## get the synthesizer cache, inverse map and compiled kernels (if
+    ## any) for these parameters (shared by all simulations in this
+    ## process), and a random stream seeded with the master seed (game
+    ## gives each run its own).
+    ## self.instr and self.events hold the Instruments and EventLog of
+    ## the run being played, if any.
+    def setUp(self):
+        self.instr = None
+        self.events = None
+        self.stops = None
+        self.rng = RandomStream(self.seed if self.seed is not None else random.SystemRandom().randint(0, 2**31-1), self.nAgents, self.noise)
+        self.synthCache = None if (self.noSynthCache or self.synthCacheSize <= 0) else getSynthCache(self.synthCacheSize)
+        self.invMap = getInverseMap(self.articEps, self.L) if (self.inverseMap or self.verifyInverseMap) else None
+        self.jit = getKernels(self.kernels)
+
+    ## parameter values, as a dict
+    def params(self):
+        return dict((name, getattr(self, name)) for name in simulationParams)
+
+    ## a simulation with the same parameters, except for those given
+    def copy(self, **changes):
+        params = self.params()
+        params.update(changes)
+        return Simulation(**params)
+
+    ## caches aren't pickled (e.g. to send to worker processes), but
+    ## fetched again on unpickling
+    def __getstate__(self):
+        return self.params()
+
+    def __setstate__(self, params):
+        self.__dict__.update(params)
+        self.setUp()
+
+    ## return formants and perceptual coordinates of articulation art,
+    ## using the compiled kernels or else the synthesizer cache, if
+    ## there are any
+    ##
+    ## NB: formants may be shared with the cache, so don't modify them
+    def synthesize(self, art):
+        if self.jit is not None:
+            return self.jit.synthesize(art)
+        if self.synthCache is not None:
+            return self.synthCache.lookup(art)
+        return synthesize(art)
+
+
+## random numbers for one run of the game, drawn in blocks of
+## blockSize (as lists, for quick scalar access) rather than one call
+## at a time:
+##
+## - pair(): speaker and hearer (indices of two different agents)
+## - noiseFactors(): factors by which noise multiplies the four formants
+##   of a production
+## - random(), choice(seq): cleanup/addition coin flips, random
+##   articulations and choices of vowels
+##
+## (and sample(), which agents to write to snapshots, drawn once)
+##
+## each of these streams' blocks is drawn from a numpy RandomState
+## seeded with (seed, stream, block number), so the state of the whole
+## thing is just the number of blocks drawn and the position in the
+## current block of each stream (see state, restore).
+##
+## seed: integer in [0, 2**64)
+class RandomStream(object):
+    PAIRS, NOISE, UNIFORM, SAMPLE = range(4)
+
+    def __init__(self, seed, nAgents, noise, blockSize=4096):
+        self.seed = seed
+        self.nAgents = nAgents
+        self.noise = noise
+        self.blockSize = blockSize
+        ## (RandomState takes 32-bit words)
+        self.seedWords = [seed & 0xffffffff, seed >> 32 & 0xffffffff]
+        self.blocks = [0, 0, 0]
+        self.pairBuf, self.pairPos = [], 0
+        self.noiseBuf, self.noisePos = [], 0
+        self.uniformBuf, self.uniformPos = [], 0
+
+    ## draw the next block of stream
+    def draw(self, stream):
+        rs = np.random.RandomState(self.seedWords + [stream, self.blocks[stream]])
+        self.blocks[stream] += 1
+        n = self.blockSize
+        if stream == self.PAIRS:
+            ## the hearer is any agent but the speaker
+            a1 = rs.randint(self.nAgents, size=n)
+            a2 = (a1 + 1 + rs.randint(self.nAgents - 1, size=n)) % self.nAgents
+            self.pairBuf, self.pairPos = zip(a1.tolist(), a2.tolist()), 0
+        elif stream == self.NOISE:
+            self.noiseBuf, self.noisePos = (1 + rs.uniform(-self.noise/2, self.noise/2, 4*n)).tolist(), 0
+        else:
+            self.uniformBuf, self.uniformPos = rs.random_sample(n).tolist(), 0
+
+    ## indices of the next speaker and hearer
+    def pair(self):
+        if self.pairPos == len(self.pairBuf):
+            self.draw(self.PAIRS)
+        self.pairPos += 1
+        return self.pairBuf[self.pairPos - 1]
+
+    ## next four noise factors (as random.uniform(-noise/2, noise/2)+1)
+    def noiseFactors(self):
+        i = self.noisePos
+        if i == len(self.noiseBuf):
+            self.draw(self.NOISE)
+            i = 0
+        self.noisePos = i + 4
+        return self.noiseBuf[i:i+4]
+
+    ## next number from [0, 1) (as random.random)
+    def random(self):
+        if self.uniformPos == len(self.uniformBuf):
+            self.draw(self.UNIFORM)
+        self.uniformPos += 1
+        return self.uniformBuf[self.uniformPos - 1]
+
+    ## random element of non-empty sequence seq (as random.choice)
+    def choice(self, seq):
+        return seq[int(self.random()*len(seq))]
+
+    ## k different numbers from range(n), in increasing order, drawn
+    ## apart from the other streams (so drawing them, or not, doesn't
+    ## change the game)
+    def sample(self, n, k):
+        return np.sort(np.random.RandomState(self.seedWords + [self.SAMPLE]).choice(n, k, replace=False))
+
+    ## blocks drawn and position in the current block, of each stream
+    def state(self):
+        return np.array(self.blocks), np.array([self.pairPos, self.noisePos, self.uniformPos])
+
+    ## continue from state (from state())
+    def restore(self, blocks, positions):
+        for stream, (nBlocks, pos) in enumerate(zip(blocks, positions)):
+            if nBlocks > 0:
+                self.blocks[stream] = nBlocks - 1
+                self.draw(stream)
+        self.pairPos, self.noisePos, self.uniformPos = [int(p) for p in positions]
 
 
 # class for a vowel
-class Vowel:
+#
+# a vowel is either free-standing, keeping its own articulation,
+# formants and perceptual coordinates, or a view into a row of an
+# agent's Inventory (once added to the agent's inventory).
+class Vowel(object):
+    __slots__ = ('sim', 'inv', 'row', '_art', '_form', '_perc', 'label')
+
     ## initialize with no articulation, formants, or label
-    def __init__(self):
-        self.art = ['','','']
-        self.form = ['','','','']
+    ##
+    ## sim: Simulation this vowel is part of
+    def __init__(self, sim):
+        self.sim = sim
+        self.inv = None
+        self.row = None
+        self._art = ['','','']
+        self._form = ['','','','']
+        self._perc = ('','')
         self.label = ''
 
+    @property
+    def art(self):
+        if self.inv is None:
+            return self._art
+        return self.inv.art[self.row].tolist()
+
+    @property
+    def form(self):
+        if self.inv is None:
+            return self._form
+        return self.inv.form[self.row].tolist()
+
+    @property
+    def perc(self):
+        if self.inv is None:
+            return self._perc
+        return tuple(self.inv.perc[self.row].tolist())
+
+    ## set articulation, formants and perceptual coordinates (which
+    ## must belong together)
+    def place(self, art, form, perc):
+        if self.inv is None:
+            self._art, self._form, self._perc = art, form, perc
+        else:
+            self.inv.place(self.row, art, form, perc)
+
+    ## set articulation, and the formants and perceptual coordinates
+    ## that go with it
+    def setArt(self, art):
+        form, perc = self.sim.synthesize(art)
+        self.place(art, form, perc)
+
     ## return formants with noise added
     def production(self):
-        return [f*(1+random.uniform(-noise/2,noise/2)) for f in self.form]
+        return [f*m for f, m in zip(self.form, self.sim.rng.noiseFactors())]
 
     
     ## shift this vowel closer to formants A
     ##
+    ## output: whether it moved
     def shiftCloser(self, A):
+        sim = self.sim
+        art = self.art
+
+        if sim.jit is not None:
+            moved = sim.jit.shiftCloser(A, art, self.perc, sim.articEps, sim.L)
+            if moved is not None:
+                self.place(*moved)
+            return moved is not None
+
         ## find 6 closest neighbors
-        neighbs  = neighbors(self.art)
+        neighbs  = neighbors(art, sim.articEps, sim.synthesize)
 
         ## find which of these directions, if any, is closer to A, and
         ## shift vowel in the best direction (if any)
-        bestV = (self.art, self.form)
-        minDist = acousticDistance(A, self.form)
+        percA = percept(A)
+        bestV = None
+        minDist = perceptualDistance(percA, self.perc, sim.L)
         
         for n in neighbs:
-            if acousticDistance(A, n[1]) < minDist:
-                minDist = acousticDistance(A, n[1])
+            curDist = perceptualDistance(percA, n[2], sim.L)
+            if curDist < minDist:
+                minDist = curDist
                 bestV = n
                 
-        self.art, self.form = bestV[0], bestV[1]
+        if bestV is not None:
+            self.place(*bestV)
+        return bestV is not None
 
 ## END VOWEL CODE
 ##
 
 
+## an agent's vowel inventory, as arrays with one row per vowel:
+## articulation, formants, perceptual coordinates (F1 in bark, F2'),
+## use count, success count and label.  Vowel objects for the rows
+## are kept in self.vowels, in the same order, and self.rows maps
+## labels to rows.  removing a vowel moves the last row into its place,
+## so rows aren't in the order vowels were added, but labels are: new
+## vowels are labeled by a counter (self.nextLabel), never reusing a
+## label.
+##
+## perceptual coordinates are cached here, so that finding the
+## closest vowel to a signal is one vectorized operation.
+##
+## the inventory also keeps track of which pairs of vowels are close
+## enough to be merged: self.partners maps each label to the labels of
+## vowels it's close to, as of the last call to mergePairs, and
+## self.dirty holds the labels of vowels moved or added since then.
+class Inventory(object):
+    def __init__(self, capacity=8):
+        self.n = 0
+        self.art, self.form, self.perc, self.useCount, self.successCount, self.labels = inventoryColumns(capacity)
+        self.nextLabel = 1
+        self.vowels = []
+        self.rows = {}
+        self.partners = {}
+        self.dirty = set()
+
+    ## the per-vowel arrays
+    def columns(self):
+        return [self.art, self.form, self.perc, self.useCount, self.successCount, self.labels]
+
+    ## double capacity of all arrays
+    def grow(self):
+        cap = 2*len(self.labels)
+        def resized(a):
+            b = np.zeros((cap,) + a.shape[1:], dtype=a.dtype)
+            b[:self.n] = a[:self.n]
+            return b
+        self.art, self.form, self.perc, self.useCount, self.successCount, self.labels = [resized(a) for a in self.columns()]
+
+    def place(self, row, art, form, perc):
+        self.art[row] = art
+        self.form[row] = form
+        self.perc[row] = perc
+        self.dirty.add(int(self.labels[row]))
+
+    ## label for a new vowel
+    def newLabel(self):
+        lab = self.nextLabel
+        self.nextLabel += 1
+        return lab
+
+    ## add (free-standing) vowel vow, with zero uses and successes;
+    ## vow becomes a view into the new row
+    def add(self, vow):
+        if self.n == len(self.labels):
+            self.grow()
+        row = self.n
+        self.n += 1
+        self.labels[row] = vow.label
+        self.place(row, vow.art, vow.form, vow.perc)
+        self.useCount[row] = 0
+        self.successCount[row] = 0
+        vow.inv, vow.row = self, row
+        self.vowels.append(vow)
+        self.rows[vow.label] = row
+        self.partners[vow.label] = set()
+
+    ## remove vowel with label lab, moving the last row into its
+    ## place.  The removed Vowel becomes free-standing again.
+    def remove(self, lab):
+        row = self.rows.pop(lab)
+        vow = self.vowels[row]
+        for other in self.partners.pop(lab):
+            self.partners[other].discard(lab)
+        self.dirty.discard(lab)
+        art, form, perc = vow.art, vow.form, vow.perc
+        vow.inv, vow.row = None, None
+        vow.place(art, form, perc)
+
+        last = self.n - 1
+        if row != last:
+            for a in self.columns():
+                a[row] = a[last]
+            moved = self.vowels[last]
+            moved.row = row
+            self.vowels[row] = moved
+            self.rows[moved.label] = row
+        self.vowels.pop()
+        self.n = last
+
+    ## replace the inventory's contents with vowels of simulation sim
+    ## given by arrays, in the order of columns(), and the next label
+    ## to give (e.g. from a checkpoint).  all vowels count as moved, so
+    ## the next call to mergePairs checks every pair.
+    def restore(self, sim, arrays, nextLabel):
+        n = len(arrays[-1])
+        cap = max(8, 1 << (n-1).bit_length()) if n else 8
+        def resized(a):
+            b = np.zeros((cap,) + a.shape[1:], dtype=a.dtype)
+            b[:n] = a
+            return b
+        self.art, self.form, self.perc, self.useCount, self.successCount, self.labels = \
+            [resized(np.asarray(a, dtype=old.dtype)) for a, old in zip(arrays, self.columns())]
+        self.n = n
+        self.nextLabel = nextLabel
+        self.index(sim)
+
+    ## set up Vowel objects of simulation sim for the first n rows, and
+    ## the map from labels to rows; all vowels count as moved.
+    def index(self, sim):
+        self.vowels = []
+        for row, lab in enumerate(self.labels[:self.n].tolist()):
+            vow = Vowel(sim)
+            vow.label = lab
+            vow.inv, vow.row = self, row
+            self.vowels.append(vow)
+        self.rows = dict((vow.label, vow.row) for vow in self.vowels)
+        self.partners = dict((vow.label, set()) for vow in self.vowels)
+        self.dirty = set(self.rows)
+
+    ## all pairs of vowels (v1, v2) whose perceptual distance (with
+    ## weighting L) is under acousticThresh or whose articulatory
+    ## distance is under articThresh, with v1 added before v2 (i.e.
+    ## labeled lower), in the order itertools.combinations would give
+    ## them if the vowels were in the order they were added.
+    ##
+    ## only pairs involving vowels moved or added since the last call
+    ## are re-checked.
+    def mergePairs(self, acousticThresh, articThresh, L):
+        n = self.n
+        if self.dirty:
+            ## distances from each moved vowel (one per row) to all
+            ## vowels
+            dirty = list(self.dirty)
+            rows = [self.rows[lab] for lab in dirty]
+            perc, art = self.perc[:n], self.art[:n]
+            acDist = perceptualDistances(perc, perc[rows][:, None], L)
+            arDist = np.sqrt((art[:,0] - art[rows,0][:, None])**2 + (art[:,1] - art[rows,1][:, None])**2 + (art[:,2] - art[rows,2][:, None])**2)
+            close = (acDist < acousticThresh) | (arDist < articThresh)
+            close[np.arange(len(rows)), rows] = False
+
+            labels = self.labels[:n]
+            for lab, isClose in zip(dirty, close):
+                for other in self.partners[lab]:
+                    self.partners[other].discard(lab)
+                partners = set(labels[isClose].tolist())
+                self.partners[lab] = partners
+                for other in partners:
+                    self.partners[other].add(lab)
+            self.dirty.clear()
+
+        pairs = set()
+        for lab, partners in self.partners.iteritems():
+            for other in partners:
+                if lab < other:
+                    pairs.add((lab, other))
+        rows, vowels = self.rows, self.vowels
+        return [(vowels[rows[lab1]], vowels[rows[lab2]]) for (lab1, lab2) in sorted(pairs)]
+
+    ## the vowel perceptually closest (with weighting L) to perceptual
+    ## coordinates perc
+    def closest(self, perc, L):
+        n = self.n
+        dist = perceptualDistances(self.perc[:n], np.asarray(perc), L)
+        return self.vowels[int(dist.argmin())]
+
+
+## empty per-vowel arrays for capacity vowels, in the order of
+## Inventory.columns()
+def inventoryColumns(capacity):
+    return [np.zeros((capacity, 3)), np.zeros((capacity, 4), dtype=int), np.zeros((capacity, 2)),
+            np.zeros(capacity, dtype=int), np.zeros(capacity, dtype=int), np.zeros(capacity, dtype=int)]
+
+
+## dict-like view of an Inventory's use or success counts, indexed by
+## vowel label
+class CountView(object):
+    __slots__ = ('inv', 'column')
+
+    def __init__(self, inv, column):
+        self.inv = inv
+        self.column = column
+
+    def __getitem__(self, lab):
+        return int(getattr(self.inv, self.column)[self.inv.rows[lab]])
+
+    def __setitem__(self, lab, count):
+        getattr(self.inv, self.column)[self.inv.rows[lab]] = count
+
+    def __contains__(self, lab):
+        return lab in self.inv.rows
+
+    def __len__(self):
+        return self.inv.n
+
+    def keys(self):
+        return self.inv.labels[:self.inv.n].tolist()
+
+## END INVENTORY CODE
+##
+
+
 ## class for an agent
-class Agent:
+##
+## the agent's vowels, labels and use/success counts are all views
+## into its Inventory
+class Agent(object):
+    __slots__ = ('id', 'sim', 'inv', 'useCount', 'successCount')
+
     ## start out with an empty inventories
-    def __init__(self, id):
+    ##
+    ## sim: Simulation this agent is part of
+    ## inv: inventory to use instead (see Population)
+    def __init__(self, id, sim, inv=None):
         self.id = id
-        self.v = []
-        self.labels = []
-        self.useCount = {}
-        self.successCount = {}
+        self.sim = sim
+        self.inv = Inventory() if inv is None else inv
+        self.useCount = CountView(self.inv, 'useCount')
+        self.successCount = CountView(self.inv, 'successCount')
+
+    @property
+    def v(self):
+        return self.inv.vowels
+
+    @property
+    def labels(self):
+        return self.inv.labels[:self.inv.n]
 
 ##
 ## add random vowel to agent's inventory
 ##
     def addRandomVowel(self):
-        vow = Vowel()
+        vow = Vowel(self.sim)
 
         ## random vowel
-        vow.art= [random.random(), random.random(), random.random()]
+        rng = self.sim.rng
+        art = [rng.random(), rng.random(), rng.random()]
 
         ## find its label and formant frequencies
-        vow.label = max(self.labels)+1 if self.v else 1
-        vow.form = calFormFreq(vow.art)
+        vow.label = self.inv.newLabel()
+        vow.setArt(art)
 
         ## update agent's vowel inventory and counters
-        self.v.append(vow)
-        self.labels.append(vow.label)
-        self.useCount[vow.label] = 0
-        self.successCount[vow.label] = 0
-        if verbose:
+        self.inv.add(vow)
+        if self.sim.events:
+            self.sim.events.add(EventLog.RANDOM, int(self.id), vow.label, vow=vow)
+        if self.sim.instr:
+            self.sim.instr.count('randomAdditions')
+        if self.sim.verbose:
                 print "agent %s randomly added a vowel" % self.id
 
 ## add non-random new vowel to agent's inventory
 ##                
     def addNewVowel(self, newV):
         ## rename this vowel
-        newVLabel = max(self.labels)+1 if self.v else 1
-        newV.label = newVLabel 
+        newV.label = self.inv.newLabel()
 
         ## add the vowel to the inventory
-        self.v.append(newV)
-        self.labels.append(newVLabel)
-        self.useCount[newVLabel] = 0
-        self.successCount[newVLabel] = 0
-        if verbose:
+        self.inv.add(newV)
+        if self.sim.events:
+            self.sim.events.add(EventLog.NEW, int(self.id), newV.label, vow=newV)
+        if self.sim.instr:
+            self.sim.instr.count('nonRandomAdditions')
+        if self.sim.verbose:
                 print "agent %s non-randomly added a vowel" % self.id
         #self.v.append(
 
@@ -156,7 +661,7 @@ class Agent:
 
         ## choose a random vowel from the inventory, increment its use
         ## count
-        randomV = random.choice(self.v)
+        randomV = self.sim.rng.choice(self.v)
         self.useCount[randomV.label] += 1
 
         ## return vowel's label plus formants+noise
@@ -174,13 +679,7 @@ class Agent:
             self.addNewVowel(vNew)
 
         ## find the perceptually closest vowel in inventory to A1
-        closest = ''
-        minDist = 10000
-        for vowel in self.v:
-            curDist = acousticDistance(vowel.form, A1)
-            if(curDist < minDist):
-                minDist = curDist
-                closest = vowel
+        closest = self.inv.closest(percept(A1), self.sim.L)
 
         ## return production with noise of this vowel, plus the vowel itslef
         return closest.production(), closest
@@ -192,13 +691,7 @@ class Agent:
     ## A2: formants of production by agent 2
     def step3(self, lab1, A2):
         ## find the perceptually closest vowel in inventory to A2
-        closest = ''
-        minDist = 10000
-        for vowel in self.v:
-            curDist = acousticDistance(vowel.form, A2)
-            if(curDist < minDist):
-                minDist = curDist
-                closest = vowel
+        closest = self.inv.closest(percept(A2), self.sim.L)
 
         ## if that vowel is the one used in step 1, success; else, failure.
         if(lab1 == closest.label):
@@ -216,86 +709,110 @@ class Agent:
     A1: formants of production by agent 1 in step1
     '''
     def step4(self, success, myV, A1):
+        events = self.sim.events
+
         ## increment use count for this vowel
         self.useCount[myV.label] += 1
 
         ## if interaction was successful, shift this vowel closer to
         ## A1, and increment success count.
         if success:
-            myV.shiftCloser(A1)
+            if myV.shiftCloser(A1) and events:
+                events.add(EventLog.SHIFT, int(self.id), myV.label, vow=myV)
             self.successCount[myV.label] += 1
         ## otherwise, if success ratio high enough, add a new vowel
         ## near A1. if it's not, just shift this vowel closer to A1.
         else:
-            if float(self.successCount[myV.label])/self.useCount[myV.label] > args.successThresh: # backwards in paper (p. 451)
+            if float(self.successCount[myV.label])/self.useCount[myV.label] > self.sim.successThresh: # backwards in paper (p. 451)
                 vNew = self.findPhoneme(A1)
                 self.addNewVowel(vNew)
             else:
-                myV.shiftCloser(A1)
+                if myV.shiftCloser(A1) and events:
+                    events.add(EventLog.SHIFT, int(self.id), myV.label, vow=myV)
 
     '''
     find a vowel near a signal A (formants), by talking to self.
     '''
     def findPhoneme(self, A):
-        ## start from schwa
-        v = Vowel()
-        v.art = [0.5, 0.5, 0.5]
-        v.form = calFormFreq(v.art)
-
-        ## shift closer to A using shiftCloser until converge on a
-        ## point where all neighbors are no closer to A.
-        newArt = [0.5, 0.5, 0.5]
-        v.shiftCloser(A)
-
-        while(newArt != v.art):
-            newArt = v.art
-            v.shiftCloser(A)
-
-        ## return a new vowel with the articulation and formants
-        ## converged on.
-        vNew = Vowel()
-        vNew.art = newArt
-        vNew.form = calFormFreq(newArt)
-
-        return(vNew)
+        ## start from schwa, or from the articulation the inverse map
+        ## gives for A
+        sim = self.sim
+        if sim.invMap is None:
+            return hillClimb(A, [0.5, 0.5, 0.5], sim)[0]
+
+        start = sim.invMap.nearest(percept(A))
+        if not sim.verifyInverseMap:
+            return hillClimb(A, start, sim)[0]
+
+        ## keep the original hill-climb's result, and note whether the
+        ## inverse map's differs.  only the original climb is counted
+        ## by sim.instr (as the game's); the map's is counted by invMap
+        instr, sim.instr = sim.instr, None
+        try:
+            vNew, steps = hillClimb(A, start, sim)
+        finally:
+            sim.instr = instr
+        vRef, refSteps = hillClimb(A, [0.5, 0.5, 0.5], sim)
+        sim.invMap.verify(A, vRef, vNew, refSteps, steps)
+        return vRef
         
     """
     remove a vowel from the inventory
     """
     def removeVowel(self, vow):
         lab = vow.label
-        if verbose:
+        if self.sim.verbose:
             uses, successes = self.useCount[lab], self.successCount[lab]
             if(uses):
                 print "agent %s removed a vowel with uses=%d, successes=%d, ratio=%f" % (self.id, uses, successes, float(successes)/uses)
             else:
                 print "agent %s removed a vowel with uses=%d, successes=%d" % (self.id, uses, successes)
-        self.v.remove(vow)
-        del self.useCount[lab]
-        del self.successCount[lab]
-        self.labels.remove(lab)
+        self.inv.remove(lab)
         
     '''
     do other updates (Table V, p. 451)
     '''
     def doOtherUpdates(self):
+        sim = self.sim
+        instr = sim.instr
         ## the book says to only 'clean up' on 10% of games, i think meaning this.
-        if(random.random() < args.cleanUpProb):
+        if(sim.rng.random() < sim.cleanUpProb):
+            if instr: t = instr.clock()
 
             ## 1. remove vowels that have been used enough times to
             ## be judged, and whose successes/uses ratio is too low.
-            for vow in self.v:
-                lab = vow.label
-                uses = self.useCount[lab]
-                if uses > args.minUsesDiscard and float(self.successCount[lab])/uses < args.discardThresh:
-                    self.removeVowel(vow)
+            ## vowels are judged in the order they were added (that of
+            ## their labels) and, as in the original loop over the list
+            ## of vowels it removed from, the vowel after each one
+            ## removed isn't judged until the next clean-up.
+            inv = self.inv
+            uses = inv.useCount[:inv.n]
+            judged = uses > sim.minUsesDiscard
+            if judged.any():
+                order = inv.labels[:inv.n].argsort()
+                ratios = inv.successCount[:inv.n]/np.maximum(uses, 1).astype(float)
+                bad = (judged & (ratios < sim.discardThresh))[order].tolist()
+                labels = inv.labels[:inv.n][order].tolist()
+                i = 0
+                while i < len(labels):
+                    if not bad[i]:
+                        i += 1
+                        continue
+                    lab = labels[i]
+                    self.removeVowel(self.v[inv.rows[lab]])
+                    if sim.events: sim.events.add(EventLog.DISCARD, int(self.id), lab)
+                    if instr: instr.count('discards')
+                    i += 2
+            if instr: t = instr.lap('discard', t)
 
             ## 2. add random vowel with some probability
-            if(random.random() < args.additionProb):
+            if(sim.rng.random() < sim.additionProb):
                 self.addRandomVowel()
+            if instr: t = instr.lap('addition', t)
 
             ## 3. merge vowels that are too close
             self.merge()
+            if instr: instr.lap('merge', t)
 
     '''
     Merge vowels that are too close.  deBoer leaves exactly how this
@@ -316,30 +833,25 @@ class Agent:
         ## if not, we're done.
         ##
 
-        ## helper function to find all vowel pairs close enough to be merged
+        ## the inventory keeps track of all vowel pairs close enough
+        ## to be merged, only re-checking vowels which have moved or
+        ## been added since the last merge (see Inventory.mergePairs).
         ##
         ## another issue comes up here: we're going to decide which
         ## vowel in a pair should be deleted by comparing
         ## successes/uses ratios, but they're undefined if uses=0.
         ## What we'll do is automatically choose the vowel with uses=0
         ## to be deleted if its the member of a pair to be merged.
-        def helper(v):
-            toMerge = []
-            for (v1,v2) in itertools.combinations(v,2):
-                if((acousticDistance(v1.form, v2.form) < args.acousticMergeThresh) or
-                   (articDistance(v1.art, v2.art)<args.articMergeThresh)):
-                    toMerge.append((v1,v2))
-            return toMerge
-
-        toMerge = helper(self.v)
+        sim = self.sim
+        toMerge = self.inv.mergePairs(sim.acousticMergeThresh, sim.articMergeThresh, sim.L)
 
         ## while there are vowels to be merged
         while(toMerge):
             ## choose a pair to merge, at random, from those close enough
-            v1, v2 = random.choice(toMerge)
+            v1, v2 = sim.rng.choice(toMerge)
             lab1, lab2 = v1.label, v2.label
             uses1, uses2 = self.useCount[v1.label], self.useCount[v2.label]
-            acDist = acousticDistance(v1.form, v2.form)
+            acDist = perceptualDistance(v1.perc, v2.perc, sim.L)
             arDist = articDistance(v1.art, v2.art)
 
             # if both have uses=0 or if v2 alone does, discard v2
@@ -353,7 +865,7 @@ class Agent:
                     self.successCount[lab2] += self.successCount[lab1]
                     self.useCount[lab2] += uses1
                     self.removeVowel(v1)
-                if verbose:
+                if sim.verbose:
                     print "agent %s merged vowels %d and %d with %d and %d uses" % (self.id, lab1, lab2, uses1, uses2)
                     print "acoustic dist = %f, artic dist = %f" % (acDist, arDist)
             else:
@@ -371,26 +883,236 @@ class Agent:
                     self.successCount[lab1] += self.successCount[lab2]
                     self.useCount[lab1] += uses2
                     self.removeVowel(v2)
-                if verbose:
+                if sim.verbose:
                     print "agent %s merged vowels %d and %d with %d and %d uses" % (self.id, lab1, lab2, uses1, uses2)
                     print "acoustic dist = %f, artic dist = %f, ratio1 = %f, ratio2 = %f" % (acDist, arDist, ratio1, ratio2)
 
+            if sim.events:
+                ## (the vowel left has taken the other's counts)
+                kept, dropped = (lab1, lab2) if lab1 in self.inv.rows else (lab2, lab1)
+                sim.events.add(EventLog.MERGE, int(self.id), kept, label2=dropped)
+            if sim.instr:
+                sim.instr.count('merges')
+
             ## check if there are still pairs to be merged
-            toMerge = helper(self.v)
+            toMerge = self.inv.mergePairs(sim.acousticMergeThresh, sim.articMergeThresh, sim.L)
        
 ## END AGENT CODE
 ##
 
+
+## all agents of a simulation, for large populations: every agent's
+## vowels are rows of one set of flat arrays (in the order of
+## Inventory.columns()), each agent's in its own segment of them,
+## starting at row self.offsets[i] with room for self.capacities[i]
+## vowels.  an agent gets a segment the first time it's used (an agent
+## that has never interacted takes up no rows), and moves to one twice
+## the size when it runs out of room.
+##
+## population[i] gives agent i, as an Agent whose inventory is a view
+## into its segment (a SegmentInventory).  these handles are kept for
+## the most recently used maxHandles agents only: the agents' vowel
+## counts and next labels are in self.sizes and self.nextLabels, and
+## everything else about an agent is rebuilt from its rows when it's
+## used again.  that doesn't change the game (see Inventory.mergePairs),
+## and self.settled notes agents with no vowels close enough to merge
+## (as after a merge), so that their pairs needn't be checked again.
+## a handle is only good until two other agents have been fetched,
+## which is enough for an interaction.
+class Population(object):
+    def __init__(self, sim, capacity=8, maxHandles=4096):
+        self.sim = sim
+        self.nAgents = sim.nAgents
+        self.capacity = capacity
+        self.maxHandles = maxHandles
+        self.offsets = np.repeat(-1, self.nAgents)
+        self.capacities = np.zeros(self.nAgents, dtype=int)
+        self.sizes = np.zeros(self.nAgents, dtype=int)
+        self.nextLabels = np.ones(self.nAgents, dtype=int)
+        self.settled = np.zeros(self.nAgents, dtype=bool)
+        self.art, self.form, self.perc, self.useCount, self.successCount, self.labels = inventoryColumns(64*capacity)
+        ## first row not in any segment, and segments given up, by size
+        self.end = 0
+        self.free = collections.defaultdict(list)
+        self.handles = {}
+        self.last = None
+
+    def columns(self):
+        return [self.art, self.form, self.perc, self.useCount, self.successCount, self.labels]
+
+    def __len__(self):
+        return self.nAgents
+
+    def __getitem__(self, i):
+        ag = self.handles.get(i)
+        if ag is None:
+            if len(self.handles) >= self.maxHandles:
+                self.evict()
+            if self.offsets[i] < 0:
+                self.offsets[i] = self.allocate(self.capacity)
+                self.capacities[i] = self.capacity
+            ag = self.handles[i] = Agent(str(i+1), self.sim, SegmentInventory(self, i))
+        self.last = i
+        return ag
+
+    ## number of agents which have interacted
+    def nUsed(self):
+        return int((self.offsets >= 0).sum())
+
+    ## copy vowel counts, next labels and whether they're settled of
+    ## the agents with handles to self.sizes, self.nextLabels and
+    ## self.settled
+    def sync(self):
+        for i, ag in self.handles.iteritems():
+            inv = ag.inv
+            self.sizes[i] = inv.n
+            self.nextLabels[i] = inv.nextLabel
+            self.settled[i] = not inv.dirty and not any(inv.partners.itervalues())
+
+    ## drop all handles but the one fetched last
+    def evict(self):
+        self.sync()
+        last = self.handles.get(self.last)
+        self.handles = {} if last is None else {self.last: last}
+
+    ## first row of a new segment for capacity vowels, growing the
+    ## arrays if need be
+    def allocate(self, capacity):
+        if self.free[capacity]:
+            return self.free[capacity].pop()
+        offset = self.end
+        self.end += capacity
+        if self.end > len(self.labels):
+            size = max(2*len(self.labels), self.end)
+            def resized(a):
+                b = np.zeros((size,) + a.shape[1:], dtype=a.dtype)
+                b[:offset] = a[:offset]
+                return b
+            self.art, self.form, self.perc, self.useCount, self.successCount, self.labels = [resized(a) for a in self.columns()]
+            for ag in self.handles.itervalues():
+                ag.inv.bind()
+        return offset
+
+    ## move agent i's n vowels to a new segment for capacity vowels
+    def relocate(self, i, n, capacity):
+        old = self.offsets[i]
+        new = self.allocate(capacity)
+        for a in self.columns():
+            a[new:new+n] = a[old:old+n]
+        self.free[int(self.capacities[i])].append(old)
+        self.offsets[i], self.capacities[i] = new, capacity
+
+    ## agents ids' (all agents' if None) vowel counts and next labels,
+    ## and their vowels' rows, in agent order
+    ##
+    ## output: ids, sizes, next labels (arrays with one entry per
+    ## agent), and the rows as a list of arrays, in the order of
+    ## Inventory.columns()
+    def inventoryArrays(self, ids=None):
+        self.sync()
+        ids = np.arange(self.nAgents) if ids is None else np.asarray(ids)
+        sizes = self.sizes[ids]
+        starts = np.cumsum(sizes) - sizes
+        rows = np.repeat(self.offsets[ids] - starts, sizes) + np.arange(sizes.sum())
+        return ids, sizes, self.nextLabels[ids], [a[rows] for a in self.columns()]
+
+    ## replace the population with the given agents' vowel counts, next
+    ## labels and vowels' rows (as from inventoryArrays, e.g. from a
+    ## checkpoint); agents with no vowels and none given out yet are
+    ## left unused
+    def restore(self, sizes, nextLabels, columns):
+        sizes, nextLabels = np.asarray(sizes), np.asarray(nextLabels)
+        used = (sizes > 0) | (nextLabels > 1)
+        capacities = np.where(used, self.capacity, 0)
+        while (capacities < sizes).any():
+            capacities[capacities < sizes] *= 2
+        offsets = np.cumsum(capacities) - capacities
+        self.end = int(capacities.sum())
+        self.offsets = np.where(used, offsets, -1)
+        self.capacities, self.sizes, self.nextLabels = capacities, sizes.copy(), nextLabels.copy()
+        self.settled = np.zeros(self.nAgents, dtype=bool)
+        starts = np.cumsum(sizes) - sizes
+        rows = np.repeat(offsets - starts, sizes) + np.arange(sizes.sum())
+        new = inventoryColumns(max(self.end, 64*self.capacity))
+        for a, col in zip(new, columns):
+            a[rows] = col
+        self.art, self.form, self.perc, self.useCount, self.successCount, self.labels = new
+        self.free.clear()
+        self.handles = {}
+        self.last = None
+
+    ## bytes taken up by the population: its arrays, and the handles
+    def nbytes(self):
+        return (sum(a.nbytes for a in self.columns() + [self.offsets, self.capacities, self.sizes, self.nextLabels, self.settled]) +
+                sum(agentBytes(ag) for ag in self.handles.itervalues()))
+
+## the inventory of agent i of Population pop: views of the agent's
+## segment of the population's arrays
+class SegmentInventory(Inventory):
+    def __init__(self, pop, i):
+        self.pop = pop
+        self.agent = i
+        self.n = int(pop.sizes[i])
+        self.nextLabel = int(pop.nextLabels[i])
+        self.bind()
+        self.index(pop.sim)
+        if pop.settled[i]:
+            self.dirty.clear()
+
+    ## (re)make the views of the segment, e.g. once it's moved
+    def bind(self):
+        start = self.pop.offsets[self.agent]
+        end = start + self.pop.capacities[self.agent]
+        self.art, self.form, self.perc, self.useCount, self.successCount, self.labels = [a[start:end] for a in self.pop.columns()]
+
+    ## move to a segment twice the size
+    def grow(self):
+        self.pop.relocate(self.agent, self.n, 2*len(self.labels))
+        self.bind()
+
+## vowel counts, next labels and vowels' rows of agents ids (all if
+## None) of a population, either a list of Agents or a Population (see
+## Population.inventoryArrays)
+def inventoryArrays(agents, ids=None):
+    if isinstance(agents, Population):
+        return agents.inventoryArrays(ids)
+    ids = np.arange(len(agents)) if ids is None else np.asarray(ids)
+    invs = [agents[i].inv for i in ids]
+    columns = [np.concatenate([inv.columns()[c][:inv.n] for inv in invs]) for c in range(len(invs[0].columns()))]
+    return ids, np.array([inv.n for inv in invs], dtype=int), np.array([inv.nextLabel for inv in invs], dtype=int), columns
+
+## (approximate) bytes taken up by agent ag: its objects, and its
+## inventory's arrays (only their headers, if they're views)
+def agentBytes(ag):
+    inv = ag.inv
+    return (sys.getsizeof(ag) + sys.getsizeof(ag.useCount) + sys.getsizeof(ag.successCount) +
+            sys.getsizeof(inv) + sys.getsizeof(inv.__dict__) + sum(sys.getsizeof(a) for a in inv.columns()) +
+            sys.getsizeof(inv.vowels) + sum(sys.getsizeof(v) for v in inv.vowels) + sys.getsizeof(inv.rows) +
+            sys.getsizeof(inv.partners) + sum(sys.getsizeof(p) for p in inv.partners.itervalues()) + sys.getsizeof(inv.dirty))
+
+## bytes taken up by a population (a list of Agents or a Population)
+def populationBytes(agents):
+    if isinstance(agents, Population):
+        return agents.nbytes()
+    return sum(agentBytes(ag) for ag in agents)
+
 ## calculate bark (formula from de Boer)
 ##
 ## f: Hz
 ## output: bark
-def bark(f):
+def calBark(f):
     if f>271.32:
         return math.log(f/271.32)/0.1719 + 2
     else:
         return (f-51)/110
 
+## bark of f (Hz): looked up in barkTable for integer frequencies (as
+## the synthesizer gives), else calculated
+def bark(f):
+    if f.__class__ is int and barkLo <= f <= barkHi:
+        return barkTable[f - barkLo]
+    return calBark(f)
+
 ## articulatory synthesizer from deBoer
 ##
 ## v: articulation of a vowel ([height, backness, roundness] list)
@@ -434,16 +1156,28 @@ def F2prime(formants):
 
     return F2prime
 
+## perceptual coordinates of a vowel: F1 (bark) and F2' (bark)
+##
+## form: [F1, F2, F3, F4] (in Hz)
+##
+def percept(form):
+    return (bark(form[0]), F2prime(form))
+
+## calculate perceptual distance between two vowels (p. 449), from
+## their perceptual coordinates (see percept)
+##
+## L: weighting of F2' difference vs F1 difference (lambda)
+##
+def perceptualDistance(perc1, perc2, L=0.3):
+    return math.sqrt((perc1[0] - perc2[0])**2 + L*(perc1[1] - perc2[1])**2)
+
 ## calculate perceptual distance between two vowels (p. 449)
 ##
 ## form1, form2: 2 sets of formants (Hz)
+## L: weighting of F2' difference vs F1 difference (lambda)
 ##
-def acousticDistance(form1, form2):
-    ## formants in bark
-    F1a, F1b = bark(form1[0]), bark(form2[0])
-    F2primea, F2primeb = F2prime(form1), F2prime(form2)
-
-    return math.sqrt((F1a - F1b)**2 + L*(F2primea - F2primeb)**2)
+def acousticDistance(form1, form2, L=0.3):
+    return perceptualDistance(percept(form1), percept(form2), L)
 
 ## articulatory distance (euclidean distance along artic dimensions)
 ## art1, art2: articulations of two vowels ([height, backness, roundness] lists)
@@ -452,107 +1186,1685 @@ def articDistance(art1, art2):
     return math.sqrt((art1[0] - art2[0])**2 + (art1[1] - art2[1])**2 + (art1[2] - art2[2])**2)
 
 
+## vectorized synthesis and perception: the functions above for arrays
+## of articulations (..., 3), formants (..., 4) and perceptual
+## coordinates (..., 2), giving exactly the same results.  used for
+## finding the closest vowel, merging, the inverse map and the
+## ensemble backend.
+##
+
+## synthesizer (calFormFreq) for an array of articulations (..., 3):
+## formants (..., 4), truncated to ints
+def calFormFreqs(art):
+    h, b, r = art[..., 0], art[..., 1], art[..., 2]
+    hh, bb = h*h, b*b
+    formants = np.empty(art.shape[:-1] + (4,), dtype=int)
+    formants[..., 0] = ((- 392+ 392*r)*hh + ( 596- 668*r)*h + (- 146+ 166*r))*bb  + (( 348- 348*r)*hh + (- 494+ 606*r)*h + ( 141- 175*r))*b + (( 340-  72*r)*hh + (- 796+ 108*r)*h + ( 708-  38*r))
+    formants[..., 1] = ((-1200+1208*r)*hh + (1320-1328*r)*h + (  118- 158*r))*bb + ((1864-1488*r)*hh + (-2644+1510*r)*h + (-561+ 221*r))*b + ((-670+ 490*r)*hh + ( 1355- 697*r)*h + (1517- 117*r))
+    formants[..., 2] = ((  604- 604*r)*hh + (1038-1178*r)*h + (  246+ 566*r))*bb + ((-1150+1262*r)*hh + (-1443+1313*r)*h + (-317- 483*r))*b + ((1130- 836*r)*hh + (- 315+  44*r)*h + (2427- 127*r))
+    formants[..., 3] = ((-1120+  16*r)*hh + (1696- 180*r)*h + (  500+ 522*r))*bb + ((- 140+ 240*r)*hh + (- 578+ 214*r)*h + (-692- 419*r))*b + ((1480- 602*r)*hh + (-1220+ 289*r)*h + (3678- 178*r))
+    return formants
+
+## bark of every integer frequency the synthesizer can give (over a
+## grid of articulations, plus a margin): barkTable[f - barkLo] is
+## calBark(f), for barkLo <= f <= barkHi
+def makeBarkTable(steps=41, margin=100):
+    vals = np.linspace(0, 1, steps)
+    grid = np.concatenate([a[..., None] for a in np.meshgrid(vals, vals, vals, indexing='ij')], axis=-1)
+    form = calFormFreqs(grid)
+    lo, hi = max(int(form.min()) - margin, 0), int(form.max()) + margin
+    return lo, hi, [calBark(f) for f in range(lo, hi+1)]
+
+barkLo, barkHi, barkTable = makeBarkTable()
+barkArray = np.array(barkTable, dtype=float)
+
+## bark of an array of frequencies: looked up in barkTable for ints,
+## else calculated (like calBark, ints under 271.32 Hz are divided as
+## ints)
+def barks(f):
+    if f.dtype.kind in 'iu':
+        inTable = (f >= barkLo) & (f <= barkHi)
+        if inTable.all():
+            return barkArray[f - barkLo]
+        low = (f - 51)//110
+    else:
+        inTable = None
+        low = (f - 51)/110
+    b = np.where(f > 271.32, np.log(np.maximum(f, 271.32)/271.32)/0.1719 + 2, low)
+    if inTable is not None:
+        b[inTable] = barkArray[f[inTable] - barkLo]
+    return b
+
+## effective second formant (F2prime) of an array of formants (..., 4),
+## choosing between F2prime's four cases for each element
+def F2primes(form):
+    c = 3.5
+    F2, F3, F4 = barks(form[..., 1]), barks(form[..., 2]), barks(form[..., 3])
+    w1 = (c - F3+F2)/c
+    w2 = (F4-2*F3+F2)/(F4-F2)
+    return np.where(F3-F2 > c, F2,
+                    np.where(F4-F2 > c, ((2-w1)*F2 + w1*F3)/2.0,
+                             np.where(F3-F2 < F4-F3, (w2*F2 + (2-w2)*F3)/2.0 - 1.0,
+                                      ((2+w2)*F3 - w2*F4)/2.0 - 1.0)))
+
+## perceptual coordinates (percept) of an array of formants (..., 4):
+## (..., 2)
+def percepts(form):
+    perc = np.empty(form.shape[:-1] + (2,))
+    perc[..., 0] = barks(form[..., 0])
+    perc[..., 1] = F2primes(form)
+    return perc
+
+## perceptual distances (perceptualDistance) between arrays of
+## perceptual coordinates, broadcast against each other: e.g. one
+## (2,) against many (n, 2), or all pairs of (n, 1, 2) and (m, 2)
+def perceptualDistances(perc1, perc2, L=0.3):
+    return np.sqrt((perc1[..., 0] - perc2[..., 0])**2 + L*(perc1[..., 1] - perc2[..., 1])**2)
+
+## acoustic distances (acousticDistance) between formants form1 and
+## forms form2: one-to-many if form1 is one set of formants (4,) and
+## form2 many (n, 4), giving n distances; many-to-many if both are
+## (n, 4) and (m, 4), giving an (n, m) array
+def acousticDistances(form1, form2, L=0.3):
+    perc1, perc2 = percepts(np.asarray(form1)), percepts(np.asarray(form2))
+    if perc1.ndim == 2:
+        perc1 = perc1[:, None, :]
+    return perceptualDistances(perc1, perc2, L)
+
+
 ## return (up to) 6 neighbors of this articulation, and their
-## corresponding formant values
+## corresponding formant values and perceptual coordinates
 ##
 ## Ex: [0.2, 0.5, 1] for articEps = 0.1 has 5 neighbors:
 ##  -- [0.1, 0.5, 1], [0.3, 0.5, 1], [0.2, 0.4, 1], [0.2, 0.6, 1], [0.2, 0.5, 0.9]
-def neighbors(art):
+##
+## synth: function giving formants and perceptual coordinates of an
+## articulation (default: synthesize, i.e. no cache)
+def neighbors(art, articEps=0.03, synth=None):
+    synth = synth or synthesize
     neighbs = []
     ## for height, back, roundness
     for i in [0,1,2]:
         ## subtract articEps from this dimension if not 0, but set to
         ## 0 if you would get number <0
         if art[i]>0:
-            temp = copy.copy(art)
+            temp = art[:]
             temp[i] = (art[i]-articEps) if art[i]>articEps else 0
             neighbs.append(temp)
         ## add articEps from this dimension if not 1, but set to
         ## 1 if you would get a number >1
         if art[i]<1:
-            temp = copy.copy(art)
+            temp = art[:]
             temp[i] = (art[i]+articEps) if art[i]<(1-articEps) else 1
             neighbs.append(temp)
     
-    return zip(neighbs, [calFormFreq(nb) for nb in neighbs])
+    return [(nb,) + synth(nb) for nb in neighbs]
+
+
+## bounded cache for the articulatory synthesizer.
+##
+## maps an articulation, quantized to a grid of size quantum, to its
+## formants and perceptual coordinates, evicting the least recently
+## used entry once maxSize entries are stored. hits and misses are
+## counted, to check how well the cache is doing.
+class SynthCache:
+    def __init__(self, maxSize, quantum=1e-9):
+        self.maxSize = maxSize
+        self.quantum = quantum
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, art):
+        q = self.quantum
+        return (int(round(art[0]/q)), int(round(art[1]/q)), int(round(art[2]/q)))
+
+    ## return (formants, perceptual coordinates) of articulation art
+    def lookup(self, art):
+        k = self.key(art)
+        entry = self.entries.pop(k, None)
+        if entry is None:
+            self.misses += 1
+            form = calFormFreq(art)
+            entry = (form, percept(form))
+            if len(self.entries) >= self.maxSize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+        ## (re)insert as most recently used
+        self.entries[k] = entry
+        return entry
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits)/lookups if lookups else 0.0
+
+    def __str__(self):
+        return "synth cache: %d entries, %d hits, %d misses, hit rate=%f" % (len(self.entries), self.hits, self.misses, self.hitRate())
+
+## synthesizer caches, by size.  formants only depend on
+## articulation, so all simulations in a process can share a cache.
+synthCaches = {}
+
+def getSynthCache(maxSize):
+    if maxSize not in synthCaches:
+        synthCaches[maxSize] = SynthCache(maxSize)
+    return synthCaches[maxSize]
+
+## return formants and perceptual coordinates of articulation art
+## (see Simulation.synthesize for the cached version)
+def synthesize(art):
+    form = calFormFreq(art)
+    return form, percept(form)
+
+## find a vowel near a signal A (formants) by talking to self: starting
+## from articulation start, shift closer to A using shiftCloser until
+## converge on a point where all neighbors are no closer to A.
+##
+## sim: Simulation the vowel is for
+## output: a new vowel with the articulation and formants converged
+## on, and the number of shifts made
+def hillClimb(A, start, sim):
+    if sim.jit is not None:
+        art, form, perc, steps = sim.jit.hillClimb(A, start, sim.articEps, sim.L)
+        vNew = Vowel(sim)
+        vNew.place(art, form, perc)
+        if sim.instr:
+            sim.instr.count('hillClimbs')
+            sim.instr.count('hillClimbSteps', steps)
+        return vNew, steps
+
+    v = Vowel(sim)
+    v.setArt(start)
+
+    newArt = start
+    v.shiftCloser(A)
+    steps = 1
+
+    while(newArt != v.art):
+        newArt = v.art
+        v.shiftCloser(A)
+        steps += 1
+
+    vNew = Vowel(sim)
+    vNew.setArt(newArt)
+
+    if sim.instr:
+        sim.instr.count('hillClimbs')
+        sim.instr.count('hillClimbSteps', steps)
+
+    return vNew, steps
+
+
+## values along one articulatory dimension that the hill-climb from
+## schwa can reach by the steps of neighbors: from 0.5 in steps of eps,
+## clipped to 0 and 1, and from there back again (which gives values
+## off the steps from 0.5).
+##
+## output: array of the values, sorted, and arrays of the index of the
+## value a step down and a step up from each leads to (-1 if none)
+def climbValues(eps):
+    def steps(x):
+        return ([(x-eps) if x > eps else 0] if x > 0 else []) + ([(x+eps) if x < (1-eps) else 1] if x < 1 else [])
+    vals = set([0.5])
+    todo = [0.5]
+    while todo:
+        for y in steps(todo.pop()):
+            if y not in vals:
+                vals.add(y)
+                todo.append(y)
+    vals = sorted(vals)
+    index = dict((x, i) for i, x in enumerate(vals))
+    down = [index[(x-eps) if x > eps else 0] if x > 0 else -1 for x in vals]
+    up = [index[(x+eps) if x < (1-eps) else 1] if x < 1 else -1 for x in vals]
+    return np.array(vals), np.array(down), np.array(up)
+
+
+## precomputed inverse of the articulatory synthesizer, for finding
+## the articulation closest to a signal without hill-climbing all the
+## way from schwa.
+##
+## articulations on the lattice the hill-climb from schwa can reach
+## (see climbValues; using every stride-th value if there are more than
+## maxVals per dimension) are synthesized once, and indexed by a grid over
+## perceptual space (F1 in bark, F2' scaled by sqrt(L), so that
+## euclidean distance is perceptual distance).  nearest() gives the
+## closest lattice point, which findPhoneme refines with a short
+## hill-climb.
+class InverseMap:
+    def __init__(self, articEps, L, cellSize=0.02, maxVals=128):
+        self.L = L
+        vals = climbValues(articEps)[0]
+        stride = int(math.ceil(len(vals)/float(maxVals)))
+        if stride > 1:
+            vals = np.unique(np.append(vals[::stride], vals[-1]))
+
+        ## (an array rather than lists, as there are up to maxVals**3)
+        self.arts = np.stack(np.meshgrid(vals, vals, vals, indexing='ij'), axis=-1).reshape(-1, 3)
+        percs = percepts(calFormFreqs(self.arts))
+        self.points = np.column_stack([percs[:,0], math.sqrt(self.L)*percs[:,1]])
+
+        ## bucket points by grid cell (sorting them by cell, stably, so
+        ## that each bucket holds its points in lattice order)
+        self.cellSize = cellSize
+        cells = np.floor(self.points/cellSize).astype(int)
+        self.cellMin, self.cellMax = cells.min(axis=0), cells.max(axis=0)
+        order = np.lexsort((cells[:,1], cells[:,0]))
+        cells = cells[order]
+        cuts = np.flatnonzero((np.diff(cells, axis=0) != 0).any(axis=1)) + 1
+        self.buckets = dict((tuple(c), ix) for c, ix in zip(cells[np.append(0, cuts)].tolist(), np.split(order, cuts)))
+
+        ## verification counts
+        self.checked = 0
+        self.differ = 0
+        self.closer = 0
+        self.further = 0
+        self.refSteps = 0
+        self.steps = 0
+
+    ## lattice articulation perceptually closest to perceptual
+    ## coordinates perc
+    def nearest(self, perc):
+        q = np.array([perc[0], math.sqrt(self.L)*perc[1]])
+        cx, cy = np.floor(q/self.cellSize).astype(int).tolist()
+
+        ## search rings of cells around q's cell until no cell further
+        ## out can hold a closer point
+        maxRing = max(abs(cx - self.cellMin[0]), abs(cx - self.cellMax[0]), abs(cy - self.cellMin[1]), abs(cy - self.cellMax[1]))
+        best, bestDist = None, float('inf')
+        for r in range(maxRing+1):
+            if r > 0 and bestDist <= (r-1)*self.cellSize:
+                break
+            for c in ringCells(cx, cy, r):
+                ix = self.buckets.get(c)
+                if ix is None:
+                    continue
+                d = ((self.points[ix] - q)**2).sum(axis=1)
+                i = d.argmin()
+                if d[i] < bestDist**2:
+                    best, bestDist = ix[i], math.sqrt(d[i])
+        return self.arts[best].tolist()
+
+    ## note whether vowel vNew found using the inverse map differs
+    ## from vowel vRef found by hill-climbing from schwa: in
+    ## articulation, and in being perceptually closer or further from
+    ## signal A.  (the synthesizer is many-to-one, so the two can
+    ## differ in articulation while being equally close to A.)  also
+    ## counts the steps the two hill-climbs took, refSteps and steps.
+    def verify(self, A, vRef, vNew, refSteps=0, steps=0):
+        self.checked += 1
+        self.refSteps += refSteps
+        self.steps += steps
+        if vRef.art != vNew.art:
+            self.differ += 1
+            percA = percept(A)
+            refDist, newDist = perceptualDistance(percA, vRef.perc, self.L), perceptualDistance(percA, vNew.perc, self.L)
+            if newDist < refDist:
+                self.closer += 1
+            elif newDist > refDist:
+                self.further += 1
+
+    def __str__(self):
+        checked = max(self.checked, 1)
+        return "inverse map: %d lattice points; %d checked against hill-climb, %d differ in articulation (%f): %d closer to the signal (%f), %d further (%f); steps per climb %f from the map, %f from schwa" % (len(self.arts), self.checked, self.differ, float(self.differ)/checked, self.closer, float(self.closer)/checked, self.further, float(self.further)/checked, float(self.steps)/checked, float(self.refSteps)/checked)
+
+## cells at chebyshev distance r from cell (cx, cy)
+def ringCells(cx, cy, r):
+    if r == 0:
+        return [(cx, cy)]
+    cells = []
+    for i in range(-r, r+1):
+        cells.extend([(cx+i, cy-r), (cx+i, cy+r)])
+    for j in range(-r+1, r):
+        cells.extend([(cx-r, cy+j), (cx+r, cy+j)])
+    return cells
+
+## compiled kernels, by name ('numba': kernelsDeBoer), or None for
+## 'python', or if they can't be loaded (so the python functions are
+## used).  loaded once per process.
+kernelBackends = {'python': None}
+
+def getKernels(name):
+    if name not in kernelBackends:
+        try:
+            import kernelsDeBoer
+            kernelBackends[name] = kernelsDeBoer
+        except ImportError as e:
+            print "can't load %s kernels (%s), using python" % (name, e)
+            kernelBackends[name] = None
+    return kernelBackends[name]
+
+## inverse maps built so far, by (articEps, L)
+inverseMaps = {}
+
+def getInverseMap(eps, L):
+    if (eps, L) not in inverseMaps:
+        inverseMaps[(eps, L)] = InverseMap(eps, L)
+    return inverseMaps[(eps, L)]
 
 
 ###
-### play the imitation game
+### writing snapshots of agents' vowel prototypes
 ###
-def game():
-    ## write to the csv file every storeIvl iterations, plus last one
-    storeIts = range(0, nIts, args.storeIvl)
-    storeIts = storeIts[1:]
 
-    if(not (nIts in  storeIts)):
-        storeIts.append(nIts)
+## columns of the output (one row per vowel per agent per snapshot)
+snapshotColumns = ['run', 'time','agent','vowel id','height','backness','rounding','F1','F2','F3','F4', 'F2prime', 'UseCount', 'SuccessCount']
 
+## output format for file name fileName: format if given, else .npz
+## for files ending in .npz, else .csv
+def outputFormat(fileName, format=None):
+    if format:
+        return format
+    return 'npz' if fileName.endswith('.npz') else 'csv'
 
-    ## start CSV file
-    csvfile =  open(path.abspath(args.csvF), 'w')
-    w = csv.writer(csvfile)
-    w.writerow(['run', 'time','agent','vowel id','height','backness','rounding','F1','F2','F3','F4', 'F2prime', 'UseCount', 'SuccessCount'])
+## write snapshots as rows of a .csv file, a snapshot at a time
+##
+## resume: position in the file returned by mark(), to continue
+## writing an existing file from (dropping anything written after it)
+class CSVSnapshotWriter(object):
+    def __init__(self, fileName, header=True, resume=None):
+        if resume is None:
+            self.f = open(fileName, 'wb', 1 << 20)
+        else:
+            self.f = open(fileName, 'r+b', 1 << 20)
+            self.f.truncate(resume[0])
+            self.f.seek(resume[0])
+        self.w = csv.writer(self.f)
+        if header and resume is None:
+            self.w.writerow(snapshotColumns)
+
+    ## write all agents' (or agents ids') vowel prototypes at time
+    def write(self, runNum, time, agents, ids=None):
+        cols = snapshotArrays(runNum, time, agents, ids)
+        if cols is not None:
+            self.writeArrays(cols)
+
+    ## write rows given as a list of arrays, one per column (see
+    ## snapshotArrays)
+    def writeArrays(self, cols):
+        cols = [c.tolist() for c in cols]
+        for i in (4, 5, 6):
+            cols[i] = [round(x, 4) for x in cols[i]]
+        self.w.writerows(zip(*cols))
+
+    ## append shard shardF, written by a CSVSnapshotWriter without header
+    def appendShard(self, shardF):
+        self.f.flush()
+        with open(shardF, 'rb') as f:
+            shutil.copyfileobj(f, self.f)
+
+    ## flush everything written so far to the file, and return the
+    ## position to resume writing from (see NPZSnapshotWriter.mark)
+    def mark(self):
+        self.f.flush()
+        return self.f.tell(), '', 0
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+## all agents' (or agents ids') vowel prototypes at time, as a list of
+## arrays (one per column in snapshotColumns; articulations not
+## rounded), or None if they have no vowels
+##
+## agents: list of Agents, or Population
+def snapshotArrays(runNum, time, agents, ids=None):
+    ids, sizes, nextLabels, (art, form, perc, useCount, successCount, labels) = inventoryArrays(agents, ids)
+    n = sizes.sum()
+    if not n:
+        return None
+    ## each agent's vowels in label order (the order they were added,
+    ## as the original vowel lists kept them), not the row order
+    ## Inventory.remove's swaps leave
+    order = np.lexsort((labels, np.repeat(np.arange(len(ids)), sizes)))
+    art, form, perc, useCount, successCount, labels = art[order], form[order], perc[order], useCount[order], successCount[order], labels[order]
+    form = form.astype(np.int32)
+    return [np.repeat(np.int32(runNum), n), np.repeat(np.int32(time), n), np.repeat((ids + 1).astype(np.int32), sizes),
+            labels.astype(np.int32),
+            art[:,0], art[:,1], art[:,2],
+            form[:,0], form[:,1], form[:,2], form[:,3],
+            perc[:,1], useCount.astype(np.int32), successCount.astype(np.int32)]
+
+## keep snapshots in memory, as arrays; result() gives a dict mapping
+## column names (see snapshotColumns) to arrays of all rows
+class MemorySnapshotWriter(object):
+    def __init__(self):
+        self.snapshots = []
+
+    def write(self, runNum, time, agents, ids=None):
+        cols = snapshotArrays(runNum, time, agents, ids)
+        if cols is not None:
+            self.writeArrays(cols)
+
+    def writeArrays(self, cols):
+        self.snapshots.append(cols)
+
+    ## append the snapshots in .npz shard shardF
+    def appendShard(self, shardF):
+        for chunk in readSnapshots(shardF):
+            self.snapshots.append([chunk[name] for name in snapshotColumns])
+
+    def close(self):
+        pass
+
+    def result(self):
+        if not self.snapshots:
+            return dict((name, np.zeros(0)) for name in snapshotColumns)
+        return dict((name, np.concatenate([cols[i] for cols in self.snapshots])) for i, name in enumerate(snapshotColumns))
+
+## write snapshots to a compressed .npz file, as chunks of columns:
+## chunk k's column c is array 'chunkK/c' (see readSnapshots).
+## articulations aren't rounded, unlike in .csv files.
+##
+## rows are buffered, and written once there are chunkRows of them, so
+## a run never has to be held in memory.
+##
+## resume: position returned by mark(), to continue writing an
+## existing file from (dropping any chunks written after it)
+class NPZSnapshotWriter(object):
+    def __init__(self, fileName, chunkRows=100000, resume=None):
+        self.fileName = fileName
+        self.nChunks = 0
+        if resume is None:
+            self.zf = zipfile.ZipFile(fileName, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        else:
+            ## put back the zip directory as it was at the mark
+            pos, directory, self.nChunks = resume
+            with open(fileName, 'r+b') as f:
+                f.truncate(pos)
+                f.seek(pos)
+                f.write(directory)
+            self.zf = zipfile.ZipFile(fileName, 'a', zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.chunkRows = chunkRows
+        self.buffered = []
+        self.nBuffered = 0
+
+    def write(self, runNum, time, agents, ids=None):
+        cols = snapshotArrays(runNum, time, agents, ids)
+        if cols is not None:
+            self.writeArrays(cols)
+
+    def writeArrays(self, cols):
+        self.buffered.append(cols)
+        self.nBuffered += len(cols[0])
+        if self.nBuffered >= self.chunkRows:
+            self.flush()
+
+    ## write buffered rows as a chunk
+    def flush(self):
+        if not self.buffered:
+            return
+        self.nChunks += 1
+        for i, name in enumerate(snapshotColumns):
+            self.writeArray(self.nChunks, name, np.concatenate([cols[i] for cols in self.buffered]))
+        self.buffered = []
+        self.nBuffered = 0
+
+    def writeArray(self, chunk, name, a):
+        buf = io.BytesIO()
+        np.lib.format.write_array(buf, a)
+        self.zf.writestr('chunk%06d/%s.npy' % (chunk, name), buf.getvalue())
+
+    ## append the chunks of shard shardF, written by an NPZSnapshotWriter
+    def appendShard(self, shardF):
+        self.flush()
+        with zipfile.ZipFile(shardF) as shard:
+            members = shard.namelist()
+            for chunk in sorted(set(m.split('/')[0] for m in members)):
+                self.nChunks += 1
+                for m in members:
+                    if m.startswith(chunk + '/'):
+                        self.zf.writestr('chunk%06d/%s' % (self.nChunks, m.split('/', 1)[1]), shard.read(m))
+
+    ## write buffered rows and the zip directory, so that the file is
+    ## complete as it stands, and return the position to resume
+    ## writing from: (offset of the directory, the directory's bytes,
+    ## number of chunks).  chunks written later overwrite the
+    ## directory, so resuming puts it back.
+    def mark(self):
+        self.flush()
+        self.zf.close()
+        self.zf = zipfile.ZipFile(self.fileName, 'a', zipfile.ZIP_DEFLATED, allowZip64=True)
+        pos = self.zf.start_dir
+        with open(self.fileName, 'rb') as f:
+            f.seek(pos)
+            directory = f.read()
+        return pos, directory, self.nChunks
+
+    def fileno(self):
+        return self.zf.fp.fileno()
+
+    def close(self):
+        self.flush()
+        self.zf.close()
+
+## open a snapshot writer of the given format ('csv' or 'npz') on file
+## fileName; .csv shards to be appended to another file are written
+## without a header.  resume: position from the writer's mark(), to
+## continue an existing file from.
+def openSnapshotWriter(fileName, format, chunkRows=100000, shard=False, resume=None):
+    if format == 'npz':
+        return NPZSnapshotWriter(fileName, chunkRows, resume)
+    return CSVSnapshotWriter(fileName, header=not shard, resume=resume)
+
+## read snapshots from .csv or .npz file fileName, in chunks of (about)
+## chunkRows rows.  yields dicts mapping column names (see
+## snapshotColumns) to arrays.
+def readSnapshots(fileName, chunkRows=100000):
+    if outputFormat(fileName) == 'npz':
+        npz = np.load(fileName)
+        for chunk in sorted(set(name.split('/')[0] for name in npz.files)):
+            yield dict((name, npz['%s/%s' % (chunk, name)]) for name in snapshotColumns)
+        npz.close()
+        return
+
+    floatCols = set(['height', 'backness', 'rounding', 'F2prime'])
+    def columns(rows):
+        cols = zip(*rows)
+        return dict((name, np.array(col, dtype=float if name in floatCols else int)) for name, col in zip(snapshotColumns, cols))
+
+    with open(fileName, 'rb') as f:
+        r = csv.reader(f)
+        next(r)
+        rows = []
+        for row in r:
+            rows.append(row)
+            if len(rows) == chunkRows:
+                yield columns(rows)
+                rows = []
+        if rows:
+            yield columns(rows)
+
+
+###
+### population summaries
+###
+
+summaryColumns = ['run', 'time', 'agents', 'vowels', 'meanSize', 'varSize', 'meanSuccess', 'meanEnergy', 'clusters']
+clusterColumns = ['run', 'time', 'cluster', 'vowels', 'agentShare', 'F1bark', 'F2prime', 'sdF1bark', 'sdF2prime']
+summaryIntColumns = set(['run', 'time', 'agents', 'vowels', 'clusters', 'cluster'])
+
+## cluster vowel prototypes with perceptual coordinates perc (n, 2):
+## the densest cells of a grid of cells radius/2 wide (in perceptual
+## distance with weighting L) are taken as centers, skipping any
+## within radius of a denser one; then each prototype goes to its
+## closest center, and centers move to their prototypes' means, a few
+## times over.
+##
+## output: cluster of each prototype (0 the largest, 1 the next, ...),
+## and the clusters' centroids (k, 2)
+def clusterPrototypes(perc, radius=1.0, L=0.3, iterations=3):
+    if not len(perc):
+        return np.zeros(0, dtype=int), np.zeros((0, 2))
+    ## scale F2' so that euclidean distance is perceptual distance
+    scale = np.array([1.0, np.sqrt(L)])
+    x = perc*scale
+    cells = np.floor(x/(radius/2)).astype(np.int64)
+    cells -= cells.min(axis=0)
+    keys, cell, counts = np.unique(cells[:,0]*(cells[:,1].max() + 1) + cells[:,1], return_inverse=True, return_counts=True)
+    means = np.column_stack([np.bincount(cell, x[:,0]), np.bincount(cell, x[:,1])])/counts[:, None]
+    centers = []
+    for c in np.argsort(-counts, kind='mergesort'):
+        if not centers or np.sqrt(((np.array(centers) - means[c])**2).sum(axis=1)).min() > radius:
+            centers.append(means[c])
+    centers = np.array(centers)
+    for i in range(iterations + 1):
+        labels = np.sqrt(((x[:, None] - centers[None])**2).sum(axis=2)).argmin(axis=1)
+        counts = np.bincount(labels, minlength=len(centers))
+        used = counts > 0
+        centers = (np.column_stack([np.bincount(labels, x[:,0], len(centers)), np.bincount(labels, x[:,1], len(centers))])[used]/counts[used][:, None])
+        labels = (np.cumsum(used) - 1)[labels]
+    ## largest first
+    order = np.argsort(-np.bincount(labels), kind='mergesort')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[labels], centers[order]/scale
+
+## summaries of the vowel prototypes in snapshot rows cols (as from
+## snapshotArrays: each (run, time)'s rows together, and each agent's
+## together within them), over agents with vowels:
+##
+## - one row per (run, time), in the order of summaryColumns: number of
+##   agents and vowels, mean and variance of inventory size, mean of
+##   agents' mean success ratio (successes/uses, over vowels used at
+##   least once), mean energy (sum over pairs of an agent's vowels of
+##   1/distance^2, as in plotDeBoer.R) and number of clusters
+## - one row per cluster of prototypes (see clusterPrototypes), in the
+##   order of clusterColumns: number of vowels, fraction of agents with
+##   a vowel in it, and mean and standard deviation of F1 (bark) and F2'
+##
+## output: lists of summary rows and cluster rows
+def summarize(cols, L=0.3, radius=1.0):
+    run, time, agent = cols[0], cols[1], cols[2]
+    perc = np.column_stack([barks(cols[7]), cols[11]])
+    uses, successes = cols[12], cols[13]
+    summaries, clusters = [], []
+    n = len(run)
+    newGroup = np.r_[True, (run[1:] != run[:-1]) | (time[1:] != time[:-1])]
+    bounds = np.r_[np.flatnonzero(newGroup), n]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        p, u, s = perc[start:end], uses[start:end], successes[start:end]
+        newAgent = np.r_[True, agent[start+1:end] != agent[start:end-1]]
+        ag = np.cumsum(newAgent) - 1
+        nAgents = ag[-1] + 1
+        sizes = np.bincount(ag)
+
+        used = u > 0
+        ratioSums = np.bincount(ag[used], s[used]/u[used].astype(float), nAgents)
+        nUsed = np.bincount(ag[used], minlength=nAgents)
+        meanSuccess = (ratioSums[nUsed > 0]/nUsed[nUsed > 0]).mean() if nUsed.any() else float('nan')
+
+        ## energy: pairs of rows k apart within an agent
+        energy = np.zeros(nAgents)
+        with np.errstate(divide='ignore'):
+            for k in range(1, sizes.max()):
+                same = ag[k:] == ag[:-k]
+                d = perceptualDistances(p[k:][same], p[:-k][same], L)
+                energy += np.bincount(ag[k:][same], 1/d**2, nAgents)
+
+        labels, centroids = clusterPrototypes(p, radius, L)
+        runNum, t = int(run[start]), int(time[start])
+        summaries.append([runNum, t, nAgents, end - start, sizes.mean(), sizes.var(), meanSuccess, energy.mean(), len(centroids)])
+        for c, (F1, F2p) in enumerate(centroids.tolist()):
+            members = labels == c
+            clusters.append([runNum, t, c + 1, int(members.sum()), len(np.unique(ag[members]))/float(nAgents), F1, F2p,
+                             p[members, 0].std(), p[members, 1].std()])
+    return summaries, clusters
+
+## summary file and clusters file for output file fileName
+def summaryFiles(fileName):
+    base = path.splitext(fileName)[0]
+    return base + '.summary.csv', base + '.clusters.csv'
+
+## snapshot writer which writes population summaries (see summarize),
+## to summaryFiles(fileName) or (if fileName is None) memory, and
+## passes snapshots on to snapshot writer rows (if not None) too.
+##
+## summaries are of the whole population, even if rows only gets a
+## sample of agents.  resume: as for the snapshot writers, from mark()
+class SummaryWriter(object):
+    columns = [summaryColumns, clusterColumns]
+
+    def __init__(self, sim, fileName=None, rows=None, header=True, resume=None):
+        self.L = sim.L
+        self.radius = sim.clusterRadius
+        self.rows = rows
+        self.files = []
+        self.tables = [[], []]
+        if fileName is not None:
+            for i, (f, columns) in enumerate(zip(summaryFiles(fileName), self.columns)):
+                if resume is None:
+                    f = open(f, 'wb')
+                    if header:
+                        csv.writer(f).writerow(columns)
+                else:
+                    f = open(f, 'r+b')
+                    f.truncate(resume[3+i])
+                    f.seek(resume[3+i])
+                self.files.append(f)
+            self.tables = [csv.writer(table) for table in self.files]
+
+    def write(self, runNum, time, agents, ids=None):
+        cols = snapshotArrays(runNum, time, agents)
+        if cols is None:
+            return
+        self.summarize(cols)
+        if self.rows is not None:
+            if ids is None:
+                self.rows.writeArrays(cols)
+            else:
+                self.rows.write(runNum, time, agents, ids)
+
+    def writeArrays(self, cols):
+        self.summarize(cols)
+        if self.rows is not None:
+            self.rows.writeArrays(cols)
+
+    def summarize(self, cols):
+        for table, rows in zip(self.tables, summarize(cols, self.L, self.radius)):
+            if self.files:
+                table.writerows(rows)
+            else:
+                table.extend(rows)
+
+    ## append shard shardF, and the summaries written alongside it by a
+    ## SummaryWriter without header
+    def appendShard(self, shardF):
+        if self.rows is not None:
+            self.rows.appendShard(shardF)
+        for i, f in enumerate(summaryFiles(shardF)):
+            with open(f, 'rb') as shard:
+                if self.files:
+                    self.files[i].flush()
+                    shutil.copyfileobj(shard, self.files[i])
+                else:
+                    types = [int if name in summaryIntColumns else float for name in self.columns[i]]
+                    self.tables[i].extend([t(x) for t, x in zip(types, row)] for row in csv.reader(shard))
+            os.remove(f)
+
+    ## mark of the rows (or of nothing, if there are none) followed by
+    ## the positions in the summary files, which are flushed to disk
+    def mark(self):
+        mark = self.rows.mark() if self.rows is not None else (0, '', 0)
+        for f in self.files:
+            f.flush()
+            os.fsync(f.fileno())
+        return tuple(mark) + tuple(f.tell() for f in self.files)
+
+    def fileno(self):
+        return self.rows.fileno() if self.rows is not None else self.files[0].fileno()
+
+    def close(self):
+        if self.rows is not None:
+            self.rows.close()
+        for f in self.files:
+            f.close()
+
+    ## rows (as MemorySnapshotWriter.result, or None), and summaries and
+    ## clusters as dicts mapping column names to arrays
+    def result(self):
+        def table(rows, columns):
+            cols = zip(*rows) if rows else [[]]*len(columns)
+            return dict((name, np.array(col, dtype=int if name in summaryIntColumns else float)) for name, col in zip(columns, cols))
+        return {'rows': self.rows.result() if self.rows is not None else None,
+                'summary': table(self.tables[0], summaryColumns), 'clusters': table(self.tables[1], clusterColumns)}
+
+
+###
+### event log
+###
+
+## columns of the event log (see EventLog)
+eventColumns = ['run', 'time', 'kind', 'agent', 'label', 'agent2', 'label2']
+
+## event log file for output file fileName
+def eventFile(fileName):
+    return path.splitext(fileName)[0] + '.events.npz'
+
+## log of everything that changes the agents' inventories as the game
+## is played (sim.eventLog), from which the population at any time can
+## be rebuilt without the perception and hill-climbs of playing the
+## game again (see replayDeBoer.py).  one row per event, giving the run
+## and interaction it happened in, its kind, and the agents (numbered
+## as in the snapshots, from 1) and vowel labels involved:
+##
+## - SUCCESS, FAILURE: agent used its vowel label, which agent2 took
+##   for its vowel label2 (counts go up as in steps 1, 3 and 4)
+## - SHIFT: agent's vowel label moved closer to a signal
+## - RANDOM, NEW: agent added vowel label, at random or near a signal
+## - DISCARD: agent discarded vowel label
+## - MERGE: agent merged vowel label2 into vowel label
+## - END: the run ended (label is 1 if it stopped early, having
+##   converged)
+##
+## the articulation and formants that SHIFT, RANDOM and NEW events
+## leave the vowel with are kept in arrays 'art' and 'form', one row
+## per such event, in order.
+##
+## written as a compressed .npz file like the snapshots (chunk k's
+## column c is array 'chunkK/c'; see readEvents), with the simulation's
+## parameters (params, if given) as 'params.json'.  self.run and
+## self.time are the run and interaction being played.
+class EventLog(NPZSnapshotWriter):
+    SUCCESS, FAILURE, SHIFT, RANDOM, NEW, DISCARD, MERGE, END = range(8)
+
+    def __init__(self, fileName, params=None, chunkRows=100000, resume=None):
+        NPZSnapshotWriter.__init__(self, fileName, chunkRows, resume)
+        if params is not None and resume is None:
+            self.zf.writestr('params.json', json.dumps(params, sort_keys=True))
+        self.run, self.time = 0, 0
+        self.events, self.arts, self.forms = [], [], []
+
+    ## log an event of kind; vow: the vowel a SHIFT, RANDOM or NEW
+    ## event leaves
+    def add(self, kind, agent, label, agent2=0, label2=0, vow=None):
+        self.events.append((self.run, self.time, kind, agent, label, agent2, label2))
+        if vow is not None:
+            self.arts.append(vow.art)
+            self.forms.append(vow.form)
+        if len(self.events) >= self.chunkRows:
+            self.flush()
+
+    ## write logged events as a chunk
+    def flush(self):
+        if not self.events:
+            return
+        self.nChunks += 1
+        events = np.array(self.events, dtype=np.int32)
+        for i, name in enumerate(eventColumns):
+            self.writeArray(self.nChunks, name, events[:, i].astype(np.int8) if name == 'kind' else events[:, i])
+        self.writeArray(self.nChunks, 'art', np.array(self.arts, dtype=float).reshape(-1, 3))
+        self.writeArray(self.nChunks, 'form', np.array(self.forms, dtype=np.int16).reshape(-1, 4))
+        self.events, self.arts, self.forms = [], [], []
+
+## read event log fileName (see EventLog) a chunk at a time.  yields
+## dicts mapping column names (see eventColumns), 'art' and 'form' to
+## arrays.
+def readEvents(fileName):
+    npz = np.load(fileName)
+    for chunk in sorted(set(name.split('/')[0] for name in npz.files if '/' in name)):
+        yield dict((name, npz['%s/%s' % (chunk, name)]) for name in eventColumns + ['art', 'form'])
+    npz.close()
+
+## parameters of the simulation logged in event log fileName
+def eventParams(fileName):
+    with zipfile.ZipFile(fileName) as zf:
+        return json.loads(zf.read('params.json'))
+
+
+###
+### instrumentation
+###
+
+## opt-in instrumentation of a run of the game (sim.profile): time
+## spent in each phase of the interactions, and counts of events, plus
+## a progress line every progressIvl interactions.
+##
+## while a run is played, sim.instr holds its Instruments, or None if
+## instrumentation is off (so that all the code being instrumented
+## pays is checking that).
+class Instruments(object):
+    phases = ['step1', 'step2', 'step3', 'step4', 'discard', 'addition', 'merge', 'snapshot']
+    events = ['successes', 'failures', 'discards', 'merges', 'randomAdditions', 'nonRandomAdditions', 'hillClimbs', 'hillClimbSteps']
+
+    def __init__(self, runNum, nIts, progressIvl):
+        self.runNum = runNum
+        self.nIts = nIts
+        self.progressIvl = progressIvl
+        self.seconds = dict.fromkeys(self.phases, 0.0)
+        self.counts = dict.fromkeys(self.events, 0)
+        self.interactions = 0
+        self.start = timeit.default_timer()
+
+    clock = staticmethod(timeit.default_timer)
+
+    ## add time since t to phase, returning the time now
+    def lap(self, phase, t):
+        now = timeit.default_timer()
+        self.seconds[phase] += now - t
+        return now
+
+    def count(self, event, n=1):
+        self.counts[event] += n
+
+    ## note that interaction number time is done, printing progress
+    ## every progressIvl interactions
+    def tick(self, time):
+        self.interactions = time
+        if self.progressIvl and time % self.progressIvl == 0:
+            elapsed = timeit.default_timer() - self.start
+            rate = time/elapsed if elapsed else 0.0
+            eta = (self.nIts - time)/rate if rate else 0.0
+            print "run %d: %d/%d interactions (%d%%), %.0f interactions/s, ETA %d:%02d:%02d" % (self.runNum, time, self.nIts, 100*time/self.nIts, rate, eta/3600, (eta % 3600)/60, eta % 60)
+
+    ## summary of the run, as a dict (for writing as JSON)
+    def summary(self):
+        elapsed = timeit.default_timer() - self.start
+        return {'run': self.runNum, 'interactions': self.interactions, 'seconds': elapsed,
+                'interactionsPerSecond': self.interactions/elapsed if elapsed else 0.0,
+                'phaseSeconds': self.seconds, 'events': self.counts}
+
+## write run summaries (from Instruments.summary), as one line of JSON
+## per run, to file statsF or (if None) stdout
+def writeStats(stats, statsF=None, mode='w'):
+    f = open(statsF, mode) if statsF else sys.stdout
+    for summary in stats:
+        f.write(json.dumps(summary, sort_keys=True) + '\n')
+    if statsF:
+        f.close()
+
+
+###
+### convergence
+###
+
+## opt-in convergence monitor for a run of simulation sim
+## (sim.convergeWindow): at the end of every window of
+## sim.convergeWindow interactions, compares the fraction of successful
+## interactions in the window, the population's mean inventory size,
+## and how far the vowels have moved (mean articulatory distance, over
+## vowels present at the start and end of the window) with the previous
+## window.  the run has converged once sim.convergePatience windows in a
+## row are within tolerances.
+class ConvergenceMonitor(object):
+    def __init__(self, sim):
+        self.window = sim.convergeWindow
+        self.tolSuccess, self.tolSize, self.tolShift = sim.convergeSuccess, sim.convergeSize, sim.convergeShift
+        self.patience = sim.convergePatience
+        self.successes = 0
+        self.stable = 0
+        self.prev = None
+
+    def record(self, success):
+        self.successes += success
+
+    ## note that the window ending at interaction number time is done,
+    ## with agents agents
+    ##
+    ## output: whether the run has converged
+    def check(self, time, agents):
+        if time % self.window:
+            return False
+        success = self.successes/float(self.window)
+        ids, sizes, nextLabels, columns = inventoryArrays(agents)
+        size = sizes.mean()
+        protos = (sizes, columns[5], columns[0])
+        if self.prev is not None:
+            prevSuccess, prevSize, prevProtos = self.prev
+            if abs(success - prevSuccess) <= self.tolSuccess and abs(size - prevSize) <= self.tolSize and movement(prevProtos, protos) <= self.tolShift:
+                self.stable += 1
+            else:
+                self.stable = 0
+        self.prev = (success, size, protos)
+        self.successes = 0
+        return self.stable >= self.patience
+
+    ## state of the monitor, as a dict of arrays (for checkpoints)
+    def state(self):
+        state = {'successes': self.successes, 'stable': self.stable}
+        if self.prev is not None:
+            success, size, (sizes, labels, art) = self.prev
+            state.update(success=success, size=size, sizes=sizes, labels=labels, art=art)
+        return state
+
+    ## restore state from state() (e.g. loaded from a checkpoint)
+    def restore(self, state):
+        self.successes, self.stable = int(state['successes']), int(state['stable'])
+        self.prev = None
+        if 'sizes' in state:
+            self.prev = (float(state['success']), float(state['size']), (state['sizes'], state['labels'], state['art']))
+
+## mean articulatory distance moved by vowels between two states of a
+## population, each (vowels per agent, labels, articulations) with
+## agents' vowels in agent order, over vowels (by agent and label) in
+## both; infinite if there are none
+def movement(protos1, protos2):
+    def keys(sizes, labels):
+        return (np.repeat(np.arange(len(sizes)), sizes) << 32) | labels
+    (sizes1, labels1, art1), (sizes2, labels2, art2) = protos1, protos2
+    common, i1, i2 = np.intersect1d(keys(sizes1, labels1), keys(sizes2, labels2), assume_unique=True, return_indices=True)
+    dists = np.sqrt(((art1[i1] - art2[i2])**2).sum(axis=1))
+    return dists.mean() if len(dists) else float('inf')
+
+## where and why each run stopped (with sim.convergeWindow): one row
+## per run, in the order of stopColumns, giving the interaction it
+## stopped after, and why: 'converged', or 'nIts' if it played them all
+stopColumns = ['run', 'time', 'reason']
+
+def stopFile(fileName):
+    return path.splitext(fileName)[0] + '.stops.csv'
+
+## write where runs stopped to stopFile(fileName), with a header unless
+## it's a shard to be appended to another.  resumeRun: the run a game
+## resumes from, to keep only the rows of runs before it.
+class StopLog(object):
+    def __init__(self, fileName, header=True, resumeRun=None):
+        self.fileName = stopFile(fileName)
+        if resumeRun is not None and path.exists(self.fileName):
+            with open(self.fileName, 'rb') as f:
+                rows = list(csv.reader(f))
+            self.f = open(self.fileName, 'wb')
+            self.table = csv.writer(self.f)
+            self.table.writerows(rows[:1] + [row for row in rows[1:] if int(row[0]) < resumeRun])
+        else:
+            self.f = open(self.fileName, 'wb')
+            self.table = csv.writer(self.f)
+            if header:
+                self.table.writerow(stopColumns)
 
+    def write(self, runNum, time, converged):
+        self.table.writerow([runNum, time, 'converged' if converged else 'nIts'])
 
-    for i in range(args.nRuns):
-        runNum = i+1
+    ## append the row of the shard written alongside shard file shardF
+    ## (by a StopLog without header)
+    def appendShard(self, shardF):
+        with open(stopFile(shardF), 'rb') as shard:
+            self.f.flush()
+            shutil.copyfileobj(shard, self.f)
 
+    ## flush the rows written so far (a game resuming keeps those of
+    ## runs before its own, so no position is needed)
+    def mark(self):
+        self.f.flush()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+
+###
+### checkpoints
+###
+
+## parameters which don't change the output, so can differ between a
+## checkpoint and the game resuming from it
+checkpointFreeParams = ['verbose', 'profile', 'statsF', 'progressIvl', 'workers', 'checkpointIvl', 'checkpointDir', 'checkpointKeep', 'resume', 'seed', 'flatPopulation']
+
+## save checkpoints of a game to directory dirName, keeping the keep
+## most recent.  a checkpoint is an .npz file holding every agent's
+## inventory (its columns concatenated over agents, plus the number of
+## vowels of each agent), the run number, number of interactions done,
+## the state of the random number generator, the master seed, the
+## simulation parameters and the position in the output file.
+##
+## the population is copied when save() is called, but written to disk
+## in a background thread, so the game only waits for the copy (and
+## for the previous checkpoint, if it's still being written).
+class Checkpointer(object):
+    def __init__(self, dirName, keep=2):
+        self.dirName = dirName
+        self.keep = keep
+        self.thread = None
+        if not path.isdir(dirName):
+            os.makedirs(dirName)
+        ## checkpoints left half-written when a game was interrupted
+        for name in os.listdir(dirName):
+            if name.endswith('.npz.tmp'):
+                os.remove(path.join(dirName, name))
+
+    ## remove all checkpoints, e.g. when starting a new game
+    def clear(self):
+        for name in listCheckpoints(self.dirName):
+            os.remove(path.join(self.dirName, name))
+
+    ## save a checkpoint of run runNum of simulation sim after interaction
+    ## number time, with snapshots so far written to snapshot writer w
+    def save(self, sim, runNum, time, agents, w, monitor=None):
+        rngBlocks, rngPositions = sim.rng.state()
+        mark = w.mark()
+        pos, directory, nChunks = mark[:3]
+        files = [w]
+        ids, sizes, nextLabels, columns = inventoryArrays(agents)
+        arrays = dict(('inv_%d' % i, a) for i, a in enumerate(columns))
+        arrays.update(
+            sizes=sizes, nextLabels=nextLabels,
+            run=runNum, time=time, seed=sim.seed,
+            params=json.dumps(dict((k, v) for k, v in sim.params().items() if k not in checkpointFreeParams), sort_keys=True),
+            rngBlocks=rngBlocks, rngPositions=rngPositions,
+            writerPos=pos, writerDirectory=np.frombuffer(directory, dtype=np.uint8), writerChunks=nChunks,
+            writerSummaries=np.array(mark[3:], dtype=np.int64))
+        if monitor:
+            arrays.update(('monitor_' + k, v) for k, v in monitor.state().items())
+        if sim.events:
+            eventsPos, eventsDirectory, eventsChunks = sim.events.mark()
+            arrays.update(eventsPos=eventsPos, eventsDirectory=np.frombuffer(eventsDirectory, dtype=np.uint8), eventsChunks=eventsChunks)
+            files.append(sim.events)
+        if sim.stops:
+            sim.stops.mark()
+            files.append(sim.stops)
+
+        ## output written so far must reach the disk before the
+        ## checkpoint refers to it; the writers may be closed by then,
+        ## so sync copies of their file descriptors
+        fds = [os.dup(f.fileno()) for f in files]
+        fileName = path.join(self.dirName, 'run%06d_time%010d.npz' % (runNum, time))
+        self.wait()
+        self.thread = threading.Thread(target=self.write, args=(fileName, arrays, fds))
+        self.thread.start()
+
+    def write(self, fileName, arrays, fds):
+        try:
+            for fd in fds:
+                os.fsync(fd)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        with open(fileName + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(fileName + '.tmp', fileName)
+        for name in listCheckpoints(self.dirName)[:-self.keep or None] if self.keep > 0 else []:
+            os.remove(path.join(self.dirName, name))
+
+    ## wait for the checkpoint being written, if any
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+## names of the checkpoints in directory dirName, oldest first
+def listCheckpoints(dirName):
+    if not path.isdir(dirName):
+        return []
+    return sorted(name for name in os.listdir(dirName) if name.startswith('run') and name.endswith('.npz'))
+
+## load the latest checkpoint in directory dirName, for simulation sim
+## (whose parameters must match the checkpoint's)
+##
+## output: dict with the run number ('run'), number of interactions
+## done ('time'), master seed ('seed'), position in the output file
+## ('writerPos', see the snapshot writers' mark()) and in the event log
+## ('eventsPos', or None if none was kept), agents ('agents'),
+## state of the run's RandomStream ('rng', for RandomStream.restore)
+## and of the convergence monitor ('monitor'), or None
+## if there's no checkpoint.
+def loadCheckpoint(sim, dirName):
+    names = listCheckpoints(dirName)
+    if not names:
+        return None
+    fileName = path.join(dirName, names[-1])
+    with np.load(fileName) as ck:
+        params = json.loads(str(ck['params']))
+        current = json.loads(json.dumps(dict((k, v) for k, v in sim.params().items() if k not in checkpointFreeParams)))
+        changed = sorted(k for k in set(params) | set(current) if params.get(k) != current.get(k))
+        if changed:
+            raise ValueError("checkpoint %s was saved with different parameters (%s)" % (fileName, ', '.join(changed)))
+        seed = int(ck['seed'])
+        if sim.seed is not None and sim.seed != seed:
+            raise ValueError("checkpoint %s was saved with seed %d" % (fileName, seed))
+
+        sizes = ck['sizes'].tolist()
+        nextLabels = ck['nextLabels'].tolist()
+        columns = [ck['inv_%d' % i] for i in range(len([k for k in ck.files if k.startswith('inv_')]))]
+        if sim.flatPopulation:
+            agents = Population(sim)
+            agents.restore(sizes, nextLabels, columns)
+        else:
+            agents = []
+            start = 0
+            for i, n in enumerate(sizes):
+                ag = Agent(str(i+1), sim)
+                ag.inv.restore(sim, [a[start:start+n] for a in columns], nextLabels[i])
+                agents.append(ag)
+                start += n
+
+        print "resuming from checkpoint %s" % fileName
+        return {'run': int(ck['run']), 'time': int(ck['time']), 'seed': seed, 'agents': agents,
+                'rng': (ck['rngBlocks'].tolist(), ck['rngPositions'].tolist()),
+                'monitor': dict((k[len('monitor_'):], ck[k]) for k in ck.files if k.startswith('monitor_')),
+                'writerPos': (int(ck['writerPos']), ck['writerDirectory'].tostring(), int(ck['writerChunks'])) + tuple(ck['writerSummaries'].tolist()),
+                'eventsPos': (int(ck['eventsPos']), ck['eventsDirectory'].tostring(), int(ck['eventsChunks'])) if 'eventsPos' in ck.files else None}
+
+
+###
+### play the imitation game
+###
+
+## seed for run number runNum, derived from master seed seed, so that
+## each run's result doesn't depend on which process plays it
+def runSeed(seed, runNum):
+    return int(hashlib.md5("%d:%d" % (seed, runNum)).hexdigest()[:8], 16)
+
+## times at which to write snapshots: every storeIvl iterations, plus
+## last one (as a set, for quick lookup)
+def storeTimes(sim):
+    storeIts = set(range(0, sim.nIts, sim.storeIvl)[1:])
+    storeIts.add(sim.nIts)
+    return storeIts
+
+## play run number runNum of the game with simulation sim, writing
+## agents' vowel prototypes at storeIts to snapshot writer w (only
+## those of a sample of sim.snapshotAgents agents, if given)
+##
+## with sim.flatPopulation, the agents are a Population rather than a
+## list of Agents.
+##
+## resumed: (agents, time, monitor state) to continue a run from a
+## checkpoint, after interaction number time
+## checkpointer: Checkpointer to save checkpoints with, if any
+##
+## everything that changes the agents' inventories is logged to
+## sim.events, if it's an EventLog.
+##
+## with sim.convergeWindow, the run stops once a ConvergenceMonitor
+## says it has converged, and a snapshot is written then.
+##
+## output: summary of the run from its Instruments, if sim.profile
+def playRun(sim, runNum, storeIts, w, resumed=None, checkpointer=None):
+    instr = sim.instr = Instruments(runNum, sim.nIts, sim.progressIvl) if sim.profile else None
+    events = sim.events
+    monitor = ConvergenceMonitor(sim) if sim.convergeWindow > 0 else None
+    converged = False
+
+    if resumed is None:
         print "run %d" % runNum
 
         ## initialize agents
-        agents = [Agent(str(i+1)) for i in range(args.nAgents)]
+        agents = Population(sim) if sim.flatPopulation else [Agent(str(i+1), sim) for i in range(sim.nAgents)]
 
         ## initialize number of interactions
-        time = 1
-
+        start = 1
+    else:
+        agents, start, monitorState = resumed
+        start += 1
+        if monitor:
+            monitor.restore(monitorState)
+        print "run %d (resumed at interaction %d)" % (runNum, start)
+
+    ## agents to write to snapshots (None: all)
+    sample = sim.rng.sample(sim.nAgents, sim.snapshotAgents) if 0 < sim.snapshotAgents < sim.nAgents else None
+
+    if events:
+        events.run, events.time = runNum, start - 1
+
+    ## (a run resumed from a checkpoint after its last interaction has
+    ## none left to play)
+    time = start - 1
+    for time in range(start, sim.nIts+1):
         ## pick two agents to interact
-        a1, a2 = random.sample(agents,2)
-	
-        for x in range(nIts):
-            ## print status every so often
-            ##if(x%100 == 0 and x>0):
-            ##    print x
-
-            ## play step 1
-            ##
-            ## lab1 = label of intended vowel, A1 = formants produced by
-            ## agent 1 (incl noise)
-            lab1, A1 = a1.step1()
-
-            ## play step 2
-            ##
-            ## A2 = produced formants (incl noise), v2 = vowel agent 2
-            ## produces
-            A2, v2 = a2.step2(A1)
-
-            ## play step 3, return whether game was a success
-            ## 
-            success = a1.step3(lab1, A2) # resp2: True (success) or False (failure)
-
-            ## play step 4
-            a2.step4(success, v2, A1)
-
-            ## do discarding, mergers, random additions
-            a1.doOtherUpdates()
-            a2.doOtherUpdates()
-            
-            ## once every storeIvl iterations, write all agents' vowel
-            ## prototypes to CSV
-            if time in storeIts:
-                for ag in agents:
-                    for v in ag.v:
-                        h, b, r = round(v.art[0],4), round(v.art[1],4), round(v.art[2],4)
-                        w.writerow([runNum, time, ag.id, v.label, h, b, r, v.form[0], v.form[1], v.form[2], v.form[3], F2prime(v.form), ag.useCount[v.label], ag.successCount[v.label]])
-                    
-            ## pick two new agents to interact
-            a1, a2 = random.sample(agents, 2)
-            time += 1
-
-    csvfile.close()
-
-## executes game() with any command-line arguments if run from the
+        i, j = sim.rng.pair()
+        a1, a2 = agents[i], agents[j]
+        if events:
+            events.time = time
+
+        if instr: t = instr.clock()
+
+        ## play step 1
+        ##
+        ## lab1 = label of intended vowel, A1 = formants produced by
+        ## agent 1 (incl noise)
+        lab1, A1 = a1.step1()
+        if instr: t = instr.lap('step1', t)
+
+        ## play step 2
+        ##
+        ## A2 = produced formants (incl noise), v2 = vowel agent 2
+        ## produces
+        A2, v2 = a2.step2(A1)
+        if instr: t = instr.lap('step2', t)
+
+        ## play step 3, return whether game was a success
+        ## 
+        success = a1.step3(lab1, A2) # resp2: True (success) or False (failure)
+        if instr:
+            t = instr.lap('step3', t)
+            instr.count('successes' if success else 'failures')
+        if monitor:
+            monitor.record(success)
+        if events:
+            events.add(EventLog.SUCCESS if success else EventLog.FAILURE, i+1, lab1, j+1, v2.label)
+
+        ## play step 4
+        a2.step4(success, v2, A1)
+        if instr: instr.lap('step4', t)
+
+        ## do discarding, mergers, random additions
+        a1.doOtherUpdates()
+        a2.doOtherUpdates()
+        
+        if monitor:
+            converged = monitor.check(time, agents)
+
+        ## once every storeIvl iterations, and when stopping early,
+        ## write all agents' vowel prototypes
+        if time in storeIts or converged:
+            if instr: t = instr.clock()
+            w.write(runNum, time, agents, sample)
+            if instr: instr.lap('snapshot', t)
+
+        if instr: instr.tick(time)
+
+        if converged:
+            print "run %d converged at interaction %d" % (runNum, time)
+            break
+
+        if checkpointer and time % sim.checkpointIvl == 0:
+            checkpointer.save(sim, runNum, time, agents, w, monitor)
+
+    if events:
+        events.add(EventLog.END, 0, int(converged))
+    if sim.stops:
+        sim.stops.write(runNum, time, converged)
+
+    sim.instr = None
+    if instr:
+        summary = instr.summary()
+        summary['bytesPerAgent'] = populationBytes(agents)/float(sim.nAgents)
+        if isinstance(agents, Population):
+            summary['agentsUsed'] = agents.nUsed()
+        if monitor:
+            summary['convergedAt'] = time if converged else None
+        return summary
+
+## snapshot writer for the output of simulation sim: to file fileName
+## (or memory, if None), with or without summaries as sim.summaries
+## says.  resume: position from the writer's mark(), to continue an
+## existing file from.
+def openOutput(sim, fileName, resume=None):
+    if sim.summaries == 'only':
+        w = None
+    elif fileName is None:
+        w = MemorySnapshotWriter()
+    else:
+        w = openSnapshotWriter(fileName, outputFormat(fileName, sim.outFormat), sim.chunkRows, resume=resume[:3] if resume else None)
+    if sim.summaries != 'none':
+        w = SummaryWriter(sim, fileName, w, resume=resume)
+    return w
+
+## play one run in a worker process, writing it to shard file shardF
+## (no shard with sim.summaries 'only'), its summaries, with
+## sim.summaries, to summaryFiles(shardF), and its events, with
+## sim.eventLog, to eventFile(shardF)
+##
+## job: (sim, runNum, seed, format, shardF)
+## output: job, and the run's summary (see playRun)
+def playShard(job):
+    sim, runNum, seed, format, shardF = job
+    sim.rng = RandomStream(seed, sim.nAgents, sim.noise)
+    if sim.summaries == 'only':
+        w = None
+    else:
+        w = openSnapshotWriter(shardF + '.tmp', format, sim.chunkRows, shard=True)
+    if sim.summaries != 'none':
+        w = SummaryWriter(sim, shardF, w, header=False)
+    if sim.eventLog:
+        sim.events = EventLog(eventFile(shardF), chunkRows=sim.chunkRows)
+    if sim.convergeWindow > 0:
+        sim.stops = StopLog(shardF, header=False)
+    stats = playRun(sim, runNum, storeTimes(sim), w)
+    w.close()
+    if sim.events:
+        sim.events.close()
+        sim.events = None
+    if sim.stops:
+        sim.stops.close()
+        sim.stops = None
+    if sim.summaries != 'only':
+        os.rename(shardF + '.tmp', shardF)
+    return job, stats
+
+## play sim.nRuns runs of the game with simulation sim (over
+## sim.workers processes).
+##
+## if fileName is given, agents' vowel prototypes at each snapshot are
+## written to it (as .csv or .npz: see outputFormat), and None is
+## returned.  otherwise they're returned, as a dict mapping column
+## names (see snapshotColumns) to arrays.
+##
+## with sim.summaries, summaries of the population at each snapshot are
+## written too (or instead), to summaryFiles(fileName), or returned
+## along with the prototypes (see SummaryWriter.result).
+##
+## with sim.checkpointIvl, checkpoints are saved as the game is played,
+## and with sim.resume, the game continues from the latest one (see
+## Checkpointer); both need fileName, and a single worker.
+##
+## with sim.eventLog, everything that changes the agents' inventories
+## is logged to eventFile(fileName) (see EventLog), which needs
+## fileName.
+##
+## with sim.ensemble, all runs are played at once by the ensemble
+## backend (see ensembleDeBoer.playEnsemble).
+def game(sim, fileName=None):
+    storeIts = storeTimes(sim)
+    if fileName is not None:
+        fileName = path.abspath(fileName)
+
+    checkpointer = None
+    resumed = None
+    if sim.ensemble and (sim.workers > 1 or sim.checkpointIvl > 0 or sim.resume):
+        raise ValueError("an ensemble is played in one process, without checkpoints")
+    if sim.ensemble and sim.convergeWindow > 0:
+        raise ValueError("ensemble runs can't be stopped early")
+    if sim.ensemble and (sim.flatPopulation or sim.snapshotAgents > 0):
+        raise ValueError("an ensemble keeps its own arrays, and writes all agents")
+    if sim.eventLog and (sim.ensemble or fileName is None):
+        raise ValueError("an event log needs an output file, and isn't kept by an ensemble")
+    if sim.checkpointIvl > 0 or sim.resume:
+        if fileName is None:
+            raise ValueError("checkpoints need an output file")
+        if sim.workers > 1:
+            raise ValueError("checkpoints can't be saved with more than one worker")
+        checkpointDir = sim.checkpointDir or fileName + '.checkpoints'
+        if sim.resume:
+            resumed = loadCheckpoint(sim, checkpointDir)
+            if resumed is None:
+                print "no checkpoint in %s, starting from the beginning" % checkpointDir
+            else:
+                sim.seed = resumed['seed']
+        if sim.checkpointIvl > 0:
+            checkpointer = Checkpointer(checkpointDir, sim.checkpointKeep)
+            if resumed is None:
+                checkpointer.clear()
+
+    ## master seed, from which each run's seed is derived
+    seed = sim.seed
+    if seed is None:
+        seed = sim.seed = random.SystemRandom().randint(0, 2**31-1)
+        print "seed %d" % seed
+
+    ## start output
+    w = openOutput(sim, fileName, resumed['writerPos'] if resumed else None)
+    format = 'npz' if fileName is None else outputFormat(fileName, sim.outFormat)
+    if sim.eventLog:
+        sim.events = EventLog(eventFile(fileName), sim.params(), sim.chunkRows, resume=resumed['eventsPos'] if resumed else None)
+    if sim.convergeWindow > 0 and fileName is not None:
+        sim.stops = StopLog(fileName, resumeRun=resumed['run'] if resumed else None)
+
+    runNums = range(1, sim.nRuns+1)
+    stats = []
+    if sim.ensemble:
+        import ensembleDeBoer
+        ensembleDeBoer.playEnsemble(sim, seed, storeIts, w)
+    elif sim.workers <= 1:
+        for runNum in runNums:
+            if resumed and runNum < resumed['run']:
+                continue
+            sim.rng = RandomStream(runSeed(seed, runNum), sim.nAgents, sim.noise)
+            if resumed and runNum == resumed['run']:
+                sim.rng.restore(*resumed['rng'])
+                stats.append(playRun(sim, runNum, storeIts, w, (resumed['agents'], resumed['time'], resumed['monitor']), checkpointer))
+            else:
+                stats.append(playRun(sim, runNum, storeIts, w, checkpointer=checkpointer))
+        if checkpointer:
+            checkpointer.wait()
+    else:
+        ## play runs in a pool of worker processes, each writing to its
+        ## own shard, and append shards to the output in run order
+        shardDir = tempfile.mkdtemp(prefix='.shards', dir=path.dirname(fileName) if fileName else None)
+        pool = multiprocessing.Pool(sim.workers)
+        try:
+            jobs = [(sim, runNum, runSeed(seed, runNum), format, path.join(shardDir, 'run%06d.%s' % (runNum, format))) for runNum in runNums]
+            for job, runStats in pool.imap(playShard, jobs):
+                shardF = job[-1]
+                w.appendShard(shardF)
+                if sim.summaries != 'only':
+                    os.remove(shardF)
+                if sim.events:
+                    sim.events.appendShard(eventFile(shardF))
+                    os.remove(eventFile(shardF))
+                if sim.stops:
+                    sim.stops.appendShard(shardF)
+                    os.remove(stopFile(shardF))
+                stats.append(runStats)
+            pool.close()
+        finally:
+            pool.terminate()
+            shutil.rmtree(shardDir, ignore_errors=True)
+
+    w.close()
+    if sim.events:
+        sim.events.close()
+        sim.events = None
+    if sim.stops:
+        sim.stops.close()
+        sim.stops = None
+
+    if sim.profile:
+        writeStats(stats, sim.statsF)
+
+    ## (counts are per process, so only meaningful without workers)
+    if sim.workers <= 1:
+        if sim.verbose and sim.synthCache is not None:
+            print sim.synthCache
+        if sim.verifyInverseMap:
+            print sim.invMap
+
+    if fileName is None:
+        return w.result()
+
+
+###
+### parameter sweeps
+###
+
+## parameters which can be varied in a sweep
+sweepParams = ['nIts', 'nAgents', 'noise', 'discardThresh', 'successThresh', 'minUsesDiscard', 'acousticMergeThresh', 'articMergeThresh', 'articEps', 'L', 'additionProb', 'cleanUpProb', 'storeIvl']
+
+## read a sweep's grid from .json file fileName, as values of the
+## parameters' types
+def loadGrid(fileName):
+    with open(fileName) as f:
+        grid = json.load(f)
+    for name in grid:
+        if name in sweepParams:
+            action = parser._option_string_actions['--' + name]
+            grid[name] = [action.type(value) for value in grid[name]]
+    return grid
+
+## the configurations of grid: (sorted parameter names, list of dicts
+## of their values, one per combination, and configuration names
+## cfgNNN)
+def gridConfigs(grid):
+    names = sorted(grid)
+    configs = [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+    return names, configs, ['cfg%03d' % (i+1) for i in range(len(configs))]
+
+## play a sweep over the parameter values in grid (a dict mapping
+## parameter names to lists of values), all other parameters as in
+## simulation sim, playing sim.nRuns runs of each combination.  writes
+## to directory outDir:
+##
+## - sweep.json: the grid, the other parameters and the master seed
+## - manifest.txt: one line "config run" per finished job
+## - shards/: one file per finished job
+## - cfgNNN.csv (or .npz): output for configuration NNN, once all its runs are done
+##   (and cfgNNN.stops.csv, with sim.convergeWindow: see StopLog)
+## - index.csv: parameter values, runs done and output file of each configuration
+##
+## if the directory already holds a sweep, it's resumed: finished jobs
+## (listed in the manifest) aren't played again.
+def sweep(sim, grid, outDir):
+    outDir = path.abspath(outDir)
+    shardDir = path.join(outDir, 'shards')
+    sweepF = path.join(outDir, 'sweep.json')
+    manifestF = path.join(outDir, 'manifest.txt')
+    nRuns = sim.nRuns
+
+    for name in grid:
+        if name not in sweepParams:
+            raise ValueError("can't sweep over %s (can sweep over: %s)" % (name, ', '.join(sweepParams)))
+    base = dict((name, getattr(sim, name)) for name in sweepParams if name not in grid)
+    format = sim.outFormat or 'csv'
+
+    if path.exists(sweepF):
+        ## resume: the sweep must be the same one
+        with open(sweepF) as f:
+            saved = json.load(f)
+        if saved['grid'] != grid or saved['base'] != base or saved['nRuns'] != nRuns or saved.get('format', 'csv') != format:
+            raise ValueError("%s holds a different sweep" % outDir)
+        seed = saved['seed']
+        print "resuming sweep in %s" % outDir
+    else:
+        seed = sim.seed if sim.seed is not None else random.SystemRandom().randint(0, 2**31-1)
+        if not path.isdir(shardDir):
+            os.makedirs(shardDir)
+        with open(sweepF, 'w') as f:
+            json.dump({'grid': grid, 'base': base, 'nRuns': nRuns, 'seed': seed, 'format': format}, f, indent=1, sort_keys=True)
+        print "sweep in %s, seed %d" % (outDir, seed)
+
+    names, configs, cfgNames = gridConfigs(grid)
+
+    done = set()
+    if path.exists(manifestF):
+        with open(manifestF) as f:
+            for line in f:
+                cfg, runNum = line.split()
+                done.add((cfg, int(runNum)))
+
+    def shardFile(cfg, runNum):
+        return path.join(shardDir, '%s_run%06d.%s' % (cfg, runNum, format))
+
+    ## write configuration cfg's output file, once all its runs are done
+    def finish(i):
+        cfg = cfgNames[i]
+        w = openSnapshotWriter(path.join(outDir, '%s.%s' % (cfg, format)), format, sim.chunkRows)
+        stops = StopLog(path.join(outDir, cfg)) if sim.convergeWindow > 0 else None
+        for runNum in range(1, nRuns+1):
+            w.appendShard(shardFile(cfg, runNum))
+            if stops:
+                stops.appendShard(shardFile(cfg, runNum))
+        w.close()
+        if stops:
+            stops.close()
+
+    def writeIndex():
+        with open(path.join(outDir, 'index.csv'), 'w') as f:
+            w = csv.writer(f)
+            w.writerow(['config'] + names + ['runsDone', 'nRuns', 'file'])
+            for cfg, params in zip(cfgNames, configs):
+                nDone = len([r for r in range(1, nRuns+1) if (cfg, r) in done])
+                w.writerow([cfg] + [params[name] for name in names] + [nDone, nRuns, '%s.%s' % (cfg, format) if nDone == nRuns else ''])
+
+    jobs = [(sim.copy(**params), r, runSeed(seed, r), format, shardFile(c, r))
+            for c, params in zip(cfgNames, configs)
+            for r in range(1, nRuns+1) if (c, r) not in done]
+    cfgIndex = dict((shardFile(c, r), i) for i, c in enumerate(cfgNames) for r in range(1, nRuns+1))
+    print "%d configurations x %d runs: %d jobs done, %d to play" % (len(configs), nRuns, len(done), len(jobs))
+
+    ## configurations finished in an earlier, interrupted sweep
+    for i, cfg in enumerate(cfgNames):
+        if not path.exists(path.join(outDir, '%s.%s' % (cfg, format))) and all((cfg, r) in done for r in range(1, nRuns+1)):
+            finish(i)
+    writeIndex()
+
+    if sim.workers > 1:
+        pool = multiprocessing.Pool(sim.workers)
+        results = pool.imap_unordered(playShard, jobs)
+    else:
+        pool = None
+        results = itertools.imap(playShard, jobs)
+
+    try:
+        with open(manifestF, 'a') as manifest:
+            for (jobSim, runNum, jobSeed, jobFormat, shardF), stats in results:
+                i = cfgIndex[shardF]
+                cfg = cfgNames[i]
+                if sim.profile:
+                    stats['config'] = cfg
+                    writeStats([stats], sim.statsF or path.join(outDir, 'stats.json'), 'a')
+                manifest.write("%s %d\n" % (cfg, runNum))
+                manifest.flush()
+                os.fsync(manifest.fileno())
+                done.add((cfg, runNum))
+                if all((cfg, r) in done for r in range(1, nRuns+1)):
+                    finish(i)
+                    writeIndex()
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+## run from the command line: play the game, or a sweep, with
+## parameters given by command-line arguments argv
+def main(argv=None):
+    args = parser.parse_args(argv)
+    sim = Simulation.fromArgs(args)
+    if args.sweep:
+        if args.checkpointIvl or args.resume:
+            parser.error("sweeps resume by themselves, without --checkpointIvl or --resume")
+        if args.ensemble:
+            parser.error("sweeps play runs one at a time, without --ensemble")
+        if args.summaries != 'none' or args.eventLog:
+            parser.error("sweeps write prototypes only, without --summaries or --eventLog")
+        grid = loadGrid(args.sweep)
+        try:
+            sweep(sim, grid, args.csvF)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        try:
+            game(sim, args.csvF)
+        except ValueError as e:
+            parser.error(str(e))
+
+## executes main() with any command-line arguments if run from the
 ## command line, as expected
 if __name__ == '__main__':
-    game()
-
+    main()
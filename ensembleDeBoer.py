@@ -0,0 +1,440 @@
+'''
+ensemble backend for deboer.py: plays all runs of a game in lockstep,
+holding every run's population in stacked numpy arrays, so that
+interaction t of every run is one batched step rather than a python
+loop per run.  runs diverge (different inventory sizes, additions,
+discards, merges) by masking.
+
+used by deboer.game when the simulation has ensemble set:
+> python deboer.py --nAgents 20 --nIts 5000 --storeIvl 5000 --nRuns 500 --ensemble --seed 1 runs.csv
+
+the ensemble plays the same game as the per-run loop, but draws its
+random numbers differently, so its runs are statistically, not
+exactly, the same as those of the per-run loop.  run as a script, it
+checks that: it plays a game with both backends, and compares the
+distributions of summaries of the runs' final states.
+
+> python ensembleDeBoer.py --nRuns 200 --nIts 3000 --nAgents 10
+
+'''
+
+import argparse, math, sys
+import numpy as np
+
+import deboer
+
+
+## lattice of articulations reachable from schwa (each dimension's
+## deboer.climbValues), synthesized once, with points numbered in
+## row-major order: the values along each dimension, the points'
+## perceptual coordinates, and the numbers of each point's (up to) 6
+## neighbors, in the order of deboer.neighbors.  missing neighbors are
+## numbered as an extra point, perceptually infinitely far from
+## everything.
+## lattices are shared by all ensembles in a process; for small
+## articEps, whose lattice would have more than maxLatticePoints
+## points, there is none (None).
+maxLatticePoints = 2*10**6
+lattices = {}
+
+def getLattice(articEps):
+    if articEps not in lattices:
+        vals, down, up = deboer.climbValues(articEps)
+        n = len(vals)
+        if n**3 > maxLatticePoints:
+            lattices[articEps] = None
+        else:
+            idx = np.indices((n, n, n)).reshape(3, -1).T
+            perc = np.concatenate([deboer.percepts(deboer.calFormFreqs(vals[idx])), [[np.inf, np.inf]]])
+            nbrs = np.empty((len(idx), 6), dtype=np.int32)
+            for i in range(3):
+                for j, step in enumerate([down, up]):
+                    nb = idx.copy()
+                    nb[:, i] = step[idx[:, i]]
+                    inside = nb[:, i] >= 0
+                    nb[~inside] = 0
+                    nbrs[:, 2*i+j] = np.where(inside, np.ravel_multi_index(nb.T, (n, n, n)), len(idx))
+            lattices[articEps] = (vals, perc, nbrs)
+    return lattices[articEps]
+
+
+## the populations of nRuns runs of a game with simulation sim, as
+## arrays indexed by run, agent and slot: articulation, formants,
+## perceptual coordinates, use and success counts and labels of each
+## agent's vowels, plus which slots hold a vowel.  slots don't keep
+## the order vowels were added in, but labels do: as in
+## deboer.Inventory, each agent labels new vowels by a counter
+## (self.nextLabel).
+##
+## self.moved notes which agents have had vowels moved or added since
+## their last merge, as only they can have vowels to merge.
+##
+## rng: numpy RandomState to draw all random numbers from
+class Ensemble(object):
+    def __init__(self, sim, nRuns, rng, capacity=8):
+        self.sim = sim
+        self.rng = rng
+        self.nRuns = nRuns
+        self.runs = np.arange(nRuns)
+        shape = (nRuns, sim.nAgents, capacity)
+        self.art = np.zeros(shape + (3,))
+        self.form = np.zeros(shape + (4,), dtype=int)
+        self.perc = np.zeros(shape + (2,))
+        self.useCount = np.zeros(shape, dtype=int)
+        self.successCount = np.zeros(shape, dtype=int)
+        self.labels = np.zeros(shape, dtype=int)
+        self.valid = np.zeros(shape, dtype=bool)
+        self.nextLabel = np.ones(shape[:2], dtype=int)
+        self.moved = np.zeros(shape[:2], dtype=bool)
+        self.lattice = getLattice(sim.articEps)
+
+    ## the per-vowel arrays
+    def columns(self):
+        return [self.art, self.form, self.perc, self.useCount, self.successCount, self.labels, self.valid]
+
+    ## double the number of slots of every agent
+    def grow(self):
+        cap = self.valid.shape[2]
+        def resized(a):
+            b = np.zeros(a.shape[:2] + (2*cap,) + a.shape[3:], dtype=a.dtype)
+            b[:, :, :cap] = a
+            return b
+        self.art, self.form, self.perc, self.useCount, self.successCount, self.labels, self.valid = [resized(a) for a in self.columns()]
+
+    ## add vowels with articulations arts (m, 3) to agents ags of runs
+    ## runs (at most one agent per run), with zero uses and successes
+    def add(self, runs, ags, arts):
+        if not len(runs):
+            return
+        if self.valid[runs, ags].all(axis=1).any():
+            self.grow()
+        valid = self.valid[runs, ags]
+        slots = valid.argmin(axis=1)
+        form = deboer.calFormFreqs(arts)
+        self.art[runs, ags, slots] = arts
+        self.form[runs, ags, slots] = form
+        self.perc[runs, ags, slots] = deboer.percepts(form)
+        self.useCount[runs, ags, slots] = 0
+        self.successCount[runs, ags, slots] = 0
+        self.labels[runs, ags, slots] = self.nextLabel[runs, ags]
+        self.nextLabel[runs, ags] += 1
+        self.valid[runs, ags, slots] = True
+        self.moved[runs, ags] = True
+
+    ## slot of the vowel of agents ags of runs runs perceptually closest
+    ## to perceptual coordinates perc (m, 2)
+    def closest(self, runs, ags, perc):
+        dist = deboer.perceptualDistances(self.perc[runs, ags], perc[:, None, :], self.sim.L)
+        dist[~self.valid[runs, ags]] = np.inf
+        return dist.argmin(axis=1)
+
+    ## formants form (m, 4) with noise added
+    def production(self, form):
+        noise = self.sim.noise
+        return form*(1 + self.rng.uniform(-noise/2, noise/2, form.shape))
+
+    ## one step of deboer.Vowel.shiftCloser for articulations art (m,
+    ## 3), with perceptual coordinates perc, towards perceptual
+    ## coordinates target: move to the closest of the (up to) 6
+    ## neighbors (see deboer.neighbors) if it's closer than art.
+    ##
+    ## output: new articulations, formants and perceptual coordinates of
+    ## those which moved, and which moved
+    def shiftCloser(self, art, perc, target):
+        eps = self.sim.articEps
+        m = len(art)
+        cand = np.repeat(art[:, None, :], 6, axis=1)
+        exists = np.empty((m, 6), dtype=bool)
+        for i in range(3):
+            x = art[:, i]
+            cand[:, 2*i, i] = np.where(x > eps, x - eps, 0)
+            exists[:, 2*i] = x > 0
+            cand[:, 2*i+1, i] = np.where(x < 1 - eps, x + eps, 1)
+            exists[:, 2*i+1] = x < 1
+        form = deboer.calFormFreqs(cand)
+        p = deboer.percepts(form)
+        dist = deboer.perceptualDistances(p, target[:, None, :], self.sim.L)
+        dist[~exists] = np.inf
+        best = dist.argmin(axis=1)
+        rows = np.arange(m)
+        moved = dist[rows, best] < deboer.perceptualDistances(perc, target, self.sim.L)
+        best = best[moved]
+        rows = rows[moved]
+        return cand[rows, best], form[rows, best], p[rows, best], moved
+
+    ## shift vowels in slots slots of agents ags of runs runs closer to
+    ## perceptual coordinates target (see shiftCloser)
+    def shift(self, runs, ags, slots, target):
+        if not len(runs):
+            return
+        art, form, perc, moved = self.shiftCloser(self.art[runs, ags, slots], self.perc[runs, ags, slots], target)
+        runs, ags, slots = runs[moved], ags[moved], slots[moved]
+        self.art[runs, ags, slots] = art
+        self.form[runs, ags, slots] = form
+        self.perc[runs, ags, slots] = perc
+        self.moved[runs, ags] = True
+
+    ## articulations near signals A (m, 4) found by talking to self
+    ## (deboer.hillClimb), from schwa or from the inverse map, taking
+    ## the steps of deboer.neighbors, so reaching the same articulations
+    ## as the per-run loop.  the hill-climb walks the lattice (see
+    ## getLattice), looking up perceptual coordinates rather than
+    ## synthesizing them; without one, it shifts closer to A (see
+    ## shiftCloser) until no neighbor is closer.
+    def findPhoneme(self, A):
+        sim = self.sim
+        target = deboer.percepts(A)
+        if sim.invMap is None:
+            art = np.full((len(A), 3), 0.5)
+        else:
+            art = np.array([sim.invMap.nearest(p) for p in target.tolist()], dtype=float)
+        active = np.arange(len(A))
+
+        if self.lattice is None:
+            perc = deboer.percepts(deboer.calFormFreqs(art))
+            while len(active):
+                newArt, form, newPerc, moved = self.shiftCloser(art[active], perc[active], target[active])
+                active = active[moved]
+                art[active] = newArt
+                perc[active] = newPerc
+            return art
+
+        vals, latticePerc, nbrs = self.lattice
+        n = len(vals)
+        point = np.ravel_multi_index(np.searchsorted(vals, art).T, (n, n, n))
+        dist = deboer.perceptualDistances(latticePerc[point], target, sim.L)
+        while len(active):
+            cand = nbrs[point[active]]
+            candDist = deboer.perceptualDistances(latticePerc[cand], target[active][:, None, :], sim.L)
+            best = candDist.argmin(axis=1)
+            rows = np.arange(len(active))
+            moved = candDist[rows, best] < dist[active]
+            rows, best, active = rows[moved], best[moved], active[moved]
+            point[active] = cand[rows, best]
+            dist[active] = candDist[rows, best]
+        return vals[np.column_stack(np.unravel_index(point, (n, n, n)))]
+
+    ## play one interaction of every run (steps 1-4 of the imitation
+    ## game, then other updates for both agents; see deboer.playRun)
+    def interact(self):
+        sim, rng, runs = self.sim, self.rng, self.runs
+        R, nAgents = self.nRuns, sim.nAgents
+
+        ## pick two (different) agents of each run to interact
+        a1 = rng.randint(nAgents, size=R)
+        a2 = (a1 + 1 + rng.randint(nAgents - 1, size=R)) % nAgents
+
+        ## step 1: agent 1 (adding a random vowel if it has none)
+        ## produces a random vowel v1
+        empty = ~self.valid[runs, a1].any(axis=1)
+        if empty.any():
+            self.add(runs[empty], a1[empty], rng.random_sample((empty.sum(), 3)))
+        valid = self.valid[runs, a1]
+        v1 = np.where(valid, rng.random_sample(valid.shape), -1).argmax(axis=1)
+        self.useCount[runs, a1, v1] += 1
+        A1 = self.production(self.form[runs, a1, v1])
+        P1 = deboer.percepts(A1)
+
+        ## step 2: agent 2 (adding a vowel near A1 if it has none)
+        ## produces its closest vowel v2
+        empty = ~self.valid[runs, a2].any(axis=1)
+        if empty.any():
+            self.add(runs[empty], a2[empty], self.findPhoneme(A1[empty]))
+        v2 = self.closest(runs, a2, P1)
+        A2 = self.production(self.form[runs, a2, v2])
+
+        ## step 3: success if agent 1's closest vowel to A2 is v1
+        success = self.closest(runs, a1, deboer.percepts(A2)) == v1
+        self.successCount[runs[success], a1[success], v1[success]] += 1
+
+        ## step 4: agent 2 shifts v2 closer to A1, or (on failure, if
+        ## v2's success ratio is high enough) adds a new vowel near A1
+        self.useCount[runs, a2, v2] += 1
+        self.successCount[runs[success], a2[success], v2[success]] += 1
+        ratio = self.successCount[runs, a2, v2]/self.useCount[runs, a2, v2].astype(float)
+        new = ~success & (ratio > sim.successThresh)
+        self.shift(runs[~new], a2[~new], v2[~new], P1[~new])
+        if new.any():
+            self.add(runs[new], a2[new], self.findPhoneme(A1[new]))
+
+        ## discarding, random additions, mergers
+        self.doOtherUpdates(a1)
+        self.doOtherUpdates(a2)
+
+    ## discard, random additions and mergers for agent ags[r] of each
+    ## run r (see deboer.Agent.doOtherUpdates)
+    def doOtherUpdates(self, ags):
+        sim, rng = self.sim, self.rng
+        clean = rng.random_sample(self.nRuns) < sim.cleanUpProb
+        runs, ags = self.runs[clean], ags[clean]
+        if not len(runs):
+            return
+
+        ## 1. remove vowels used enough times whose success ratio is too
+        ## low, in the order they were added, skipping the vowel after
+        ## each one removed (as deboer.Agent.doOtherUpdates)
+        uses = self.useCount[runs, ags]
+        valid = self.valid[runs, ags]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = self.successCount[runs, ags]/uses.astype(float)
+            bad = valid & (uses > sim.minUsesDiscard) & (ratio < sim.discardThresh)
+        if bad.any():
+            rows = np.arange(len(runs))[:, None]
+            order = np.where(valid, self.labels[runs, ags], np.iinfo(int).max).argsort(axis=1)
+            bad = bad[rows, order]
+            for k in range(1, bad.shape[1]):
+                bad[:, k] &= ~bad[:, k-1]
+            valid[rows, order] &= ~bad
+            self.valid[runs, ags] = valid
+
+        ## 2. add random vowel with some probability
+        add = rng.random_sample(len(runs)) < sim.additionProb
+        if add.any():
+            self.add(runs[add], ags[add], rng.random_sample((add.sum(), 3)))
+
+        ## 3. merge vowels that are too close
+        self.merge(runs, ags)
+
+    ## merge vowels of agents ags of runs runs that are too close, a
+    ## random pair at a time, as deboer.Agent.merge does
+    def merge(self, runs, ags):
+        sim = self.sim
+        moved = self.moved[runs, ags]
+        runs, ags = runs[moved], ags[moved]
+        self.moved[runs, ags] = False
+        while len(runs):
+            perc, art, labels = self.perc[runs, ags], self.art[runs, ags], self.labels[runs, ags]
+            valid = self.valid[runs, ags]
+            acDist = deboer.perceptualDistances(perc[:, :, None], perc[:, None, :], sim.L)
+            arDist = np.sqrt(((art[:, :, None] - art[:, None, :])**2).sum(axis=-1))
+            ## pairs (v1, v2), with v1 added before v2
+            close = (acDist < sim.acousticMergeThresh) | (arDist < sim.articMergeThresh)
+            close &= valid[:, :, None] & valid[:, None, :] & (labels[:, :, None] < labels[:, None, :])
+
+            pairs = close.reshape(len(runs), -1)
+            some = pairs.any(axis=1)
+            if not some.any():
+                return
+            runs, ags, pairs = runs[some], ags[some], pairs[some]
+
+            ## choose a pair to merge, at random
+            cap = valid.shape[1]
+            pick = np.where(pairs, self.rng.random_sample(pairs.shape), -1).argmax(axis=1)
+            s1, s2 = pick // cap, pick % cap
+            uses1, uses2 = self.useCount[runs, ags, s1], self.useCount[runs, ags, s2]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio1 = self.successCount[runs, ags, s1]/uses1.astype(float)
+                ratio2 = self.successCount[runs, ags, s2]/uses2.astype(float)
+                ratio1Lower = ratio1 < ratio2
+
+            ## discard the vowel with no uses (v2 if both have none), else
+            ## the one with the lower success ratio (v2 on ties), giving its
+            ## successes and uses to the other
+            dropFirst = np.where((uses1 == 0) | (uses2 == 0), uses2 != 0, ratio1Lower)
+            keep, drop = np.where(dropFirst, s2, s1), np.where(dropFirst, s1, s2)
+            self.successCount[runs, ags, keep] += self.successCount[runs, ags, drop]
+            self.useCount[runs, ags, keep] += self.useCount[runs, ags, drop]
+            self.valid[runs, ags, drop] = False
+
+    ## all agents' vowel prototypes at time, as a list of arrays (one per
+    ## column in deboer.snapshotColumns), ordered by run, agent and
+    ## label.  run numbers start at firstRun.
+    def snapshotArrays(self, time, firstRun=1):
+        r, a, s = np.nonzero(self.valid)
+        labels = self.labels[r, a, s]
+        order = np.lexsort((labels, a, r))
+        r, a, s, labels = r[order], a[order], s[order], labels[order]
+        n = len(r)
+        art = self.art[r, a, s]
+        form = self.form[r, a, s].astype(np.int32)
+        return [(r + firstRun).astype(np.int32), np.repeat(np.int32(time), n), (a + 1).astype(np.int32), labels.astype(np.int32),
+                art[:, 0], art[:, 1], art[:, 2],
+                form[:, 0], form[:, 1], form[:, 2], form[:, 3],
+                self.perc[r, a, s, 1],
+                self.useCount[r, a, s].astype(np.int32), self.successCount[r, a, s].astype(np.int32)]
+
+
+## play all sim.nRuns runs of a game with simulation sim as one
+## ensemble, with master seed seed, writing all agents' vowel
+## prototypes at storeIts to snapshot writer w (see deboer.game).
+## snapshots are written a time at a time, so rows are ordered by time
+## and then run, rather than by run and then time.
+def playEnsemble(sim, seed, storeIts, w):
+    ens = Ensemble(sim, sim.nRuns, np.random.RandomState(seed))
+    print "runs 1-%d (ensemble)" % sim.nRuns
+    for time in range(1, sim.nIts+1):
+        ens.interact()
+        if time in storeIts:
+            w.writeArrays(ens.snapshotArrays(time))
+        if sim.progressIvl and sim.profile and time % sim.progressIvl == 0:
+            print "%d/%d interactions" % (time, sim.nIts)
+
+
+###
+### statistical check against the per-run loop
+###
+
+## summaries of the final state of each run in results (a dict of
+## columns, as returned by deboer.game): name -> array, one value per
+## run
+def runSummaries(results):
+    final = results['time'] == results['time'].max()
+    run = results['run'][final]
+    runs = np.unique(run)
+    idx = np.searchsorted(runs, run)
+    nAgents = np.array([len(np.unique(results['agent'][final][run == r])) for r in runs], dtype=float)
+    vowels = np.bincount(idx, minlength=len(runs))
+    uses = np.bincount(idx, results['UseCount'][final], minlength=len(runs))
+    successes = np.bincount(idx, results['SuccessCount'][final], minlength=len(runs))
+    return {'vowels per agent': vowels/nAgents,
+            'success ratio': successes/np.maximum(uses, 1),
+            'mean F1 (Hz)': np.bincount(idx, results['F1'][final], minlength=len(runs))/vowels,
+            'mean F2prime (bark)': np.bincount(idx, results['F2prime'][final], minlength=len(runs))/vowels}
+
+## two-sample Kolmogorov-Smirnov test of samples x and y
+##
+## output: statistic D, and (asymptotic) p-value
+def ksTest(x, y):
+    x, y = np.sort(x), np.sort(y)
+    both = np.concatenate([x, y])
+    d = np.abs(np.searchsorted(x, both, side='right')/float(len(x)) - np.searchsorted(y, both, side='right')/float(len(y))).max()
+    ne = len(x)*len(y)/float(len(x) + len(y))
+    lam = (math.sqrt(ne) + 0.12 + 0.11/math.sqrt(ne))*d
+    p = 2*sum((-1)**(k-1)*math.exp(-2*k*k*lam*lam) for k in range(1, 101))
+    return d, min(max(p, 0.0), 1.0)
+
+## play simulation sim with the per-run loop and as an ensemble, and
+## compare the distributions of their runs' summaries
+##
+## output: list of (summary, per-run loop mean, ensemble mean, D, p)
+def check(sim):
+    reference = runSummaries(deboer.game(sim.copy(ensemble=False)))
+    ensemble = runSummaries(deboer.game(sim.copy(ensemble=True, workers=1)))
+    return [(name, reference[name].mean(), ensemble[name].mean()) + ksTest(reference[name], ensemble[name])
+            for name in sorted(reference)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = 'check the ensemble backend of deboer.py against the per-run loop')
+    parser.add_argument('--nRuns', type=int, default=200, help = 'number of runs to play with each backend (default: %(default)s)')
+    parser.add_argument('--nIts', type=int, default=3000, help = 'number of interactions per run (default: %(default)s)')
+    parser.add_argument('--nAgents', type=int, default=10, help = 'number of agents (default: %(default)s)')
+    parser.add_argument('--noise', type=float, default=0.1, help = 'amount of acoustic noise (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help = 'master random seed (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1, help = 'number of worker processes for the per-run loop (default: %(default)s)')
+    parser.add_argument('--alpha', type=float, default=0.01, help = 'significance level under which a difference is flagged (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    sim = deboer.Simulation(nRuns=args.nRuns, nIts=args.nIts, nAgents=args.nAgents, noise=args.noise,
+                            storeIvl=args.nIts, seed=args.seed, workers=args.workers)
+    results = check(sim)
+    print
+    print "%-22s %12s %12s %8s %8s" % ('summary', 'per-run', 'ensemble', 'D', 'p')
+    flagged = 0
+    for name, ref, ens, d, p in results:
+        flag = 'DIFFERENT' if p < args.alpha else ''
+        flagged += bool(flag)
+        print "%-22s %12.4f %12.4f %8.3f %8.3f %s" % (name, ref, ens, d, p, flag)
+    return 1 if flagged else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,328 @@
+'''
+numba kernels for deboer.py: the synthesizer, bark and F2' scales,
+distances, neighbors, and the shift and hill-climb loops of
+Vowel.shiftCloser and hillClimb, compiled with numba so that the
+hill-climb doesn't pay python's call overhead at every step.
+
+used by the simulation when --kernels numba is given (see
+deboer.getKernels); if numba can't be imported, the simulation says
+so and uses the python functions instead.  compiled code is cached on
+disk (in __pycache__ next to this file, or $NUMBA_CACHE_DIR), so only
+the first run after a change pays for compiling.
+
+the kernels do the same floating-point operations in the same order as
+the python functions (squaring, as python's ** does, with libm's pow
+rather than a multiplication, which can differ in the last bit), so
+they give the same results, except that
+they never use the synthesizer cache: games played with them are the
+same as those played with --noSynthCache.  run as a script, it checks
+that, comparing the kernels with the python functions on random and
+edge-case articulations and signals (or, if numba isn't installed,
+says so and exits without checking):
+
+> python kernelsDeBoer.py --n 10000
+
+'''
+
+import argparse, math, random, sys, time
+import numpy as np
+try:
+    import numba
+    from numba import types
+    from numba.extending import intrinsic
+    from llvmlite import ir
+except ImportError as e:
+    ## imported, let deboer.getKernels see the error and fall back to
+    ## python; run as a script, there's nothing to check
+    if __name__ != '__main__':
+        raise
+    print "can't import numba (%s), skipping the check" % e
+    sys.exit(0)
+
+import deboer
+
+
+jit = numba.njit(cache=True)
+
+## x**y by a call to libm's pow, as python computes it: numba (LLVM)
+## turns pow(x, 2.0) into x*x, which isn't always the same in the last
+## bit, unless pow is declared nobuiltin
+@intrinsic
+def libmPow(typingctx, x, y):
+    def codegen(context, builder, signature, args):
+        fn = builder.module.globals.get('pow')
+        if fn is None:
+            fnty = ir.FunctionType(ir.DoubleType(), [ir.DoubleType(), ir.DoubleType()])
+            fn = ir.Function(builder.module, fnty, 'pow')
+        fn.attributes.add('nobuiltin')
+        return builder.call(fn, args)
+    return types.float64(types.float64, types.float64), codegen
+
+## x**2, as python (2.7's float_pow squares abs(x)) computes it
+@jit
+def square(x):
+    return libmPow(abs(x), 2.0)
+
+## formants of articulation (h, b, r): as deboer.calFormFreq
+@jit
+def formants(h, b, r):
+    F1 = int(((- 392+ 392*r)*(h*h) + ( 596- 668*r)*h + (- 146+ 166*r))*(b*b)  + (( 348- 348*r)*(h*h) + (- 494+ 606*r)*h + ( 141- 175*r))*b + (( 340-  72*r)*(h*h) + (- 796+ 108*r)*h + ( 708-  38*r)))
+    F2 = int(((-1200+1208*r)*(h*h) + (1320-1328*r)*h + (  118- 158*r))*(b*b) + ((1864-1488*r)*(h*h) + (-2644+1510*r)*h + (-561+ 221*r))*b + ((-670+ 490*r)*(h*h) + ( 1355- 697*r)*h + (1517- 117*r)))
+    F3 = int(((  604- 604*r)*(h*h) + (1038-1178*r)*h + (  246+ 566*r))*(b*b) + ((-1150+1262*r)*(h*h) + (-1443+1313*r)*h + (-317- 483*r))*b + ((1130- 836*r)*(h*h) + (- 315+  44*r)*h + (2427- 127*r)))
+    F4 = int(((-1120+  16*r)*(h*h) + (1696- 180*r)*h + (  500+ 522*r))*(b*b) + ((- 140+ 240*r)*(h*h) + (- 578+ 214*r)*h + (-692- 419*r))*b + ((1480- 602*r)*(h*h) + (-1220+ 289*r)*h + (3678- 178*r)))
+    return F1, F2, F3, F4
+
+## bark of integer frequency f (as the synthesizer gives): as
+## deboer.calBark, whose low frequencies are divided as ints
+@jit
+def barkOfInt(f):
+    if f > 271.32:
+        return math.log(f/271.32)/0.1719 + 2
+    return float((f - 51)//110)
+
+## bark of frequency f (as a signal, with noise, has)
+@jit
+def barkOfFloat(f):
+    if f > 271.32:
+        return math.log(f/271.32)/0.1719 + 2
+    return (f - 51)/110.0
+
+## F2' from the barks of F2, F3 and F4: as deboer.F2prime
+@jit
+def F2primeOfBarks(F2, F3, F4):
+    c = 3.5
+    w1 = (c - F3+F2)/c
+    w2 = (F4-2*F3+F2)/(F4-F2)
+    if F3-F2 > c:
+        return F2
+    elif (F3-F2)<=c and (F4-F2)>c:
+        return ((2-w1)*F2 + w1*F3)/2.0
+    elif (F4-F2)<=c and (F3-F2)<(F4-F3):
+        return (w2*F2 + (2-w2)*F3)/2.0 - 1.0
+    return ((2+w2)*F3 - w2*F4)/2.0 - 1.0
+
+## perceptual coordinates of the synthesizer's (integer) formants
+@jit
+def perceptOfInts(F1, F2, F3, F4):
+    return barkOfInt(F1), F2primeOfBarks(barkOfInt(F2), barkOfInt(F3), barkOfInt(F4))
+
+## perceptual coordinates of a signal's formants
+@jit
+def perceptOfFloats(F1, F2, F3, F4):
+    return barkOfFloat(F1), F2primeOfBarks(barkOfFloat(F2), barkOfFloat(F3), barkOfFloat(F4))
+
+## perceptual distance between (x1, y1) and (x2, y2): as
+## deboer.perceptualDistance
+@jit
+def distance(x1, y1, x2, y2, L):
+    return math.sqrt(square(x1 - x2) + L*square(y1 - y2))
+
+## neighbors of articulation (h, b, r), in the order deboer.neighbors
+## gives them: array (n, 9) of articulation, formants and perceptual
+## coordinates
+@jit
+def neighborArray(h, b, r, eps):
+    out = np.empty((6, 9))
+    art = np.array([h, b, r])
+    n = 0
+    for i in range(3):
+        for up in range(2):
+            x = art[i]
+            if up == 0:
+                if not x > 0:
+                    continue
+                y = x - eps if x > eps else 0.0
+            else:
+                if not x < 1:
+                    continue
+                y = x + eps if x < (1 - eps) else 1.0
+            nb = art.copy()
+            nb[i] = y
+            F1, F2, F3, F4 = formants(nb[0], nb[1], nb[2])
+            p1, p2 = perceptOfInts(F1, F2, F3, F4)
+            out[n, 0], out[n, 1], out[n, 2] = nb[0], nb[1], nb[2]
+            out[n, 3], out[n, 4], out[n, 5], out[n, 6] = F1, F2, F3, F4
+            out[n, 7], out[n, 8] = p1, p2
+            n += 1
+    return out[:n]
+
+## one shift of a vowel at articulation (h, b, r), perceptual
+## coordinates (p1, p2), closer to a signal at perceptual coordinates
+## (a1, a2): as Vowel.shiftCloser.  output: the neighbors (see
+## neighborArray), and the number of the one moved to, or -1 if none
+## is closer
+@jit
+def shift(a1, a2, h, b, r, p1, p2, eps, L):
+    nbs = neighborArray(h, b, r, eps)
+    best = -1
+    minDist = distance(a1, a2, p1, p2, L)
+    for k in range(nbs.shape[0]):
+        d = distance(a1, a2, nbs[k, 7], nbs[k, 8], L)
+        if d < minDist:
+            minDist = d
+            best = k
+    return nbs, best
+
+## hill-climb from articulation (h, b, r) towards a signal at perceptual
+## coordinates (a1, a2): as deboer.hillClimb.  output: row of
+## articulation, formants and perceptual coordinates climbed to, and
+## number of shifts tried
+@jit
+def climb(a1, a2, h, b, r, eps, L):
+    F1, F2, F3, F4 = formants(h, b, r)
+    p1, p2 = perceptOfInts(F1, F2, F3, F4)
+    cur = np.array([h, b, r, float(F1), float(F2), float(F3), float(F4), p1, p2])
+    nbs, best = shift(a1, a2, h, b, r, p1, p2, eps, L)
+    steps = 1
+    while best >= 0:
+        cur = nbs[best].copy()
+        nbs, best = shift(a1, a2, cur[0], cur[1], cur[2], cur[7], cur[8], eps, L)
+        steps += 1
+    return cur, steps
+
+
+## the kernels with the arguments and results of the python functions
+## in deboer.py
+
+def isInt(x):
+    return isinstance(x, (int, long, np.integer))
+
+def calFormFreq(v):
+    return list(formants(float(v[0]), float(v[1]), float(v[2])))
+
+def bark(f):
+    return barkOfInt(f) if isInt(f) else barkOfFloat(float(f))
+
+def F2prime(form):
+    return F2primeOfBarks(bark(form[1]), bark(form[2]), bark(form[3]))
+
+def percept(form):
+    if all(isInt(f) for f in form):
+        return perceptOfInts(int(form[0]), int(form[1]), int(form[2]), int(form[3]))
+    return perceptOfFloats(float(form[0]), float(form[1]), float(form[2]), float(form[3]))
+
+def perceptualDistance(perc1, perc2, L=0.3):
+    return distance(perc1[0], perc1[1], perc2[0], perc2[1], L)
+
+def acousticDistance(form1, form2, L=0.3):
+    return perceptualDistance(percept(form1), percept(form2), L)
+
+@jit
+def articDistanceOf(h1, b1, r1, h2, b2, r2):
+    return math.sqrt(square(h1 - h2) + square(b1 - b2) + square(r1 - r2))
+
+def articDistance(art1, art2):
+    return articDistanceOf(float(art1[0]), float(art1[1]), float(art1[2]), float(art2[0]), float(art2[1]), float(art2[2]))
+
+## row of neighborArray as (articulation, formants, perceptual
+## coordinates)
+def unpack(row):
+    row = row.tolist()
+    return row[:3], [int(f) for f in row[3:7]], tuple(row[7:])
+
+def synthesize(art):
+    form = calFormFreq(art)
+    return form, perceptOfInts(*form)
+
+def neighbors(art, articEps=0.03):
+    return [unpack(row) for row in neighborArray(float(art[0]), float(art[1]), float(art[2]), articEps)]
+
+## shift a vowel at articulation art, perceptual coordinates perc closer
+## to signal A: (articulation, formants, perceptual coordinates) moved
+## to, or None
+def shiftCloser(A, art, perc, articEps, L):
+    a1, a2 = percept(A)
+    nbs, best = shift(a1, a2, float(art[0]), float(art[1]), float(art[2]), float(perc[0]), float(perc[1]), articEps, L)
+    return unpack(nbs[best]) if best >= 0 else None
+
+## hill-climb from articulation start to signal A: (articulation,
+## formants, perceptual coordinates, number of shifts)
+def hillClimb(A, start, articEps, L):
+    a1, a2 = percept(A)
+    row, steps = climb(a1, a2, float(start[0]), float(start[1]), float(start[2]), articEps, L)
+    return unpack(row) + (steps,)
+
+
+###
+### check against the python functions
+###
+
+## articulations to check: random ones, and ones on the edges of the
+## articulatory space and within articEps of them
+def testArticulations(n, articEps, rng):
+    edges = [0, 1, 0.5, articEps/2, 1 - articEps/2, articEps, 1 - articEps]
+    arts = [[rng.random(), rng.random(), rng.random()] for i in range(n)]
+    arts += [[rng.choice(edges), rng.choice(edges), rng.choice(edges)] for i in range(n/10 + 1)]
+    return arts
+
+## compare the kernels with the python functions of simulation sim
+## (which mustn't use the synthesizer cache) on n random articulations
+## and signals
+##
+## output: list of (function, cases, mismatches)
+def check(sim, n=10000, seed=1, tolerance=0.0):
+    rng = random.Random(seed)
+    sim.rng = deboer.RandomStream(seed, 2, sim.noise)
+    eps, L = sim.articEps, sim.L
+    arts = testArticulations(n, eps, rng)
+    forms = [deboer.calFormFreq(a) for a in arts]
+    signals = [[f*(1 + rng.uniform(-sim.noise/2, sim.noise/2)) for f in form] for form in forms]
+
+    def same(x, y):
+        if isinstance(x, (list, tuple)):
+            return len(x) == len(y) and all(same(a, b) for a, b in zip(x, y))
+        return x == y or abs(x - y) <= tolerance
+
+    def reference(fn):
+        results = []
+        for a, A in zip(arts, signals):
+            v = deboer.Vowel(sim)
+            v.setArt(a)
+            results.append(fn(v, A))
+        return results
+
+    def refShift(v, A):
+        return (v.art, v.form, v.perc) if v.shiftCloser(A) else None
+
+    def refClimb(v, A):
+        vNew, steps = deboer.hillClimb(A, v.art, sim)
+        return vNew.art, vNew.form, vNew.perc, steps
+
+    cases = [
+        ('calFormFreq', [deboer.calFormFreq(a) for a in arts], [calFormFreq(a) for a in arts]),
+        ('bark (formants)', [deboer.bark(f) for form in forms for f in form], [bark(f) for form in forms for f in form]),
+        ('bark (signals)', [deboer.bark(f) for A in signals for f in A], [bark(f) for A in signals for f in A]),
+        ('F2prime', [deboer.F2prime(A) for A in forms + signals], [F2prime(A) for A in forms + signals]),
+        ('acousticDistance', [deboer.acousticDistance(f, A, L) for f, A in zip(forms, signals)], [acousticDistance(f, A, L) for f, A in zip(forms, signals)]),
+        ('articDistance', [deboer.articDistance(a, b) for a, b in zip(arts, arts[1:])], [articDistance(a, b) for a, b in zip(arts, arts[1:])]),
+        ('neighbors', [deboer.neighbors(a, eps) for a in arts], [[(nb, form, perc) for nb, form, perc in neighbors(a, eps)] for a in arts]),
+        ('Vowel.shiftCloser', reference(refShift), [shiftCloser(A, a, percept(calFormFreq(a)), eps, L) for a, A in zip(arts, signals)]),
+        ('hillClimb', reference(refClimb), [hillClimb(A, a, eps, L) for a, A in zip(arts, signals)]),
+    ]
+    return [(name, len(ref), sum(not same(r, k) for r, k in zip(ref, ker))) for name, ref, ker in cases]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = 'check the numba kernels of deboer.py against the python functions')
+    parser.add_argument('--n', type=int, default=10000, help = 'number of random articulations and signals to check (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help = 'random seed (default: %(default)s)')
+    parser.add_argument('--noise', type=float, default=0.1, help = 'amount of acoustic noise in the signals (default: %(default)s)')
+    parser.add_argument('--articEps', type=float, default=0.03, help = 'step of the hill-climb (default: %(default)s)')
+    parser.add_argument('--L', type=float, default=0.3, help = 'weighting of F2prime vs F1 in perceptual distance (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=0.0, help = 'largest difference from the python functions allowed (default: %(default)s, i.e. the same)')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    hillClimb([500.0, 1500.0, 2500.0, 3500.0], [0.5, 0.5, 0.5], args.articEps, args.L)
+    print "kernels compiled or loaded in %.2f s" % (time.time() - start)
+
+    sim = deboer.Simulation(noise=args.noise, articEps=args.articEps, L=args.L, noSynthCache=True)
+    print
+    print "%-22s %8s %10s" % ('function', 'cases', 'mismatches')
+    failed = 0
+    for name, n, mismatches in check(sim, args.n, args.seed, args.tolerance):
+        failed += bool(mismatches)
+        print "%-22s %8d %10d %s" % (name, n, mismatches, 'DIFFERENT' if mismatches else '')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,501 @@
+'''
+runs of deboer.py spread over any number of hosts, through a work queue
+in a directory on storage they share (e.g. NFS), with no server.
+
+a queue holds a game or a sweep (deboer.py --sweep): one task per
+configuration and run, each with the run's seed (deboer.runSeed, so
+runs are the same as deboer.py's).  workers claim tasks by creating
+lease files, which is atomic (os.link fails if the lease exists), and
+keep their leases alive while playing; the lease of a worker which
+died expires after the queue's --leaseSecs (given at submit), and its
+task is claimed again.  each
+task's run is written to its own shard, renamed into place when done,
+so a task is done once its shard exists.  at worst (a worker stalled
+past its lease) a task is played twice, writing the same shard.
+
+merging appends the shards of each configuration in run order (as the
+--workers of deboer.py do) into one output file per configuration,
+cfgNNN.csv (or .npz), with index.csv as written by a sweep.
+
+submit 100 runs of each configuration of sweep.json (any deboer.py
+arguments but --workers, with or without --sweep):
+> python queueDeBoer.py submit --sweep sweep.json --nRuns 100 --nIts 5000 --storeIvl 5000 --seed 1 /shared/queue1
+
+then start workers on any number of hosts (here 8 processes on this
+one), see how far they've got, and merge the shards once they're done:
+> python queueDeBoer.py work --processes 8 /shared/queue1
+> python queueDeBoer.py status /shared/queue1
+> python queueDeBoer.py merge /shared/queue1
+
+'''
+
+import argparse, csv, errno, json, multiprocessing, os, random, socket, sys, threading, time
+import os.path as path
+
+import deboer
+
+
+###
+### queues
+###
+
+## a queue in directory queueDir:
+##
+## - queue.json: the grid, the other simulation parameters, runs per
+##   configuration, master seed, output format and lease length
+## - leases/: one file per claimed task, renewed by its worker
+## - shards/: one file per finished task
+## - workers/: one file per running worker, renewed while it runs
+##   (status removes those of workers which died)
+## - cfgNNN.csv (or .npz), index.csv (and cfgNNN.stops.csv, with
+##   --convergeWindow): written by merge
+class Queue(object):
+    def __init__(self, queueDir):
+        self.dir = path.abspath(queueDir)
+        queueF = path.join(self.dir, 'queue.json')
+        if not path.exists(queueF):
+            raise ValueError("no queue in %s" % self.dir)
+        with open(queueF) as f:
+            saved = json.load(f)
+        self.grid, self.nRuns, self.seed, self.format = saved['grid'], saved['nRuns'], saved['seed'], saved['format']
+        ## (queues submitted before leases were the queue's had 300 s)
+        self.leaseSecs = saved.get('leaseSecs', 300.0)
+        self.params = dict((str(k), v) for k, v in saved['params'].items() if k in deboer.simulationParams)
+        self.names, self.configs, self.cfgNames = deboer.gridConfigs(self.grid)
+        self.leaseDir, self.shardDir, self.workerDir = [path.join(self.dir, d) for d in ('leases', 'shards', 'workers')]
+
+    ## tasks, as (configuration index, run number), in order
+    def tasks(self):
+        return [(i, runNum) for i in range(len(self.configs)) for runNum in range(1, self.nRuns+1)]
+
+    def taskName(self, i, runNum):
+        return '%s_run%06d' % (self.cfgNames[i], runNum)
+
+    def shardFile(self, i, runNum):
+        return path.join(self.shardDir, '%s.%s' % (self.taskName(i, runNum), self.format))
+
+    ## the shard of task (i, runNum) while worker plays it (renamed to
+    ## shardFile when done; deboer.playShard writes it as
+    ## workingShardFile + '.tmp' until the run is over)
+    def workingShardFile(self, i, runNum, worker):
+        return path.join(self.shardDir, '.%s.%s.%s' % (self.taskName(i, runNum), worker, self.format))
+
+    def leaseFile(self, i, runNum):
+        return path.join(self.leaseDir, self.taskName(i, runNum))
+
+    def outputFile(self, i):
+        return path.join(self.dir, '%s.%s' % (self.cfgNames[i], self.format))
+
+    ## names of finished tasks' shards (not of those being played), and
+    ## of leases
+    def done(self):
+        return set(f for f in os.listdir(self.shardDir) if not f.startswith('.'))
+
+    def leased(self):
+        return set(f for f in os.listdir(self.leaseDir) if not f.startswith('.'))
+
+    def isDone(self, i, runNum, done):
+        return path.basename(self.shardFile(i, runNum)) in done
+
+    ## the simulation of configuration i
+    def simulation(self, i):
+        return deboer.Simulation(**self.params).copy(**self.configs[i])
+
+## submit the runs of a sweep over grid (see deboer.sweep; {} for just
+## the game), all other parameters as in simulation sim, to a new queue
+## in queueDir, whose leases expire when not renewed for leaseSecs.
+## submitting the same queue again leaves it as it is.
+def submit(sim, grid, queueDir, leaseSecs=300.0):
+    queueDir = path.abspath(queueDir)
+    if not leaseSecs > 0:
+        raise ValueError("leases must last some time (--leaseSecs > 0)")
+    for name in grid:
+        if name not in deboer.sweepParams:
+            raise ValueError("can't sweep over %s (can sweep over: %s)" % (name, ', '.join(deboer.sweepParams)))
+    params = sim.params()
+    params.update(workers=1, ensemble=False, checkpointIvl=0, resume=False)
+    seed = sim.seed if sim.seed is not None else random.SystemRandom().randint(0, 2**31-1)
+    params['seed'] = seed
+    saved = {'grid': grid, 'params': params, 'nRuns': sim.nRuns, 'seed': seed, 'format': sim.outFormat or 'csv', 'leaseSecs': leaseSecs}
+
+    for d in ('leases', 'shards', 'workers'):
+        if not path.isdir(path.join(queueDir, d)):
+            os.makedirs(path.join(queueDir, d))
+    ## queue.json is linked into place, so only one of two submits to
+    ## the same directory can create it
+    queueF = path.join(queueDir, 'queue.json')
+    tmpF = '%s.%s.%d' % (queueF, socket.gethostname(), os.getpid())
+    with open(tmpF, 'w') as f:
+        json.dump(saved, f, indent=1, sort_keys=True)
+    try:
+        os.link(tmpF, queueF)
+        print "queue in %s, seed %d: %d configurations x %d runs" % (queueDir, seed, len(deboer.gridConfigs(grid)[1]), sim.nRuns)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+        with open(queueF) as f:
+            if json.load(f) != json.loads(json.dumps(saved)):
+                raise ValueError("%s holds a different queue" % queueDir)
+        print "queue in %s already submitted" % queueDir
+    finally:
+        os.remove(tmpF)
+    return Queue(queueDir)
+
+
+###
+### workers
+###
+
+## a worker process, claiming tasks of queue until all are done (or
+## it's done maxTasks of them).
+##
+## its lease on the task it's playing, and its file in queue.workerDir,
+## are renewed (their modification times set to now) every
+## queue.leaseSecs/4 by a thread.  a lease not renewed in
+## queue.leaseSecs has expired.  times
+## are all modification times of files in the queue, set by the file
+## server, so hosts' clocks needn't agree.
+class Worker(object):
+    def __init__(self, queue, pollSecs=30.0, maxTasks=0):
+        self.queue = queue
+        self.leaseSecs, self.pollSecs, self.maxTasks = queue.leaseSecs, pollSecs, maxTasks
+        self.name = '%s.%d' % (socket.gethostname(), os.getpid())
+        self.workerF = path.join(queue.workerDir, self.name)
+        self.lease = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    ## renew this worker's file (creating it again if status removed it
+    ## while the worker was stalled)
+    def touch(self):
+        with open(self.workerF, 'a'):
+            pass
+        os.utime(self.workerF, None)
+
+    ## the file server's time now
+    def now(self):
+        self.touch()
+        return os.stat(self.workerF).st_mtime
+
+    def heartbeat(self):
+        while not self.stopped.wait(self.leaseSecs/4):
+            with self.lock:
+                try:
+                    self.touch()
+                    if self.lease is not None:
+                        os.utime(self.lease, None)
+                except (IOError, OSError):
+                    pass
+
+    ## claim task (i, runNum): True if this worker now holds its lease
+    def claim(self, i, runNum):
+        leaseF = self.queue.leaseFile(i, runNum)
+        tmpF = path.join(self.queue.leaseDir, '.%s.%s' % (path.basename(leaseF), self.name))
+        with open(tmpF, 'w') as f:
+            json.dump({'worker': self.name, 'host': socket.gethostname(), 'pid': os.getpid()}, f)
+        try:
+            os.link(tmpF, leaseF)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return False
+        finally:
+            os.remove(tmpF)
+        with self.lock:
+            self.lease = leaseF
+        return True
+
+    ## claim task (i, runNum) if its lease has expired: the expired
+    ## lease is renamed away, then claimed as a new one, and the
+    ## unfinished shard its worker left removed.  two workers
+    ## can both see it expired, and the second rename take away the
+    ## lease the first has just claimed; so the lease renamed away is
+    ## checked again, and put back if it's fresh.  (if a third worker
+    ## claims the task in between, its lease is kept, and at worst the
+    ## task is played twice.)
+    def claimExpired(self, i, runNum):
+        leaseF = self.queue.leaseFile(i, runNum)
+        try:
+            if self.now() - os.stat(leaseF).st_mtime <= self.leaseSecs:
+                return False
+            staleF = path.join(self.queue.leaseDir, '.%s.%s.stale' % (path.basename(leaseF), self.name))
+            os.rename(leaseF, staleF)
+            try:
+                if self.now() - os.stat(staleF).st_mtime <= self.leaseSecs:
+                    try:
+                        os.link(staleF, leaseF)
+                    except OSError as e:
+                        if e.errno != errno.EEXIST:
+                            raise
+                    return False
+                with open(staleF) as f:
+                    expired = json.load(f)['worker']
+            finally:
+                os.remove(staleF)
+            print "%s: lease of %s on %s expired" % (self.name, expired, self.queue.taskName(i, runNum))
+        except (IOError, OSError) as e:
+            ## (released since the pass started)
+            if e.errno != errno.ENOENT:
+                raise
+            expired = None
+        if not self.claim(i, runNum):
+            return False
+        if expired is not None:
+            ## (deboer.playShard writes tmpF + '.tmp', renamed to tmpF
+            ## when the run is over)
+            tmpF = self.queue.workingShardFile(i, runNum, expired)
+            for f in [tmpF + '.tmp', tmpF, deboer.stopFile(tmpF)]:
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+        return True
+
+    ## let go of the lease held, if it's still this worker's
+    def release(self):
+        with self.lock:
+            leaseF, self.lease = self.lease, None
+        try:
+            with open(leaseF) as f:
+                if json.load(f)['worker'] == self.name:
+                    os.remove(leaseF)
+        except (IOError, OSError, ValueError):
+            pass
+
+    ## play task (i, runNum), writing its shard
+    ##
+    ## output: True if it was written, False if this worker stalled past
+    ## its lease and the task was taken over (removing its shard)
+    def play(self, i, runNum):
+        q = self.queue
+        shardF = q.shardFile(i, runNum)
+        ## played under a name of this worker's own, and renamed into place
+        tmpF = q.workingShardFile(i, runNum, self.name)
+        sim = q.simulation(i)
+        start = time.time()
+        job, stats = deboer.playShard((sim, runNum, deboer.runSeed(q.seed, runNum), q.format, tmpF))
+        try:
+            if sim.convergeWindow > 0:
+                os.rename(deboer.stopFile(tmpF), deboer.stopFile(shardF))
+            os.rename(tmpF, shardF)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            print "%s: lease on %s expired, task taken over" % (self.name, q.taskName(i, runNum))
+            return False
+        if sim.profile:
+            stats['config'] = q.cfgNames[i]
+            stats['worker'] = self.name
+            deboer.writeStats([stats], sim.statsF or path.join(q.dir, 'stats.%s.json' % self.name), 'a')
+        print "%s: played %s in %.1f s" % (self.name, q.taskName(i, runNum), time.time() - start)
+        return True
+
+    ## claim and play tasks until all are done.  each pass over the
+    ## tasks claims those neither done nor leased when it started, and
+    ## those whose lease has expired; if a pass claims none, the worker
+    ## waits pollSecs for leases held by others to be released or to
+    ## expire.
+    ##
+    ## output: number of tasks played
+    def run(self):
+        q = self.queue
+        with open(self.workerF, 'w') as f:
+            json.dump({'host': socket.gethostname(), 'pid': os.getpid()}, f)
+        beat = threading.Thread(target=self.heartbeat)
+        beat.daemon = True
+        beat.start()
+        played = 0
+        try:
+            while True:
+                done, leased = q.done(), q.leased()
+                todo = [(i, r) for i, r in q.tasks() if not q.isDone(i, r, done)]
+                if not todo:
+                    break
+                claimed = 0
+                for i, runNum in todo:
+                    if q.taskName(i, runNum) in leased:
+                        got = self.claimExpired(i, runNum)
+                    else:
+                        got = self.claim(i, runNum)
+                    if not got:
+                        continue
+                    claimed += 1
+                    try:
+                        ## (it may have been finished since the pass started)
+                        if not path.exists(q.shardFile(i, runNum)) and self.play(i, runNum):
+                            played += 1
+                    finally:
+                        self.release()
+                    if self.maxTasks and played >= self.maxTasks:
+                        return played
+                if not claimed:
+                    time.sleep(self.pollSecs)
+        finally:
+            self.stopped.set()
+            beat.join()
+            try:
+                os.remove(self.workerF)
+            except OSError:
+                pass
+        return played
+
+## run a worker on the queue in queueDir (see Worker)
+def work(queueDir, pollSecs=30.0, maxTasks=0):
+    w = Worker(Queue(queueDir), pollSecs, maxTasks)
+    played = w.run()
+    print "%s: played %d tasks" % (w.name, played)
+    return played
+
+
+###
+### status and merging
+###
+
+## state of the queue in queueDir: number of tasks done, leased
+## (renewed within the queue's leaseSecs), expired and waiting, and
+## names of workers seen within leaseSecs.  the files of workers not
+## seen within leaseSecs (which died), and the unfinished shards they
+## left which no worker has cleaned up on taking over their tasks, are
+## removed.
+def status(queueDir):
+    q = Queue(queueDir)
+    leaseSecs = q.leaseSecs
+    probeF = path.join(q.workerDir, '.status.%s.%d' % (socket.gethostname(), os.getpid()))
+    with open(probeF, 'w'):
+        pass
+    try:
+        now = os.stat(probeF).st_mtime
+    finally:
+        os.remove(probeF)
+
+    def age(f):
+        try:
+            return now - os.stat(f).st_mtime
+        except OSError:
+            return None
+
+    done, leased = q.done(), q.leased()
+    counts = {'done': 0, 'leased': 0, 'expired': 0, 'waiting': 0}
+    for i, runNum in q.tasks():
+        if q.isDone(i, runNum, done):
+            counts['done'] += 1
+        elif q.taskName(i, runNum) in leased:
+            a = age(q.leaseFile(i, runNum))
+            counts['expired' if a is not None and a > leaseSecs else 'leased'] += 1
+        else:
+            counts['waiting'] += 1
+    workers = []
+    for w in sorted(os.listdir(q.workerDir)):
+        if w.startswith('.'):
+            continue
+        ## (age is None if the worker has just finished)
+        a = age(path.join(q.workerDir, w))
+        if a is not None and a <= leaseSecs:
+            workers.append(w)
+        elif a is not None:
+            try:
+                os.remove(path.join(q.workerDir, w))
+            except OSError:
+                pass
+    ## unfinished shards are named .<task>.<worker>..., and left alone
+    ## while their worker is alive or they're fresh (a worker started
+    ## since workerDir was listed)
+    for f in os.listdir(q.shardDir):
+        if not f.startswith('.') or '.' not in f[1:]:
+            continue
+        owner = f[1:].split('.', 1)[1]
+        if any(owner.startswith(w + '.') for w in workers):
+            continue
+        a = age(path.join(q.shardDir, f))
+        if a is not None and a > leaseSecs:
+            try:
+                os.remove(path.join(q.shardDir, f))
+            except OSError:
+                pass
+    return counts, workers
+
+## merge the shards of each configuration of the queue in queueDir
+## whose runs are all done into its output file, appending them in run
+## order, and write index.csv (as deboer.sweep).  configurations
+## merged before aren't merged again.
+##
+## output: number of configurations merged (now or before), and of
+## configurations
+def merge(queueDir):
+    q = Queue(queueDir)
+    done = q.done()
+    nMerged = 0
+    with open(path.join(q.dir, 'index.csv'), 'w') as f:
+        index = csv.writer(f)
+        index.writerow(['config'] + q.names + ['runsDone', 'nRuns', 'file'])
+        for i, (cfg, params) in enumerate(zip(q.cfgNames, q.configs)):
+            nDone = len([r for r in range(1, q.nRuns+1) if q.isDone(i, r, done)])
+            outF = q.outputFile(i)
+            if nDone == q.nRuns:
+                if not path.exists(outF):
+                    w = deboer.openSnapshotWriter(outF + '.tmp', q.format, q.params['chunkRows'])
+                    stops = deboer.StopLog(outF) if q.params['convergeWindow'] > 0 else None
+                    for runNum in range(1, q.nRuns+1):
+                        w.appendShard(q.shardFile(i, runNum))
+                        if stops:
+                            stops.appendShard(q.shardFile(i, runNum))
+                    w.close()
+                    if stops:
+                        stops.close()
+                    os.rename(outF + '.tmp', outF)
+                nMerged += 1
+            index.writerow([cfg] + [params[name] for name in q.names] + [nDone, q.nRuns, path.basename(outF) if nDone == q.nRuns else ''])
+    return nMerged, len(q.configs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = 'play deboer.py runs on any number of hosts through a work queue in a shared directory')
+    commands = parser.add_subparsers(dest='command')
+    ## all of deboer.py's arguments, csvF naming the queue directory
+    submitParser = commands.add_parser('submit', parents=[deboer.parser], add_help=False,
+                                       help = 'submit a game or sweep (deboer.py arguments; the output file is the queue directory)')
+    workParser = commands.add_parser('work', help = 'claim and play tasks until all are done')
+    statusParser = commands.add_parser('status', help = 'print how many tasks are done, leased and waiting')
+    mergeParser = commands.add_parser('merge', help = 'merge the shards of finished configurations into one output file each')
+    for p in (workParser, statusParser, mergeParser):
+        p.add_argument('queueDir', help = 'queue directory (on storage shared by all workers)')
+    submitParser.add_argument('--leaseSecs', type=float, default=300.0, help = 'seconds after which a lease not renewed by its worker expires, for all workers of the queue (default: %(default)s)')
+    workParser.add_argument('--processes', type=int, default=1, help = 'number of worker processes to start on this host (default: %(default)s)')
+    workParser.add_argument('--pollSecs', type=float, default=30.0, help = 'seconds to wait before looking again when all tasks left are leased (default: %(default)s)')
+    workParser.add_argument('--maxTasks', type=int, default=0, help = 'stop after playing this many tasks, 0 for no limit (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'submit':
+            if args.checkpointIvl or args.resume:
+                parser.error("queued runs are played one at a time, without --checkpointIvl or --resume")
+            if args.ensemble or args.workers > 1:
+                parser.error("queued runs are played one at a time, without --ensemble or --workers (start more workers instead)")
+            if args.summaries != 'none' or args.eventLog:
+                parser.error("queues write prototypes only, without --summaries or --eventLog")
+            submit(deboer.Simulation.fromArgs(args), deboer.loadGrid(args.sweep) if args.sweep else {}, args.csvF, args.leaseSecs)
+        elif args.command == 'work':
+            Queue(args.queueDir)
+            if args.processes > 1:
+                procs = [multiprocessing.Process(target=work, args=(args.queueDir, args.pollSecs, args.maxTasks))
+                         for p in range(args.processes)]
+                for p in procs:
+                    p.start()
+                for p in procs:
+                    p.join()
+                return max(p.exitcode for p in procs)
+            work(args.queueDir, args.pollSecs, args.maxTasks)
+        elif args.command == 'status':
+            counts, workers = status(args.queueDir)
+            print "%(done)d done, %(leased)d leased, %(expired)d expired, %(waiting)d waiting" % counts
+            print "%d workers: %s" % (len(workers), ' '.join(workers))
+        elif args.command == 'merge':
+            nMerged, nConfigs = merge(args.queueDir)
+            print "%d of %d configurations merged" % (nMerged, nConfigs)
+            return 0 if nMerged == nConfigs else 1
+    except ValueError as e:
+        parser.error(str(e))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+'''
+replay of deboer.py event logs: rebuilds the agents' inventories at
+any time of a game played with --eventLog from the log alone, by
+applying its events (use and success counts, shifts, additions,
+discards and merges) to a population starting out empty, as each run
+of the game does.  nothing is perceived and nothing hill-climbed, so
+this is much faster than playing the game again, and gives exactly the
+same snapshots as a game played with the replay's --storeIvl.
+
+play a game, writing only its final state, plus the event log
+sample.events.npz:
+> python deboer.py --nAgents 20 --nIts 10000 --storeIvl 10000 --seed 1 --eventLog sample.csv
+
+then write a snapshot every 20 interactions, as if it had been played
+with --storeIvl 20:
+> python replayDeBoer.py --storeIvl 20 sample.events.npz sample20.csv
+
+or in python, the agents of run 1 after 5000 interactions:
+> agents = replayDeBoer.populationAt('sample.events.npz', 1, 5000)
+
+'''
+
+import argparse, sys, time
+import numpy as np
+
+import deboer
+
+
+## parameters which can differ from the logged game's in a replay (they
+## only change what's written, or how the population is kept)
+replayParams = ['storeIvl', 'snapshotAgents', 'summaries', 'clusterRadius', 'outFormat', 'chunkRows', 'flatPopulation']
+
+## simulation logged in event log logFile, with changes to replayParams
+def logSimulation(logFile, **changes):
+    for name in changes:
+        if name not in replayParams:
+            raise ValueError("can't change %s in a replay (can change: %s)" % (name, ', '.join(replayParams)))
+    params = dict((str(k), v) for k, v in deboer.eventParams(logFile).items() if k in deboer.simulationParams)
+    params.update(changes, eventLog=False, ensemble=False, workers=1, checkpointIvl=0, resume=False)
+    return deboer.Simulation(**params)
+
+## replay the runs in event log logFile (only those in runs, if given)
+## with simulation sim: yields (run, time, agents) after each time in
+## storeIts, up to the end of the run, and at the end of a run that
+## stopped early, having converged.  agents are a list of Agents, or a
+## Population with sim.flatPopulation, and are changed by the events
+## that follow, so use them before asking for the next.
+def states(sim, logFile, storeIts, runs=None):
+    E = deboer.EventLog
+    storeIts = sorted(storeIts)
+    run = None
+    for chunk in deboer.readEvents(logFile):
+        kind = chunk['kind']
+        ## each event's row in art and form, if it has one
+        artRow = np.cumsum((kind == E.SHIFT) | (kind == E.RANDOM) | (kind == E.NEW)) - 1
+        keep = np.in1d(chunk['run'], list(runs)) if runs is not None else slice(None)
+        arts, forms = chunk['art'].tolist(), chunk['form'].tolist()
+        percs = deboer.percepts(chunk['form'].astype(int)).tolist()
+        columns = [chunk[name][keep].tolist() for name in deboer.eventColumns] + [artRow[keep].tolist()]
+
+        for r, t, k, agent, label, agent2, label2, a in zip(*columns):
+            if r != run:
+                run = r
+                agents = deboer.Population(sim) if sim.flatPopulation else [deboer.Agent(str(i+1), sim) for i in range(sim.nAgents)]
+                nextStore = 0
+            ## snapshots before this interaction
+            while nextStore < len(storeIts) and storeIts[nextStore] < t:
+                yield run, storeIts[nextStore], agents
+                nextStore += 1
+
+            if k == E.SUCCESS or k == E.FAILURE:
+                a1, a2 = agents[agent-1], agents[agent2-1]
+                a1.useCount[label] += 1
+                a2.useCount[label2] += 1
+                if k == E.SUCCESS:
+                    a1.successCount[label] += 1
+                    a2.successCount[label2] += 1
+            elif k == E.SHIFT:
+                inv = agents[agent-1].inv
+                inv.place(inv.rows[label], arts[a], forms[a], percs[a])
+            elif k == E.RANDOM or k == E.NEW:
+                inv = agents[agent-1].inv
+                vow = deboer.Vowel(sim)
+                vow.label = inv.newLabel()
+                if vow.label != label:
+                    raise ValueError("event log %s doesn't follow on from the start of run %d: agent %d adds vowel %d at interaction %d, not %d" % (logFile, run, agent, label, t, vow.label))
+                vow.place(arts[a], forms[a], percs[a])
+                inv.add(vow)
+            elif k == E.DISCARD:
+                agents[agent-1].inv.remove(label)
+            elif k == E.MERGE:
+                ag = agents[agent-1]
+                ag.successCount[label] += ag.successCount[label2]
+                ag.useCount[label] += ag.useCount[label2]
+                ag.inv.remove(label2)
+            elif k == E.END:
+                while nextStore < len(storeIts) and storeIts[nextStore] <= t:
+                    yield run, storeIts[nextStore], agents
+                    nextStore += 1
+                if label and t not in storeIts:
+                    yield run, t, agents
+                nextStore = len(storeIts)
+
+## the agents of run runNum after interaction time, from event log
+## logFile (a Population with flatPopulation), or None if the run
+## doesn't go on that long
+def populationAt(logFile, runNum, time, flatPopulation=False):
+    sim = logSimulation(logFile, flatPopulation=flatPopulation)
+    for run, t, agents in states(sim, logFile, [time], [runNum]):
+        if t == time:
+            return agents
+
+## replay the game logged in event log logFile, writing snapshots (or
+## summaries) as game would for simulation logSimulation(logFile,
+## **changes): to fileName, if given; else returned as game returns
+## them.
+def replay(logFile, fileName=None, **changes):
+    sim = logSimulation(logFile, **changes)
+    w = deboer.openOutput(sim, fileName)
+    run = None
+    for runNum, t, agents in states(sim, logFile, deboer.storeTimes(sim)):
+        if runNum != run:
+            run = runNum
+            ## the same agents as the game wrote
+            rng = deboer.RandomStream(deboer.runSeed(sim.seed, runNum), sim.nAgents, sim.noise)
+            sample = rng.sample(sim.nAgents, sim.snapshotAgents) if 0 < sim.snapshotAgents < sim.nAgents else None
+        w.write(runNum, t, agents, sample)
+    w.close()
+    if sim.convergeWindow > 0 and fileName is not None:
+        writeStops(logFile, fileName)
+    if fileName is None:
+        return w.result()
+
+## write where each run logged in event log logFile stopped (from their
+## END events) to deboer.stopFile(fileName), as the game does
+def writeStops(logFile, fileName):
+    stops = deboer.StopLog(fileName)
+    for chunk in deboer.readEvents(logFile):
+        end = chunk['kind'] == deboer.EventLog.END
+        for run, t, converged in zip(chunk['run'][end].tolist(), chunk['time'][end].tolist(), chunk['label'][end].tolist()):
+            stops.write(run, t, converged)
+    stops.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = 'write snapshots of a deboer.py game from its event log')
+    parser.add_argument('logFile', help = 'event log (.events.npz) written by deboer.py --eventLog')
+    parser.add_argument('csvF', help = '.csv file to write snapshots to (or .npz: see --outFormat)')
+    parser.add_argument('--storeIvl', type=int, default=None, help = 'write a snapshot every storeIvl interactions (default: as in the logged game)')
+    parser.add_argument('--snapshotAgents', type=int, default=None, help = 'write only this many agents to each snapshot, the same ones as the game would (default: as in the logged game)')
+    parser.add_argument('--summaries', choices=['none', 'both', 'only'], default=None, help = 'write summaries of the population too, or instead, as deboer.py --summaries (default: as in the logged game)')
+    parser.add_argument('--clusterRadius', type=float, default=None, help = 'with --summaries, perceptual distance within which prototypes are clustered together (default: as in the logged game)')
+    parser.add_argument('--outFormat', choices=['csv', 'npz'], default=None, help = 'output format (default: npz if the output file ends in .npz, else csv)')
+    parser.add_argument('--flatPopulation', action='store_true', help = 'keep the agents in one set of flat arrays, for very large populations (default: false)')
+    args = parser.parse_args(argv)
+
+    changes = dict((name, getattr(args, name)) for name in replayParams if getattr(args, name, None) is not None)
+    changes['outFormat'] = args.outFormat
+    try:
+        start = time.time()
+        replay(args.logFile, args.csvF, **changes)
+    except ValueError as e:
+        parser.error(str(e))
+    print "replayed %s in %.1f s" % (args.logFile, time.time() - start)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())